@@ -1,37 +1,56 @@
 # написать комментарии к каждому модулю программы
 
+import logging
 import os
+import time
 from datetime import datetime
-from io import BytesIO
-import pandas as pd
-import psycopg2
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, send_file, jsonify, session, redirect, url_for, make_response
-from psycopg2.extras import execute_values
-from waitress import serve
-from openpyxl.styles import NamedStyle
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g, make_response
+from db import connect, get_db_connection, get_pool, pool_enabled
+import checkout
+import commands
+import dim_cache
+import export
+import ingest
+import jobs
+import metrics
+import reports
+import reservations
+import response_cache
+import serve
+import stock_search
+import upload_reader
 
 # Загружаем переменные окружения
 load_dotenv() # Загрузка переменных окружения из файла .env
 
 app = Flask(__name__) # Создаем экземпляр приложения Flask
 app.secret_key = os.getenv('SECRET_KEY') # Устанавливаем секретный ключ для сессий
+app.cli.add_command(commands.warehouse) # Команды обслуживания БД: flask --app app warehouse ...
+
+# Сброс кэша справочников и версии данных по сигналам других процессов (DIM_CACHE_NOTIFY=1)
+if dim_cache.notify_enabled():
+    dim_cache.start_listener(connect, handlers={response_cache.NOTIFY_CHANNEL: response_cache.invalidate})
+
+# Время ответа и запросы к БД каждого HTTP-запроса (см. /metrics)
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.begin_scope()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.finish_request(request.endpoint or 'not_found', request.method, response.status_code,
+                               time.perf_counter() - started)
+    return response
 
 @app.context_processor
 def inject_user():
     # Передаем логин пользователя в шаблоны, если он вошел в систему
     return {'user_logged_in': 'username' in session, 'username': session.get('username')}
 
-# функция для подключения к БД
-def get_db_connection():
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
-    )
-    return conn
-
 def execute_query(query, params=None):
     """Выполняет запрос к базе данных PostgreSQL и возвращает результат."""
     conn = get_db_connection()
@@ -49,58 +68,6 @@ def execute_query(query, params=None):
 
     return result
 
-def execute_query2(query, params=None):
-    """Выполняет запрос к базе данных PostgreSQL и возвращает результат."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(query, params)
-            if query.strip().lower().startswith("select"):
-                result = cur.fetchall()
-            elif "returning" in query.lower():
-                result = cur.fetchone()  # Получаем возвращаемый результат
-                conn.commit()
-            else:
-                conn.commit()
-                result = None
-    finally:
-        conn.close()
-    return result
-
-
-# функция для преобразования данных для БД
-def get_reference_id(table_name, column_name, value):
-    query = f"SELECT id FROM {table_name} WHERE {column_name} = %s"
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, (value,))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    return result[0] if result else None
-
-
-def get_or_create_id(table, column, value):
-    """Возвращает id из вспомогательной таблицы, добавляя запись, если она отсутствует."""
-    select_query = f"SELECT id FROM {table} WHERE {column} = %s" # SQL-запрос для поиска записи
-
-    result = execute_query(select_query, (value,)) # Выполняем запрос
-
-    if result:
-        return result[0][0]
-    #print(result)
-    # Если записи нет, добавляем ее
-    insert_query = f"INSERT INTO {table} ({column}) VALUES (%s) RETURNING id"
-    print(f"Inserting value: {value}")
-        # Выполняем запрос
-    new_id = execute_query2(insert_query, (value,))
-    print(f"Insert value: {value}")
-    # Проверяем, что результат не None
-    if new_id and new_id[0]:
-        return new_id[0]
-    else:
-        raise ValueError(f"Failed to insert value '{value}' into table '{table}'")
-
 # Стартовая страница
 @app.route('/')
 def home():
@@ -108,324 +75,195 @@ def home():
 
 
 
+def process_upload(kind):
+    """Прием файла прихода/расхода/возврата.
+
+    По умолчанию файл ставится в очередь фоновой загрузки и клиент получает id задания
+    (ход выполнения - /jobs/<id>). С IMPORT_ASYNC=0 или ?sync=1 файл загружается сразу.
+    С ?dry_run=1 файл только проверяется: в ответе отчет об ошибках по строкам, БД не меняется.
+    Повторно загруженный файл и уже загруженные строки пропускаются (см. fingerprints.py).
+    """
+    file = request.files['file']
+    if not file:
+        return jsonify({"error": "Файл не выбран"}), 400
+
+    # Имя загружаемого файла
+    file_name = file.filename
+    user_id = session.get('user_id')  # ID пользователя из сессии
+    dry_run = request.args.get('dry_run') == '1'
+    try:
+        # Ход задания виден только его владельцу, поэтому без входа файл загружается сразу
+        if jobs.async_enabled() and user_id and request.args.get('sync') != '1':
+            job_id = jobs.manager.submit(kind, file, file_name, user_id, dry_run)
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status_url": url_for('job_status', job_id=job_id),
+                "message": "Файл принят в обработку"
+            }), 202
+
+        # Файл читается порциями, все порции загружаются одной транзакцией
+        report = ingest.run_upload(kind, file, file_name, user_id, dry_run=dry_run)
+        if report["duplicate_of"]:
+            message = f"Этот файл уже загружен {report['duplicate_of']['created_at']}: данные не изменены"
+            return jsonify({"success": True, "message": message, "report": report}), 200
+        if dry_run:
+            message = "Ошибок не найдено" if report["error_count"] == 0 else "В файле есть ошибки"
+            return jsonify({"success": report["error_count"] == 0, "message": message, "report": report}), 200
+        return jsonify({"success": True, "message": "Данные успешно загружены в БД", "report": report}), 200
+    except ingest.UploadValidationError as e:
+        return jsonify({"error": str(e), "missing": e.missing, "report": e.report.as_dict()}), 400
+    except upload_reader.UploadFormatError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # Страница поступления (inflow)
 @app.route('/inflow', methods=['GET', 'POST'])
 def inflow():
     if request.method == 'POST':
-        file = request.files['file']
-        if not file:
-            return jsonify({"error": "Файл не выбран"}), 400
-
-        try:
-            # Имя загружаемого файла
-            file_name = file.filename
-            # Загрузка данных из Excel
-            df = pd.read_excel(file, header=0)
-            #print(df.info())
-            df['Приход Wafer, шт.'] = df['Приход Wafer, шт.'].fillna(0).astype(int)
-            df['Приход GelPack, шт.'] = df['Приход GelPack, шт.'].fillna(0).astype(int)
-            df['Приход общий, шт.'] = df['Приход общий, шт.'].fillna(0).astype(int)
-            # Преобразование данных в список кортежей для вставки
-            for _, row in df.iterrows():
-                data_to_insert = []
-                id_start = int(get_or_create_id("start_p", "name_start", str(row["Номер запуска"])))
-                #print('id_start', id_start, str(row["Номер запуска"]))
-                id_pr = int(get_or_create_id("pr", "name_pr", str(row["Производитель"])))
-                #print('id_pr',id_pr, str(row["Производитель"]))
-                id_tech = int(get_or_create_id("tech", "name_tech", str(row["Технологический процесс"])))
-                #print('id_tech', id_tech, str(row["Технологический процесс"]))
-                id_lot = int(get_or_create_id("lot", "name_lot", str(row['Партия (Lot ID)'])))
-                #print('id_lot',id_lot, str(row['Партия (Lot ID)']))
-                id_wafer = int(get_or_create_id("wafer", "name_wafer", str(row['Пластина (Wafer)'])))
-                #print('id_wafer',id_wafer, str(row['Пластина (Wafer)']))
-                id_quad = int(get_or_create_id("quad", "name_quad", str(row['Quadrant'])))
-                #print('id_quad',id_quad, str(row['Quadrant']))
-                id_in_lot = int(get_or_create_id("in_lot", "in_lot", str(row['Внутренняя партия'])))
-                #print('id_in_lot',id_in_lot, str(row['Внутренняя партия']))
-                id_chip = int(get_or_create_id("chip", "name_chip", str(row['Номер кристалла'])))
-                #print('id_chip',id_chip, str(row['Номер кристалла']))
-                id_n_chip = int(get_or_create_id("n_chip", "n_chip", str(row['Шифр кристалла'])))
-                #print('id_n_chip',id_n_chip, str(row['Шифр кристалла']))
-                id_size = get_or_create_id("size_c", "size", str(row['Размер кристалла']))
-                #print('id_size',id_size, str(row['Размер кристалла']))
-                id_pack = int(get_or_create_id("pack", "name_pack", str(row["Упаковка"])))
-                #print('id_pack',id_pack, str(row["Упаковка"]))
-                id_stor = int(get_or_create_id("stor", "name_stor", str(row['Место хранения'])))
-                #print('id_stor',id_stor, str(row['Место хранения']))
-                id_cells = int(get_or_create_id("cells", "name_cells", str(row["Ячейка хранения"])))
-                #print('id_cells',id_cells, str(row["Ячейка хранения"]))
-                data_to_insert.append((
-                    id_start, id_tech,  id_chip, id_lot, id_wafer, id_quad, id_in_lot,
-                    row['Дата прихода'], row['Приход Wafer, шт.'], row['Примечание'], id_pack, id_cells, id_n_chip,
-                    id_pr, id_size, row['Приход GelPack, шт.'], id_stor
-                ))
-
-                # SQL-запрос для добавления данных в таблицу invoice
-                insert_query = """
-                    INSERT INTO invoice (
-                    id_start, id_tech, id_chip, id_lot, id_wafer, id_quad, id_in_lot, date, quan_w, 
-                    note, id_pack, id_cells, id_n_chip, id_pr, id_size, quan_gp, id_stor
-                    ) VALUES %s
-                    ON CONFLICT (id)
-                    DO UPDATE SET
-                        date = EXCLUDED.date,
-                        quan_w = EXCLUDED.quan_w,
-                        quan_gp = EXCLUDED.quan_gp,
-                        note = EXCLUDED.note                    
-                """
-
-                # Вставка данных с использованием execute_values для оптимизации
-                conn = get_db_connection()
-                with conn.cursor() as cur:
-                    execute_values(cur, insert_query, data_to_insert)
-                conn.commit()
-                conn.close()
-            # Логирование
-            log_user_action(
-                user_id=session.get('user_id'),  # ID пользователя из сессии
-                action_type='Загрузка файла: Приход',
-                file_name=file_name,
-                target_table='invoice'  # Название таблицы
-            )
-
-            return jsonify({"success": True, "message": "Данные успешно загружены в БД"}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        return process_upload('inflow')
     return render_template('inflow.html')
 
 # Страница расхода (outflow)
 @app.route('/outflow', methods=['GET', 'POST'])
 def outflow():
     if request.method == 'POST':
-        file = request.files['file']
-        if not file:
-            return jsonify({"error": "Файл не выбран"}), 400
-
-        try:
-            # Имя загружаемого файла
-            file_name = file.filename
-            # Загрузка данных из Excel
-            data = pd.read_excel(file, header=0)
-            data['Расход Wafer, шт.'] = data['Расход Wafer, шт.'].fillna(0).astype(int)
-            data['Расход GelPack, шт.'] = data['Расход GelPack, шт.'].fillna(0).astype(int)
-            data['Место хранения'] = data['Место хранения'].fillna('-')
-            data['Ячейка хранения'] = data['Ячейка хранения'].fillna('-')
-            for _, row in data.iterrows():
-                data_to_insert = []
-                # Извлечение данных из строки Excel
-                id_start = int(get_reference_id("start_p", "name_start", str(row["Номер запуска"])))
-                id_pr = int(get_reference_id("pr", "name_pr", str(row["Производитель"])))
-                id_tech = int(get_reference_id("tech", "name_tech", str(row["Технологический процесс"])))
-                id_lot = int(get_reference_id("lot", "name_lot", str(row["Партия (Lot ID)"])))
-                id_wafer = int(get_reference_id("wafer", "name_wafer", str(row["Пластина (Wafer)"])))
-                id_quad = int(get_reference_id("quad", "name_quad", str(row["Quadrant"])))
-                id_in_lot = int(get_reference_id("in_lot", "in_lot", str(row["Внутренняя партия"])))
-                id_n_chip = int(get_reference_id("n_chip", "n_chip", str(row["Шифр кристалла"])))
-                cons_w = int(row["Расход Wafer, шт."])
-                cons_gp = int(row["Расход GelPack, шт."])
-                note = str(row["Примечание"])
-                transf_man = str(row["Куда передано (Производственная партия)"])
-                reciver = str(row["ФИО"])
-                id_stor = int(get_reference_id("stor", "name_stor", str(row['Место хранения'])))
-                id_cells = int(get_reference_id("cells", "name_cells", str(row["Ячейка хранения"])))
-                data_to_insert.append((
-                id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip,
-                row["Дата расхода"], cons_w, cons_gp, note, transf_man, reciver, id_stor, id_cells
-                ))
-                # SQL-запрос для вставки данных в таблицу "consumption"
-                query = """
-                    INSERT INTO consumption (
-                        id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip,
-                        date, cons_w, cons_gp, note, transf_man, reciver, id_stor, id_cells
-                    ) VALUES %s
-                """
-
-                # Вставка данных с использованием execute_values для оптимизации
-                conn = get_db_connection()
-                with conn.cursor() as cur:
-                    execute_values(cur, query, data_to_insert)
-                conn.commit()
-                conn.close()
-            # Логирование
-            log_user_action(
-                user_id=session.get('user_id'),  # ID пользователя из сессии
-                action_type='Загрузка файла: Расход',
-                file_name=file_name,
-                target_table='consumption'  # Название таблицы
-            )
-            return jsonify({"success": True, "message": "Данные успешно загружены в БД"}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        return process_upload('outflow')
     return render_template('outflow.html')
 
-# Страница расхода (outflow)
+# Страница возврата (refund)
 @app.route('/refund', methods=['GET', 'POST'])
 def refund():
     if request.method == 'POST':
-        file = request.files['file']
-        if not file:
-            return jsonify({"error": "Файл не выбран"}), 400
-
-        try:
-            # Имя загружаемого файла
-            file_name = file.filename
-            # Загрузка данных из Excel
-            data = pd.read_excel(file, header=0)
-            data['Возврат Wafer, шт.'] = data['Возврат Wafer, шт.'].fillna(0).astype(int)
-            data['Возврат GelPack, шт.'] = data['Возврат GelPack, шт.'].fillna(0).astype(int)
-            data['Место хранения'] = data['Место хранения'].fillna('-')
-            data['Ячейка хранения'] = data['Ячейка хранения'].fillna('-')
-
-            for _, row in data.iterrows():
-                data_to_insert = []
-                # Извлечение данных из строки Excel
-                id_start = int(get_reference_id("start_p", "name_start", str(row["Номер запуска"])))
-                id_pr = int(get_reference_id("pr", "name_pr", str(row["Производитель"])))
-                id_tech = int(get_reference_id("tech", "name_tech", str(row["Технологический процесс"])))
-                id_lot = int(get_reference_id("lot", "name_lot", str(row["Партия (Lot ID)"])))
-                id_wafer = int(get_reference_id("wafer", "name_wafer", str(row["Пластина (Wafer)"])))
-                id_quad = int(get_reference_id("quad", "name_quad", str(row["Quadrant"])))
-                id_in_lot = int(get_reference_id("in_lot", "in_lot", str(row["Внутренняя партия"])))
-                id_n_chip = int(get_reference_id("n_chip", "n_chip", str(row["Шифр кристалла"])))
-                quan_w = int(row['Возврат Wafer, шт.'])
-                quan_gp = int(row['Возврат GelPack, шт.'])
-                note = "возврат"
-                id_stor = int(get_reference_id("stor", "name_stor", str(row['Место хранения'])))
-                id_cells = int(get_reference_id("cells", "name_cells", str(row["Ячейка хранения"])))
-                data_to_insert.append((
-                id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip,
-                row["Дата возврата"], quan_w, quan_gp, str(note), id_stor, id_cells
-                ))
-
-                # SQL-запрос для вставки данных в таблицу "consumption"
-                query = """
-                    INSERT INTO invoice (
-                        id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip,
-                        date, quan_w, quan_gp, note, id_stor, id_cells
-                    ) VALUES %s
-                """
-
-                # Вставка данных с использованием execute_values для оптимизации
-                conn = get_db_connection()
-                try:
-                    with conn.cursor() as cur:
-                        # Печать данных для отладки
-
-                        execute_values(cur, query, data_to_insert)
-                    conn.commit()  # Фиксация изменений в базе данных
-
-                except Exception as e:
-                    conn.rollback()  # Откат транзакции при ошибке
-                    print("Ошибка при вставке данных:", e)
-                    return jsonify({"error": str(e)}), 500
-                finally:
-                    conn.close()
-                # Логирование
-                log_user_action(
-                    user_id=session.get('user_id'),  # ID пользователя из сессии
-                    action_type='Загрузка файла: Возврат',
-                    file_name=file_name,
-                    target_table='invoice'  # Название таблицы
-                )
-            return jsonify({"success": True, "message": "Данные успешно загружены в БД"}), 200
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        return process_upload('refund')
     return render_template('refund.html')
 
-@app.route('/search', methods=['GET', 'POST'])
-def search():
-    # Если только загрузка страницы
-    if request.method == 'GET' and not request.args.get('chip_name'):
-        # Получить список всех производителей для фильтра
+# Состояние фонового задания загрузки
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({"error": "Пользователь не авторизован"}), 401
+    job = jobs.manager.get(job_id)
+    # Чужое задание не отличается от несуществующего
+    if job is None or job["user_id"] != session['user_id']:
+        return jsonify({"error": "Задание не найдено"}), 404
+    return jsonify(job)
+
+def get_manufacturers():
+    """Список производителей для фильтра поиска (из кэша справочников)."""
+    def load():
         manufacturers_query = "SELECT DISTINCT name_pr FROM pr ORDER BY name_pr"
-        manufacturers_raw = execute_query(manufacturers_query)
         # Преобразуем кортежи в список строк
-        manufacturers = [row[0] for row in manufacturers_raw]
-        return render_template('search.html', manufacturers=manufacturers)
+        return [row[0] for row in execute_query(manufacturers_query)]
+    return dim_cache.cache.names_list('pr', load)
+
+def search_first_page(cur, chip_name, manufacturer_filter, page_size=stock_search.PAGE_SIZE):
+    """Первая страница поиска и число найденных позиций (точное, если страница одна)."""
+    rows, next_cursor = stock_search.fetch_page(cur, chip_name, manufacturer_filter, page_size=page_size)
+    if next_cursor is None:
+        total = len(rows)
+    else:
+        total = max(stock_search.estimate_count(cur, chip_name, manufacturer_filter), len(rows))
+    return rows, next_cursor, total
 
-    if request.method == 'POST':
-        if 'user_id' not in session:
-            return redirect(url_for('login'))
-        manufacturers_query = "SELECT DISTINCT name_pr FROM pr ORDER BY name_pr"
-        manufacturers_raw = execute_query(manufacturers_query)
-        # Преобразуем кортежи в список строк
-        manufacturers = [row[0] for row in manufacturers_raw]
-        chip_name = request.form.get('chip_name', '').strip()
-        manufacturer_filter = request.form.get('manufacturer', '')
+def search_page(version, chip_name, manufacturer_filter, cursor=None, page_size=stock_search.PAGE_SIZE):
+    """Страница поиска (строки, курсор следующей страницы, оценка количества) через кэш результатов.
 
+    Пока версия данных склада не изменилась, повторный поиск не обращается к БД.
+    Оценка количества считается только для первой страницы.
+    """
+    def load():
         conn = get_db_connection()
-        cur = conn.cursor()
-        query = """
-                WITH consumption_aggregated AS (SELECT id_n_chip,id_quad, item_id, SUM(cons_w) AS total_cons_w, SUM(cons_gp) AS total_cons_gp
-                    FROM consumption
-                    GROUP BY id_n_chip, id_quad, item_id
-                ),
-                invoice_aggregated AS (SELECT id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad, item_id, SUM(quan_w) AS total_quan_w, SUM(quan_gp) AS total_quan_gp, invoice.note, invoice.id_cells, invoice.id_stor
-                    FROM invoice
-                    GROUP BY id_start, id_pr, id_tech, id_wafer, id_quad, id_lot, id_in_lot, id_n_chip, item_id, invoice.note, invoice.id_cells, invoice.id_stor
-                )
-                SELECT i.item_id, 
-                    i.id_start,
-                    s.name_start,
-                    p.name_pr,
-                    t.name_tech,
-                    w.name_wafer,
-                    q.name_quad,
-                    l.name_lot,
-                    il.in_lot,
-                    nc.n_chip, 
-                    (i.total_quan_w - COALESCE(cons.total_cons_w, 0)) AS ostatok_w, 
-                    (i.total_quan_gp - COALESCE(cons.total_cons_gp, 0)) AS ostatok_gp,
-                    i.note,
-                    st.name_stor,
-                    c.name_cells
-                    FROM invoice_aggregated i
-                LEFT JOIN consumption_aggregated cons ON cons.item_id = i.item_id
-                LEFT JOIN n_chip nc ON nc.id = i.id_n_chip  
-                LEFT JOIN quad q ON q.id = i.id_quad  
-                LEFT JOIN start_p s ON s.id = i.id_start
-                LEFT JOIN tech t ON t.id = i.id_tech
-                LEFT JOIN pr p ON p.id = i.id_pr
-                LEFT JOIN wafer w ON w.id = i.id_wafer 
-                LEFT JOIN lot l ON l.id = i.id_lot
-                LEFT JOIN in_lot il ON il.id = i.id_in_lot
-                LEFT JOIN stor st ON st.id = i.id_stor
-                LEFT JOIN cells c ON c.id = i.id_cells
-                WHERE 1=1
-        """
-        # Добавить фильтр по производителю, если выбран
-        params = []
-        if chip_name:
-            query += " AND nc.n_chip ILIKE %s"
-            params.append(f"%{chip_name}%")
-
-        if manufacturer_filter and manufacturer_filter != "all":
-            query += " AND p.name_pr = %s"
-            params.append(manufacturer_filter)
-
-        #print(query, manufacturer_filter)
-        # Добавить поиск по запросу, если задан
-        # if query_f:
-        #     query += " AND (start_p.name_start ILIKE %s OR lot.name_lot ILIKE %s)"
-        #     params.extend([f"%{query}%", f"%{query}%"])
-
         try:
-            cur.execute(query, params)
-            results = cur.fetchall()
-            #print(f"Query results: {results}")
-        except Exception as e:
-            print(f"Error executing query: {e}")
+            with conn.cursor() as cur:
+                if cursor:
+                    rows, next_cursor = stock_search.fetch_page(
+                        cur, chip_name, manufacturer_filter, cursor=cursor, page_size=page_size)
+                    return rows, next_cursor, None
+                return search_first_page(cur, chip_name, manufacturer_filter, page_size)
         finally:
-            cur.close()
             conn.close()
+    return response_cache.cached(version, ('search', chip_name, manufacturer_filter, cursor, page_size), load)
 
-            return render_template('search.html', results=results,
-                manufacturers=manufacturers,
-                query=chip_name,
-                manufacturer_filter=manufacturer_filter
-            )
+def conditional_response(tag, build):
+    """Ответ с ETag: если у клиента та же версия (If-None-Match), 304 без вызова build()."""
+    if tag is not None and request.method == 'GET' and tag in request.if_none_match:
+        response = Response(status=304)
     else:
-        return render_template('search.html')  # Выводим страницу поиска для GET-запроса
+        response = make_response(build())
+        if tag is None or request.method != 'GET' or response.status_code != 200:
+            return response
+    response.set_etag(tag)
+    # Браузер хранит ответ, но перед показом всегда сверяет ETag с сервером
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+    # Форма поиска отправляется GET-запросом, поэтому браузер может сверить ETag; POST оставлен для старых ссылок
+    params = request.form if request.method == 'POST' else request.args
+    chip_name = params.get('chip_name', '').strip()
+    manufacturer_filter = params.get('manufacturer', '')
+    searching = request.method == 'POST' or 'chip_name' in request.args
+    if searching and 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    # Страница зависит от пользователя (логин в шапке), поэтому он входит в ETag
+    version = response_cache.version()
+    tag = response_cache.etag(version, 'search', session.get('user_id'), session.get('username'),
+                              searching, chip_name, manufacturer_filter)
+
+    def build():
+        # Список всех производителей для фильтра
+        manufacturers = get_manufacturers()
+        if not searching:
+            return render_template('search.html', manufacturers=manufacturers)
+
+        # Остатки читаются из таблицы stock_balance постранично: здесь только первая страница,
+        # следующие страницы подгружаются со страницы через /api/search
+        results, next_cursor, total = [], None, 0
+        try:
+            results, next_cursor, total = search_page(version, chip_name, manufacturer_filter)
+        except Exception as e:
+            app.logger.error(f"Ошибка поиска: {e}")
+
+        return render_template('search.html', results=results,
+            manufacturers=manufacturers,
+            query=chip_name,
+            manufacturer_filter=manufacturer_filter,
+            next_cursor=next_cursor,
+            total=total
+        )
+
+    return conditional_response(tag, build)
+
+# Постраничная выдача результатов поиска в JSON (курсор - item_id последней строки)
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Пользователь не авторизован'}), 401
+    chip_name = request.args.get('chip_name', '').strip()
+    manufacturer_filter = request.args.get('manufacturer', '')
+    cursor = request.args.get('cursor')
+    page_size = stock_search.page_size_from(request.args.get('page_size'))
+    version = response_cache.version()
+    tag = response_cache.etag(version, 'api_search', chip_name, manufacturer_filter, cursor, page_size)
+
+    def build():
+        try:
+            rows, next_cursor, total = search_page(version, chip_name, manufacturer_filter, cursor, page_size)
+        except stock_search.InvalidCursorError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        return jsonify({
+            'success': True,
+            'items': [stock_search.row_to_dict(row) for row in rows],
+            'next_cursor': next_cursor,
+            'total_estimate': total,
+        })
+
+    return conditional_response(tag, build)
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
@@ -438,51 +276,58 @@ def add_to_cart():
     item_id = data.get('item_id')
     quantity_w = data.get('quantity_w', 0)
     quantity_gp = data.get('quantity_gp', 0)
-    start = data.get('launch')
-    manufacturer = data.get('manufacturer')
-    technology = data.get('technology')
-    lot = data.get('lot')
-    wafer = data.get('wafer')
-    quadrant = data.get('quadrant')
-    internal_lot = data.get('internal_lot')
-    chip_code = data.get('chip_code')
-    note=data.get('note')
-    stor=data.get('stor')
-    cells=data.get('cells')
-    cons_w = data.get('quantity_w', 0)
-    cons_gp = data.get('quantity_gp', 0)
     date_added = datetime.now().strftime('%Y-%m-%d')  # Текущая дата
+    try:
+        cons_w = reservations.quantity(quantity_w)
+        cons_gp = reservations.quantity(quantity_gp)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Неверное количество'}), 400
 
-    if not item_id or (quantity_w == 0 and quantity_gp == 0):
+    if not item_id or (cons_w == 0 and cons_gp == 0):
         return jsonify({'success': False, 'message': 'Недостаточно данных для добавления в корзину'}), 400
 
+    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
 
+        # Остаток позиции блокируется до COMMIT: одновременные добавления не зарезервируют
+        # больше, чем есть на складе
+        reservations.reserve(cur, item_id, cons_w, cons_gp)
+
+        # Корзина хранит только позицию и количества, названия берутся при чтении (cart_view)
         query = """
-            INSERT INTO cart (user_id, item_id, cons_w, cons_gp, manufacturer, technology, lot, wafer, quadrant, internal_lot, chip_code, date_added, start, note, stor, cells)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO cart (user_id, item_id, cons_w, cons_gp, date_added)
+            VALUES (%s, %s, %s, %s, %s)
             ON CONFLICT (user_id, item_id) 
             DO UPDATE SET 
                 cons_w = cart.cons_w + EXCLUDED.cons_w,
                 cons_gp = cart.cons_gp + EXCLUDED.cons_gp;
         """
-        cur.execute(query, (user_id, item_id, cons_w, cons_gp, manufacturer, technology, lot, wafer, quadrant, internal_lot, chip_code, date_added, start, note, stor, cells))
+        cur.execute(query, (user_id, item_id, cons_w, cons_gp, date_added))
         conn.commit()
 
         cur.close()
-        conn.close()
         return jsonify({'success': True, 'message': 'Товар добавлен в корзину'})
+    except reservations.InsufficientStockError as e:
+        return jsonify({'success': False, 'message': str(e),
+                        'available_w': e.available_w, 'available_gp': e.available_gp}), 409
+    except reservations.UnknownItemError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
     except Exception as e:
-        print(f"Ошибка добавления в корзину: {e}")
+        app.logger.error(f"Ошибка добавления в корзину: {e}")
         return jsonify({'success': False, 'message': 'Ошибка сервера'}), 500
+    finally:
+        if conn is not None:
+            conn.close()
 
 
-@app.route('/cart', methods=['GET'])
-def cart():
-    # SQL-запрос для извлечения данных из таблицы "cart"
-    query = """
+# Содержимое корзины пользователя; порядок столбцов совпадает с индексами row[...] в cart.html
+CART_COLUMNS = [
+    "item_id", "user_id", "start", "manufacturer", "technology", "wafer", "quadrant", "lot",
+    "internal_lot", "chip_code", "note", "stor", "cells", "date_added", "cons_w", "cons_gp",
+]
+CART_QUERY = """
     SELECT 
         item_id, 
         user_id,
@@ -500,15 +345,50 @@ def cart():
         date_added,
         cons_w,
         cons_gp
-    FROM cart
+    FROM cart_view
     WHERE user_id = %s
-    """
+    ORDER BY item_id
+"""
+
+@app.route('/cart', methods=['GET'])
+def cart():
     user_id = session.get('user_id')  # Предполагается, что пользователь вошел в систему
-    results = execute_query(query, (user_id,))  # Получаем данные из БД для текущего пользователя
+    results = execute_query(CART_QUERY, (user_id,))  # Получаем данные из БД для текущего пользователя
 
     # Передаем данные в шаблон
     return render_template('cart.html', results=results)
 
+# Пакет операций с корзиной (add/update/remove) одной транзакцией; в ответе - новое содержимое корзины
+@app.route('/cart/batch', methods=['POST'])
+def cart_batch():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Пользователь не авторизован'}), 401
+    ops = (request.get_json(silent=True) or {}).get('ops')
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            counts = reservations.apply_batch(cur, user_id, ops, datetime.now().date())
+            cur.execute(CART_QUERY, (user_id,))
+            rows = cur.fetchall()
+        conn.commit()
+    except reservations.BatchError as e:
+        conn.rollback()
+        return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 409 if e.conflict else 400
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Ошибка изменения корзины: {e}")
+        return jsonify({'success': False, 'message': 'Ошибка сервера'}), 500
+    finally:
+        conn.close()
+    cart_items = []
+    for row in rows:
+        item = dict(zip(CART_COLUMNS, row))
+        if hasattr(item['date_added'], 'isoformat'):
+            item['date_added'] = item['date_added'].isoformat()
+        cart_items.append(item)
+    return jsonify({'success': True, **counts, 'cart': cart_items})
+
 @app.route('/remove_from_cart', methods=['POST'])
 def remove_from_cart():
     data = request.get_json()
@@ -519,7 +399,6 @@ def remove_from_cart():
 
     query = "DELETE FROM cart WHERE item_id = %s AND user_id = %s"
     user_id = session.get('user_id')  # Получаем ID текущего пользователя
-    print(user_id)
     try:
         execute_query(query, (item_id, user_id))
         return jsonify({'success': True})
@@ -535,16 +414,39 @@ def update_cart_item():
     if not item_id or cons_w is None or cons_gp is None:
         return jsonify({"success": False, "message": "Неполные данные"}), 400
 
-    query = """
-    UPDATE cart
-    SET cons_w = %s, cons_gp = %s
-    WHERE item_id = %s
-    """
     try:
-        execute_query(query, (cons_w, cons_gp, item_id))
+        cons_w = reservations.quantity(cons_w)
+        cons_gp = reservations.quantity(cons_gp)
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Неверное количество"}), 400
+
+    user_id = session.get('user_id')
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            found = reservations.set_quantity(cur, user_id, item_id, cons_w, cons_gp)
+        conn.commit()
+        if not found:
+            return jsonify({"success": False, "message": "Позиции нет в корзине"}), 404
         return jsonify({"success": True})
+    except reservations.InsufficientStockError as e:
+        return jsonify({"success": False, "message": str(e),
+                        "available_w": e.available_w, "available_gp": e.available_gp}), 409
+    except reservations.UnknownItemError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
+    finally:
+        conn.close()
+
+def export_response(fmt, header, rows, file_name):
+    """Потоковый ответ с файлом выгрузки: данные отдаются по мере чтения из БД."""
+    if fmt not in export.FORMATS:
+        fmt = 'xlsx'
+    response = Response(stream_with_context(export.iter_export(fmt, header, rows)),
+                        mimetype=export.FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename={file_name}.{fmt}"
+    return response
 
 @app.route('/export_cart', methods=['GET'])
 def export_cart():
@@ -552,88 +454,93 @@ def export_cart():
     if not user_id:
         return "Необходимо войти в систему для экспорта корзины", 401
 
-    # SQL-запрос для извлечения данных из корзины
-    query = """
-    SELECT 
-        start AS "Номер запуска",
-        manufacturer AS "Производитель",
-        technology AS "Технологический процесс",
-        lot AS "Партия (Lot ID)",
-        wafer AS "Пластина (Wafer)",
-        quadrant AS "Quadrant",
-        internal_lot AS "Внутренняя партия",
-        chip_code AS "Шифр кристалла",
-        note AS "Примечание",
-        stor AS "Место хранения",
-        cells AS "Ячейка хранения",
-        date_added AS "Дата расхода",
-        cons_w AS "Расход Wafer, шт.",
-        cons_gp AS "Расход GelPack, шт."
-    FROM cart
-    WHERE user_id = %s
-    """
-    results = execute_query(query, (user_id,))
-
-    if not results:
+    if not execute_query("SELECT EXISTS (SELECT 1 FROM cart WHERE user_id = %s)", (user_id,))[0][0]:
         return "Корзина пуста. Нет данных для экспорта.", 404
 
-    columns = [
-        "Номер запуска", "Производитель", "Технологический процесс", "Партия (Lot ID)", "Пластина (Wafer)",
-        "Quadrant", "Внутренняя партия", "Шифр кристалла", "Дата расхода",
-        "Расход Wafer, шт.", "Расход GelPack, шт.", "Расход общий, шт.", "Дата возврата",
-        "Возврат Wafer, шт.", "Возврат GelPack, шт.", "Возврат общий, шт.",
-        "Примечание", "Куда передано (Производственная партия)", "ФИО", "Место хранения", "Ячейка хранения"
-    ]
-    # Столбцы, которые заполняются из SQL-запроса
-    filled_columns = [
-        "Номер запуска", "Производитель", "Технологический процесс", "Партия (Lot ID)", "Пластина (Wafer)",
-        "Quadrant", "Внутренняя партия", "Шифр кристалла", "Примечание", "Место хранения", "Ячейка хранения", "Дата расхода",
-        "Расход Wafer, шт.", "Расход GelPack, шт."
+    return export_response(request.args.get('format', 'xlsx'), export.CART_EXPORT_COLUMNS,
+                           export.iter_cart_rows(user_id), "cart_export")
+
+# Выгрузка результатов поиска (все страницы) в Excel или CSV
+@app.route('/export_search', methods=['GET'])
+def export_search():
+    if 'user_id' not in session:
+        return "Необходимо войти в систему для экспорта", 401
+    chip_name = request.args.get('chip_name', '').strip()
+    manufacturer_filter = request.args.get('manufacturer', '')
+    query, params = stock_search.build_query(chip_name, manufacturer_filter)
+    query += " ORDER BY b.item_id"
+    header = [
+        "ID", "id запуска", "Запуск", "Производитель", "Технология", "Пластина", "Квадрант", "Партия",
+        "Внутренняя партия", "Шифр кристалла", "Количество на пластине", "Количество в GelPack",
+        "Примечание", "Место хранения", "Ячейка хранения"
     ]
-    # Проверка на наличие данных
-    if results:  # Если данные есть
-        # Создаем DataFrame из результатов запроса
-        df_filled = pd.DataFrame(results, columns=filled_columns)
-        # Создаем полный DataFrame, добавляя недостающие столбцы
-        df = pd.DataFrame(columns=columns)
-        for col in filled_columns:
-            df[col] = df_filled[col]
-    else:  # Если данных нет
-        # Создаем пустой DataFrame с 21 столбцом
-        df = pd.DataFrame(columns=columns)
-
-    # Убедитесь, что столбец "Дата" существует и преобразуйте его в формат даты
-    if "Дата" in df.columns:
-        df["Дата"] = pd.to_datetime(df["Дата"], errors="coerce")  # Преобразование в datetime
-
-    # Все пустые столбцы автоматически заполнятся NaN (неявно)
-    df = df.infer_objects(copy=False)
-
-    # Создаем временный файл в памяти
-    output = BytesIO()
-    # Создаем ExcelWriter и записываем DataFrame в файл
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Sheet1")
-        workbook = writer.book
-        worksheet = writer.sheets["Sheet1"]
-
-        # Применяем форматирование к столбцу с датами
-        if "Дата" in df.columns:
-            date_style = NamedStyle(name="datetime", number_format="YYYY-MM-DD")
-            workbook.add_named_style(date_style)
-
-            # Найти индекс столбца "Дата"
-            date_col_index = df.columns.get_loc("Дата") + 1  # Учитываем смещение для Excel
-            for row in range(2, len(df) + 2):  # Начинаем с 2, т.к. 1 строка - заголовок
-                cell = worksheet.cell(row=row, column=date_col_index)
-                cell.style = date_style
-
-    output.seek(0)
-
-    # Отправляем файл клиенту
-    response = make_response(send_file(output, as_attachment=True, download_name="cart_export.xlsx"))
-    response.headers["Content-Disposition"] = "attachment; filename=cart_export.xlsx"
-    return response
+    rows = export.iter_query_rows(query, params)
+    return export_response(request.args.get('format', 'xlsx'), header, rows, "search_export")
+
+def report_rows(version, group_by, date_from, date_to):
+    """Строки отчета по движениям через кэш результатов (до изменения данных склада)."""
+    def load():
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                return reports.movement_report(cur, group_by, date_from, date_to)
+        finally:
+            conn.close()
+    return response_cache.cached(version, ('report', group_by, date_from.isoformat(), date_to.isoformat()), load)
+
+# Отчет по движениям: приход, расход, возврат за период и остаток на его конец по справочнику
+@app.route('/reports', methods=['GET'])
+def reports_page():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    try:
+        group_by, date_from, date_to = reports.parse_params(
+            request.args.get('group_by'), request.args.get('from'), request.args.get('to'))
+    except reports.ReportError as e:
+        return render_template('reports.html', groups=reports.GROUP_TITLES, error=str(e),
+                               group_by=request.args.get('group_by'),
+                               date_from=request.args.get('from', ''), date_to=request.args.get('to', '')), 400
+    version = response_cache.version()
+    tag = response_cache.etag(version, 'reports', session.get('user_id'), session.get('username'),
+                              group_by, date_from.isoformat(), date_to.isoformat())
+
+    def build():
+        rows = report_rows(version, group_by, date_from, date_to)
+        return render_template('reports.html', groups=reports.GROUP_TITLES, rows=rows,
+                               group_by=group_by, date_from=date_from.isoformat(), date_to=date_to.isoformat())
+
+    return conditional_response(tag, build)
+
+# Тот же отчет в JSON (format=json, по умолчанию), CSV или Excel
+@app.route('/api/reports', methods=['GET'])
+def api_reports():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Пользователь не авторизован'}), 401
+    try:
+        group_by, date_from, date_to = reports.parse_params(
+            request.args.get('group_by'), request.args.get('from'), request.args.get('to'))
+    except reports.ReportError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    fmt = request.args.get('format', 'json')
+    version = response_cache.version()
+    if fmt != 'json':
+        rows = report_rows(version, group_by, date_from, date_to)
+        header = [reports.REPORT_HEADER[0], reports.GROUP_TITLES[group_by]] + reports.REPORT_HEADER[2:]
+        return export_response(fmt, header, iter(rows),
+                               f"report_{group_by}_{date_from.isoformat()}_{date_to.isoformat()}")
+    tag = response_cache.etag(version, 'api_reports', group_by, date_from.isoformat(), date_to.isoformat())
+
+    def build():
+        rows = report_rows(version, group_by, date_from, date_to)
+        return jsonify({
+            'success': True,
+            'group_by': group_by,
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'rows': [reports.row_to_dict(row) for row in rows],
+        })
+
+    return conditional_response(tag, build)
 
 # Регистрация пользователя
 @app.route('/register', methods=['GET', 'POST'])
@@ -651,7 +558,7 @@ def register():
             session['user_id'] = cur.fetchone()[0]  # Сохраняем ID пользователя в сессии
             return redirect(url_for('home'))
         except Exception as e:
-            print(f"Error during registration: {e}")
+            app.logger.error(f"Ошибка регистрации: {e}")
             return "Ошибка при регистрации", 500
         finally:
             cur.close()
@@ -687,6 +594,38 @@ def logout():
     session.pop('username', None)
     return redirect(url_for('home'))  # Возврат на главную страницу
 
+# Списание корзины в расход без выгрузки в Excel: одна транзакция на всю корзину
+@app.route('/cart/checkout', methods=['POST'])
+def cart_checkout():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Пользователь не авторизован'}), 401
+    data = request.get_json(silent=True) or request.form
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            rows = checkout.checkout(cur, user_id, datetime.now().date(),
+                                     transf_man=data.get('transf_man') or None,
+                                     reciver=data.get('reciver') or session.get('username'))
+            response_cache.mark_changed(cur)
+        conn.commit()
+        response_cache.invalidate()
+        return jsonify({'success': True, 'rows': rows, 'message': f'Списано позиций: {rows}'})
+    except checkout.CheckoutError as e:
+        conn.rollback()
+        shortages = [
+            {'item_id': item_id, 'cons_w': cons_w, 'cons_gp': cons_gp,
+             'available_w': available_w, 'available_gp': available_gp}
+            for item_id, cons_w, cons_gp, available_w, available_gp in e.shortages
+        ]
+        return jsonify({'success': False, 'message': str(e), 'shortages': shortages}), 409
+    except Exception as e:
+        conn.rollback()
+        app.logger.error(f"Ошибка списания корзины: {e}")
+        return jsonify({'success': False, 'message': 'Ошибка сервера'}), 500
+    finally:
+        conn.close()
+
 @app.route('/clear_cart', methods=['POST'])
 def clear_cart():
     user_id = session.get('user_id')  # ID текущего пользователя
@@ -702,22 +641,70 @@ def clear_cart():
         app.logger.error(f"Ошибка очистки корзины: {e}")
         return {"success": False, "message": "Ошибка при очистке корзины."}, 500
 
-def log_user_action(user_id, action_type, file_name, target_table):
-    query = """
-        INSERT INTO user_logs (user_id, action_type, file_name, target_table)
-        VALUES (%s, %s, %s, %s)
-    """
-    params = (user_id, action_type, file_name, target_table)
+# Состояние пула соединений с БД (размер, ожидания, таймауты)
+@app.route('/api/db_pool', methods=['GET'])
+def db_pool_stats():
+    if not pool_enabled():
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **get_pool().snapshot()})
+
+# Счетчики попаданий и промахов кэша справочников
+@app.route('/api/dim_cache', methods=['GET'])
+def dim_cache_stats():
+    return jsonify(dim_cache.cache.stats())
+
+# Явный сброс кэша справочников (всего или одной таблицы) во всех процессах
+@app.route('/api/dim_cache/invalidate', methods=['POST'])
+def dim_cache_invalidate():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Пользователь не авторизован'}), 401
+    table = (request.get_json(silent=True) or {}).get('table')
+    dim_cache.cache.invalidate(table)
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(query, params)
+            dim_cache.notify_changed(cur, [table or ''])
         conn.commit()
-    except Exception as e:
-        print(f"Ошибка логирования: {e}")
-        conn.rollback()
     finally:
         conn.close()
+    return jsonify({'success': True})
+
+# Метрики в формате Prometheus: время ответа по маршрутам, запросы к БД, пул, кэш, загрузки
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Текущие значения - gauge, накопленные с запуска процесса - counter
+    gauges, counters = {}, {}
+    if pool_enabled():
+        pool = get_pool().snapshot()
+        gauges.update({
+            'db_pool_size': pool['size'],
+            'db_pool_in_use': pool['in_use'],
+            'db_pool_idle': pool['idle'],
+        })
+        counters.update({
+            'db_pool_checkouts_total': pool['checkouts'],
+            'db_pool_waits_total': pool['waits'],
+            'db_pool_wait_seconds_total': pool['wait_time_total'],
+            'db_pool_timeouts_total': pool['timeouts'],
+        })
+    cache = dim_cache.cache.stats()
+    gauges['dim_cache_size'] = cache['size']
+    counters.update({
+        'dim_cache_hits_total': cache['hits'],
+        'dim_cache_misses_total': cache['misses'],
+    })
+    responses = response_cache.stats()
+    gauges.update({
+        'response_cache_version': responses['version'],
+        'response_cache_size': responses['size'],
+    })
+    counters.update({
+        'response_cache_hits_total': responses['hits'],
+        'response_cache_misses_total': responses['misses'],
+    })
+    return Response(metrics.render(gauges, counters), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    serve(app, host="127.0.0.1", port=5000)
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    serve.run(app)
@@ -0,0 +1,126 @@
+# Обслуживание таблицы остатков stock_balance: полное перестроение и сверка с историей движений
+
+BALANCE_COLUMNS = [
+    "item_id", "id_start", "id_pr", "id_tech", "id_wafer", "id_lot", "id_in_lot", "id_n_chip", "id_quad",
+    "note", "id_stor", "id_cells", "quan_w", "quan_gp", "cons_w", "cons_gp", "invoice_rows",
+]
+
+# Эталонные остатки: итоги заархивированных периодов (stock_opening_balance) плюс живая история.
+# Заменяет представление из миграции 0001: после секционирования и архивации читаются только
+# оставшиеся секции invoice и consumption. Примечание берется из самой ранней записи, место
+# и ячейка хранения - из самой поздней, как в триггерах stock_balance.
+EXPECTED_VIEW = """
+CREATE OR REPLACE VIEW stock_balance_expected AS
+WITH inv AS (
+    SELECT item_id,
+           MIN(id_start) AS id_start, MIN(id_pr) AS id_pr, MIN(id_tech) AS id_tech,
+           MIN(id_wafer) AS id_wafer, MIN(id_lot) AS id_lot, MIN(id_in_lot) AS id_in_lot,
+           MIN(id_n_chip) AS id_n_chip, MIN(id_quad) AS id_quad,
+           (array_agg(note ORDER BY id) FILTER (WHERE note IS NOT NULL))[1] AS note,
+           (array_agg(id_stor ORDER BY id DESC) FILTER (WHERE id_stor IS NOT NULL))[1] AS id_stor,
+           (array_agg(id_cells ORDER BY id DESC) FILTER (WHERE id_cells IS NOT NULL))[1] AS id_cells,
+           SUM(COALESCE(quan_w, 0)) AS quan_w, SUM(COALESCE(quan_gp, 0)) AS quan_gp,
+           COUNT(*) AS invoice_rows
+    FROM invoice
+    GROUP BY item_id
+),
+cons AS (
+    SELECT item_id,
+           MIN(id_start) AS id_start, MIN(id_pr) AS id_pr, MIN(id_tech) AS id_tech,
+           MIN(id_wafer) AS id_wafer, MIN(id_lot) AS id_lot, MIN(id_in_lot) AS id_in_lot,
+           MIN(id_n_chip) AS id_n_chip, MIN(id_quad) AS id_quad,
+           SUM(COALESCE(cons_w, 0)) AS cons_w, SUM(COALESCE(cons_gp, 0)) AS cons_gp
+    FROM consumption
+    GROUP BY item_id
+),
+live AS (
+    SELECT COALESCE(inv.item_id, cons.item_id) AS item_id,
+           COALESCE(inv.id_start, cons.id_start) AS id_start,
+           COALESCE(inv.id_pr, cons.id_pr) AS id_pr,
+           COALESCE(inv.id_tech, cons.id_tech) AS id_tech,
+           COALESCE(inv.id_wafer, cons.id_wafer) AS id_wafer,
+           COALESCE(inv.id_lot, cons.id_lot) AS id_lot,
+           COALESCE(inv.id_in_lot, cons.id_in_lot) AS id_in_lot,
+           COALESCE(inv.id_n_chip, cons.id_n_chip) AS id_n_chip,
+           COALESCE(inv.id_quad, cons.id_quad) AS id_quad,
+           inv.note, inv.id_stor, inv.id_cells,
+           COALESCE(inv.quan_w, 0) AS quan_w, COALESCE(inv.quan_gp, 0) AS quan_gp,
+           COALESCE(cons.cons_w, 0) AS cons_w, COALESCE(cons.cons_gp, 0) AS cons_gp,
+           COALESCE(inv.invoice_rows, 0) AS invoice_rows
+    FROM inv
+    FULL JOIN cons ON cons.item_id = inv.item_id
+)
+SELECT COALESCE(o.item_id, l.item_id) AS item_id,
+       COALESCE(o.id_start, l.id_start) AS id_start,
+       COALESCE(o.id_pr, l.id_pr) AS id_pr,
+       COALESCE(o.id_tech, l.id_tech) AS id_tech,
+       COALESCE(o.id_wafer, l.id_wafer) AS id_wafer,
+       COALESCE(o.id_lot, l.id_lot) AS id_lot,
+       COALESCE(o.id_in_lot, l.id_in_lot) AS id_in_lot,
+       COALESCE(o.id_n_chip, l.id_n_chip) AS id_n_chip,
+       COALESCE(o.id_quad, l.id_quad) AS id_quad,
+       COALESCE(o.note, l.note) AS note,
+       COALESCE(l.id_stor, o.id_stor) AS id_stor,
+       COALESCE(l.id_cells, o.id_cells) AS id_cells,
+       COALESCE(o.quan_w, 0) + COALESCE(l.quan_w, 0) AS quan_w,
+       COALESCE(o.quan_gp, 0) + COALESCE(l.quan_gp, 0) AS quan_gp,
+       COALESCE(o.cons_w, 0) + COALESCE(l.cons_w, 0) AS cons_w,
+       COALESCE(o.cons_gp, 0) + COALESCE(l.cons_gp, 0) AS cons_gp,
+       (COALESCE(o.invoice_rows, 0) + COALESCE(l.invoice_rows, 0))::integer AS invoice_rows
+FROM live l
+FULL JOIN stock_opening_balance o ON o.item_id = l.item_id
+"""
+
+
+def rebuild_balance(cur):
+    """Пересчитывает stock_balance по всей истории invoice и consumption.
+
+    Таблица блокируется на время пересчета, чтобы параллельные загрузки дождались его окончания.
+    Возвращает количество позиций.
+    """
+    columns = ", ".join(BALANCE_COLUMNS)
+    cur.execute("LOCK TABLE stock_balance IN EXCLUSIVE MODE")
+    cur.execute("DELETE FROM stock_balance")
+    cur.execute(f"INSERT INTO stock_balance ({columns}) SELECT {columns} FROM stock_balance_expected")
+    return cur.rowcount
+
+
+def verify_balance(cur, limit=100):
+    """Сверяет stock_balance с остатками, посчитанными по истории.
+
+    Возвращает список расхождений: (item_id, столбец, в таблице, ожидается), не более limit.
+    """
+    compared = BALANCE_COLUMNS[1:]
+    differs = " OR ".join(f"b.{col} IS DISTINCT FROM e.{col}" for col in compared)
+    selected = ", ".join(f"b.{col}, e.{col}" for col in compared)
+    cur.execute(f"""
+        SELECT COALESCE(b.item_id, e.item_id), b.item_id IS NULL, e.item_id IS NULL, {selected}
+        FROM stock_balance b
+        FULL JOIN stock_balance_expected e ON e.item_id = b.item_id
+        WHERE b.item_id IS NULL OR e.item_id IS NULL OR {differs}
+        LIMIT %s
+    """, (limit,))
+    mismatches = []
+    for row in cur.fetchall():
+        item_id, missing_in_table, missing_in_history = row[:3]
+        if missing_in_table:
+            mismatches.append((item_id, "*", None, "есть в истории"))
+            continue
+        if missing_in_history:
+            mismatches.append((item_id, "*", "есть в таблице", None))
+            continue
+        values = row[3:]
+        for i, col in enumerate(compared):
+            actual, expected = values[2 * i], values[2 * i + 1]
+            if actual != expected:
+                mismatches.append((item_id, col, actual, expected))
+    return mismatches
+
+
+def create_expected_view(cur):
+    """(Пере)создает представление stock_balance_expected с учетом архива.
+
+    Нужно после замены таблиц invoice и consumption секционированными: представление
+    ссылается на таблицы, а не на их имена.
+    """
+    cur.execute(EXPECTED_VIEW)
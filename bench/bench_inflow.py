@@ -0,0 +1,63 @@
+# Бенчмарк загрузки прихода: строк в секунду для пакетной загрузки ingest.import_inflow.
+#
+# Данные генерируются в памяти, по умолчанию транзакция откатывается, чтобы не засорять БД:
+#   python bench/bench_inflow.py --rows 20000 --distinct 200
+#   python bench/bench_inflow.py --rows 20000 --commit
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_inflow_frame(rows, distinct, seed=0):
+    """Синтетический файл прихода: rows строк, до distinct разных значений в каждом справочнике."""
+    import ingest
+
+    rng = np.random.default_rng(seed)
+    data = {}
+    for excel_col, table, _, _ in ingest.INFLOW_DIMENSIONS:
+        data[excel_col] = [f"bench-{table}-{i}" for i in rng.integers(0, distinct, rows)]
+    data["Дата прихода"] = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    data["Приход Wafer, шт."] = rng.integers(0, 50, rows)
+    data["Приход GelPack, шт."] = rng.integers(0, 500, rows)
+    data["Приход общий, шт."] = data["Приход Wafer, шт."] + data["Приход GelPack, шт."]
+    data["Примечание"] = "bench"
+    return pd.DataFrame(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк пакетной загрузки прихода')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--distinct', type=int, default=200, help='Разных значений в справочнике')
+    parser.add_argument('--commit', action='store_true', help='Зафиксировать загруженные строки')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    import ingest
+    from db import get_db_connection
+
+    df = make_inflow_frame(args.rows, args.distinct)
+    conn = get_db_connection()
+    try:
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            count = ingest.import_inflow(cur, df)
+        if args.commit:
+            conn.commit()
+        else:
+            conn.rollback()
+        elapsed = time.perf_counter() - started
+    finally:
+        conn.close()
+    print(f"Строк: {count}, время: {elapsed:.2f} с, скорость: {count / elapsed:.0f} строк/с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Бенчмарк пула соединений: запросов в секунду для /search и /cart с пулом и без него.
+#
+# Запуск (нужна рабочая БД из .env и существующий пользователь):
+#   python bench/bench_pool.py --user-id 1 --chip-name A --threads 8 --requests 400
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(client_factory, method, url, data, threads, total):
+    """Выполняет total запросов в threads потоков и возвращает запросов в секунду."""
+    per_thread = max(total // threads, 1)
+    errors = []
+
+    def worker():
+        client = client_factory()
+        for _ in range(per_thread):
+            response = client.open(url, method=method, data=data)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return per_thread * threads / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк пула соединений')
+    parser.add_argument('--user-id', type=int, required=True, help='ID пользователя для сессии')
+    parser.add_argument('--chip-name', default='', help='Фильтр шифра кристалла для /search')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    args = parser.parse_args()
+
+    import db
+    from app import app
+    app.config['TESTING'] = True
+
+    def client_factory():
+        client = app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'] = args.user_id
+        return client
+
+    scenarios = [
+        ('/search', 'POST', {'chip_name': args.chip_name, 'manufacturer': 'all'}),
+        ('/cart', 'GET', None),
+    ]
+    print(f"{'Маршрут':<10}{'Пул':<6}{'запр/с':>10}{'ошибок':>8}")
+    for enabled in ('0', '1'):
+        os.environ['DB_POOL_ENABLED'] = enabled
+        db.reset_pool()
+        for url, method, data in scenarios:
+            rps, errors = run(client_factory, method, url, data, args.threads, args.requests)
+            print(f"{url:<10}{'да' if enabled == '1' else 'нет':<6}{rps:>10.1f}{errors:>8}")
+    print('Пул:', db.get_pool().snapshot())
+
+
+if __name__ == '__main__':
+    main()
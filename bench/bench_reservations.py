@@ -0,0 +1,98 @@
+# Проверка резервирования под конкурентной нагрузкой: много пользователей одновременно добавляют
+# в корзину одну и ту же позицию. Сумма резервов не должна превысить остаток; код возврата 1 - превысила.
+# Автоматическая проверка того же на тестовой БД - tests/test_reservations.py; этот скрипт - нагрузочный замер.
+#
+# Работает с БД бенчмарка (bench/datagen.py), резервы тестовой позиции удаляются после проверки:
+#   python bench/bench_reservations.py --threads 16 --extra 50
+
+import argparse
+import threading
+import time
+
+from common import use_bench_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Конкурентное добавление одной позиции в корзины')
+    parser.add_argument('--db', help='Имя БД бенчмарка (по умолчанию BENCH_DB_NAME или warehouse_bench)')
+    parser.add_argument('--threads', type=int, default=16, help='Одновременных пользователей')
+    parser.add_argument('--extra', type=int, default=50, help='На сколько попыток больше, чем есть остатка')
+    parser.add_argument('--keep', action='store_true', help='Не удалять резервы после проверки')
+    args = parser.parse_args()
+
+    use_bench_database(args.db)
+    import reservations
+    from app import app
+    from db import get_db_connection
+
+    # Позиция с небольшим остатком GelPack, которой нет ни в одной корзине
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT b.item_id FROM stock_balance b
+                WHERE b.quan_gp - b.cons_gp BETWEEN 10 AND 300
+                  AND NOT EXISTS (SELECT 1 FROM cart c WHERE c.item_id = b.item_id)
+                LIMIT 1
+            """)
+            row = cur.fetchone()
+            if row is None:
+                raise SystemExit("Нет подходящей позиции: сгенерируйте данные bench/datagen.py")
+            item_id = row[0]
+            _, available_gp = reservations.lock_available(cur, item_id)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    attempts = available_gp + args.extra
+    per_thread = -(-attempts // args.threads)
+    app.config['TESTING'] = True
+    clients = []
+    for i in range(args.threads):
+        client = app.test_client()
+        client.post('/login', data={'username': f"bench-user-{i + 1}", 'password': 'bench'})
+        clients.append(client)
+
+    statuses = {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(client):
+        barrier.wait()
+        for _ in range(per_thread):
+            response = client.post('/add_to_cart', json={'item_id': item_id, 'quantity_w': 0, 'quantity_gp': 1})
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(reservations.RESERVED, (item_id,))
+            reserved_gp = int(cur.fetchone()[1])
+            if not args.keep:
+                cur.execute("DELETE FROM cart WHERE item_id = %s", (item_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+    total = sum(statuses.values())
+    print(f"Позиция {item_id}: остаток GelPack {available_gp}, попыток {total} за {elapsed:.2f} с "
+          f"({total / elapsed:.0f} запр/с)")
+    print(f"Ответы: {dict(sorted(statuses.items()))}")
+    print(f"Зарезервировано: {reserved_gp}, успешных добавлений: {statuses.get(200, 0)}")
+    if reserved_gp > available_gp or reserved_gp != statuses.get(200, 0):
+        print("ОШИБКА: резервы не совпадают с остатком")
+        raise SystemExit(1)
+    print("OK: остаток не превышен")
+
+
+if __name__ == '__main__':
+    main()
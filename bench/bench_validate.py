@@ -0,0 +1,53 @@
+# Бенчмарк проверки файла прихода (upload_schema.validate) без БД: строк в секунду на порции из --rows строк.
+#
+# В синтетические данные добавляются пробелы, пустые ячейки, даты текстом и ошибочные значения:
+#   python bench/bench_validate.py --rows 100000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_inflow import make_inflow_frame
+
+
+def make_raw_frame(rows, distinct, seed=0):
+    """Файл прихода в том виде, в каком его возвращает upload_reader: значения разных типов."""
+    rng = np.random.default_rng(seed)
+    df = make_inflow_frame(rows, distinct, seed).astype(object)
+    df.index = df.index + 2
+    blank = rng.random(rows) < 0.05
+    df.loc[blank, "Quadrant"] = "   "
+    df.loc[blank, "Примечание"] = None
+    text_dates = rng.random(rows) < 0.5
+    df.loc[text_dates, "Дата прихода"] = [d.strftime("%d.%m.%Y") for d in df.loc[text_dates, "Дата прихода"]]
+    df["Партия (Lot ID)"] = [f" {value} " for value in df["Партия (Lot ID)"]]
+    bad = rng.random(rows) < 0.001
+    df.loc[bad, "Приход GelPack, шт."] = "много"
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк проверки и приведения типов файла прихода')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=200, help='Разных значений в справочнике')
+    args = parser.parse_args()
+
+    import ingest
+    import upload_schema
+
+    df = make_raw_frame(args.rows, args.distinct)
+    report = ingest.UploadReport()
+    started = time.perf_counter()
+    valid = upload_schema.validate(df, ingest.INFLOW_SCHEMA, report)
+    elapsed = time.perf_counter() - started
+    print(f"Строк: {len(df)}, без ошибок: {len(valid)}, ошибок: {report.error_count}, "
+          f"время: {elapsed:.2f} с, скорость: {len(df) / elapsed:.0f} строк/с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Общие функции бенчмарков: подключение к отдельной БД бенчмарка и сохранение результатов
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Каталог, куда сохраняются результаты прогонов (JSON)
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+
+def use_bench_database(name=None):
+    """Переключает приложение на БД бенчмарка (BENCH_DB_NAME, по умолчанию warehouse_bench).
+
+    Вызывается до импорта db и app: остальные параметры подключения берутся из .env.
+    """
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(ROOT, '.env'))
+    name = name or os.getenv('BENCH_DB_NAME', 'warehouse_bench')
+    os.environ['DB_NAME'] = name
+    return name
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def percentile(values, p):
+    """Перцентиль p (0-100) по отсортированному списку, с линейной интерполяцией."""
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def summarize(latencies, errors, elapsed):
+    """Сводка по одному сценарию: задержки в миллисекундах и пропускная способность."""
+    values = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'elapsed_sec': round(elapsed, 3),
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(sum(values) / len(values)) if values else None,
+        'p50_ms': ms(percentile(values, 50)),
+        'p95_ms': ms(percentile(values, 95)),
+        'p99_ms': ms(percentile(values, 99)),
+        'max_ms': ms(values[-1]) if values else None,
+    }
+
+
+def save_results(kind, params, scenarios, path=None):
+    """Сохраняет результаты прогона в JSON и возвращает путь к файлу."""
+    revision = git_revision()
+    data = {
+        'kind': kind,
+        'revision': revision,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'scenarios': scenarios,
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{revision or 'norev'}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
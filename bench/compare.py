@@ -0,0 +1,84 @@
+# Сравнение двух результатов бенчмарка (bench/results/*.json): изменение задержек и пропускной способности.
+#
+# Без аргументов сравниваются два последних файла; код возврата 1, если есть регрессия больше порога:
+#   python bench/compare.py
+#   python bench/compare.py bench/results/load-A.json bench/results/load-B.json --threshold 15
+
+import argparse
+import glob
+import json
+import os
+
+from common import RESULTS_DIR
+
+# Показатели, по которым ищется регрессия: (ключ, больше - хуже)
+METRICS = [
+    ("p50_ms", True),
+    ("p95_ms", True),
+    ("p99_ms", True),
+    ("throughput_rps", False),
+]
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def compare(base, head, threshold):
+    """Печатает таблицу сравнения и возвращает список регрессий (сценарий, показатель, изменение %)."""
+    regressions = []
+    print(f"{'Сценарий':<16}{'Показатель':<16}{'было':>10}{'стало':>10}{'изм., %':>10}")
+    for scenario, new in head['scenarios'].items():
+        old = base['scenarios'].get(scenario)
+        if old is None:
+            print(f"{scenario:<16}(нет в базовом прогоне)")
+            continue
+        for key, higher_is_worse in METRICS:
+            delta = change(old.get(key), new.get(key))
+            mark = ''
+            if delta is not None and (delta if higher_is_worse else -delta) > threshold:
+                mark = '  регрессия'
+                regressions.append((scenario, key, delta))
+            delta_text = f"{delta:+.1f}" if delta is not None else '-'
+            print(f"{scenario:<16}{key:<16}{old.get(key) or 0:>10.1f}{new.get(key) or 0:>10.1f}{delta_text:>10}{mark}")
+        if new.get('errors') and not old.get('errors'):
+            regressions.append((scenario, 'errors', new['errors']))
+            print(f"{scenario:<16}{'errors':<16}{0:>10}{new['errors']:>10}  регрессия")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение результатов бенчмарка')
+    parser.add_argument('base', nargs='?', help='Базовый результат (по умолчанию предпоследний)')
+    parser.add_argument('head', nargs='?', help='Новый результат (по умолчанию последний)')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Допустимое ухудшение, %%')
+    args = parser.parse_args()
+
+    if args.base and args.head:
+        base_path, head_path = args.base, args.head
+    else:
+        files = sorted(glob.glob(os.path.join(RESULTS_DIR, '*.json')), key=os.path.getmtime)
+        if len(files) < 2:
+            raise SystemExit(f"Нужно два результата в {RESULTS_DIR}")
+        base_path, head_path = files[-2], files[-1]
+
+    base, head = load(base_path), load(head_path)
+    print(f"Было:  {base_path} ({base.get('revision')}, {base.get('created_at')})")
+    print(f"Стало: {head_path} ({head.get('revision')}, {head.get('created_at')})")
+    if base.get('params') != head.get('params'):
+        print("Внимание: параметры прогонов различаются")
+    regressions = compare(base, head, args.threshold)
+    if regressions:
+        print(f"Регрессий: {len(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# Генератор синтетического склада для бенчмарков: схема, справочники, приход, расход, корзины
+# пользователей и Excel-файлы для /inflow, /outflow и /refund.
+#
+# Данные пишутся в отдельную БД бенчмарка (BENCH_DB_NAME, по умолчанию warehouse_bench),
+# параметры подключения берутся из .env. БД нужно создать заранее: createdb warehouse_bench
+#   python bench/datagen.py --items 200000 --invoice-rows 1000000 --consumption-rows 300000
+#   python bench/datagen.py --items 0 --excel-dir bench/files --excel-rows 10000
+
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from common import ROOT, use_bench_database
+
+# Справочники: (таблица, столбец, размер). Размер - доля от числа позиций или фиксированное число
+DIMENSIONS = [
+    ("start_p", "name_start", 0.01),
+    ("pr", "name_pr", 20),
+    ("tech", "name_tech", 30),
+    ("lot", "name_lot", 0.02),
+    ("wafer", "name_wafer", 25),
+    ("quad", "name_quad", 4),
+    ("in_lot", "in_lot", 0.02),
+    ("chip", "name_chip", 0.05),
+    ("n_chip", "n_chip", 0.01),
+    ("size_c", "size", 50),
+    ("pack", "name_pack", 5),
+    ("stor", "name_stor", 10),
+    ("cells", "name_cells", 500),
+]
+
+# Столбец invoice/consumption для каждого справочника
+ID_COLUMNS = {
+    "start_p": "id_start", "pr": "id_pr", "tech": "id_tech", "lot": "id_lot", "wafer": "id_wafer",
+    "quad": "id_quad", "in_lot": "id_in_lot", "chip": "id_chip", "n_chip": "id_n_chip",
+    "size_c": "id_size", "pack": "id_pack", "stor": "id_stor", "cells": "id_cells",
+}
+CONSUMPTION_DIMENSIONS = ["start_p", "pr", "tech", "lot", "wafer", "quad", "in_lot", "n_chip", "stor", "cells"]
+
+# Сколько строк движения вставлять одним запросом
+BATCH_ROWS = 200000
+
+
+def dimension_size(size, items):
+    return max(int(items * size), 10) if isinstance(size, float) else size
+
+
+def create_schema(conn):
+    """Базовые таблицы из bench/schema.sql и таблицы приложения из migrations/."""
+    import schema
+
+    with open(os.path.join(ROOT, 'bench', 'schema.sql'), encoding='utf-8') as f:
+        ddl = f.read()
+    with conn.cursor() as cur:
+        cur.execute(ddl)
+    conn.commit()
+    return schema.migrate(conn)
+
+
+def fill_dimensions(cur, items):
+    """Заполняет справочники значениями bench-<таблица>-<n> и возвращает {таблица: [id, ...]}."""
+    ids = {}
+    for table, column, size in DIMENSIONS:
+        count = dimension_size(size, items)
+        cur.execute(f"""
+            INSERT INTO {table} ({column})
+            SELECT 'bench-{table}-' || g FROM generate_series(1, %s) g
+            ON CONFLICT DO NOTHING
+        """, (count,))
+        cur.execute(f"SELECT array_agg(id ORDER BY id) FROM {table} WHERE {column} LIKE 'bench-{table}-%'")
+        ids[table] = cur.fetchone()[0] or []
+    return ids
+
+
+def _id_expressions(tables, ids):
+    # Позиция k однозначно задает набор id справочников, поэтому строки прихода и расхода
+    # с одинаковым k относятся к одной позиции склада
+    return ", ".join(
+        f"(%({table})s::int[])[1 + k %% {len(ids[table])}]" for table in tables
+    )
+
+
+def fill_movements(conn, table, rows, items, ids, started_at):
+    """Вставляет rows строк в invoice или consumption пачками по BATCH_ROWS."""
+    if table == "invoice":
+        tables = [t for t, _, _ in DIMENSIONS]
+        extra = "date, quan_w, quan_gp, note"
+        values = ("date '2020-01-01' + (g %% 1500), floor(random() * 50)::int, "
+                  "floor(random() * 500)::int, 'bench'")
+    else:
+        tables = CONSUMPTION_DIMENSIONS
+        extra = "date, cons_w, cons_gp, note, transf_man, reciver"
+        values = ("date '2020-06-01' + (g %% 1200), floor(random() * 5)::int, "
+                  "floor(random() * 50)::int, 'bench', 'bench-batch-' || (g %% 100), 'bench'")
+    columns = ", ".join(ID_COLUMNS[t] for t in tables)
+    query = f"""
+        INSERT INTO {table} ({columns}, {extra})
+        SELECT {_id_expressions(tables, ids)}, {values}
+        FROM (SELECT g, floor(random() * %(items)s)::int AS k
+              FROM generate_series(%(first)s, %(last)s) g) s
+    """
+    params = {t: ids[t] for t in tables}
+    params["items"] = items
+    done = 0
+    while done < rows:
+        batch = min(BATCH_ROWS, rows - done)
+        params.update(first=done + 1, last=done + batch)
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+        conn.commit()
+        done += batch
+        print(f"  {table}: {done}/{rows} строк, {time.perf_counter() - started_at:.1f} с")
+
+
+def fill_carts(cur, users, cart_items, seed):
+    """Пользователи bench-user-<n> (пароль bench) и по cart_items позиций в корзине каждого."""
+    from psycopg2.extras import execute_values
+
+    cur.execute("""
+        INSERT INTO users (username, password)
+        SELECT 'bench-user-' || g, 'bench' FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    """, (users,))
+    cur.execute("SELECT id FROM users WHERE username LIKE 'bench-user-%%' ORDER BY id LIMIT %s", (users,))
+    user_ids = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT item_id FROM stock_balance WHERE invoice_rows > 0 ORDER BY random() LIMIT %s",
+                (max(cart_items * 20, 1000),))
+    item_ids = [row[0] for row in cur.fetchall()]
+    if not item_ids:
+        return 0
+    rng = random.Random(seed)
+    rows = [
+        (user_id, item_id, rng.randint(0, 3), rng.randint(1, 20))
+        for user_id in user_ids
+        for item_id in rng.sample(item_ids, min(cart_items, len(item_ids)))
+    ]
+    execute_values(cur, """
+        INSERT INTO cart (user_id, item_id, cons_w, cons_gp, date_added)
+        VALUES %s
+        ON CONFLICT (user_id, item_id) DO NOTHING
+    """, rows, template="(%s, %s, %s, %s, current_date)", page_size=5000)
+    return len(rows)
+
+
+def fill_data(conn, items, invoice_rows, consumption_rows, users, cart_items, seed):
+    import balance
+
+    started_at = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", (seed % 1000 / 1000,))
+        ids = fill_dimensions(cur, items)
+    conn.commit()
+    print(f"Справочники: {', '.join(f'{t}={len(v)}' for t, v in ids.items())}")
+
+    # Остатки и дневные итоги пересчитываются один раз после вставки, а не триггерами на каждую пачку
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE invoice DISABLE TRIGGER USER")
+        cur.execute("ALTER TABLE consumption DISABLE TRIGGER USER")
+    conn.commit()
+    try:
+        fill_movements(conn, "invoice", invoice_rows, items, ids, started_at)
+        fill_movements(conn, "consumption", consumption_rows, items, ids, started_at)
+        with conn.cursor() as cur:
+            positions = balance.rebuild_balance(cur)
+            cur.execute("SELECT movement_daily_rebuild()")
+            rollups = cur.fetchone()[0]
+        conn.commit()
+        print(f"Остатки пересчитаны: {positions} позиций, дневных итогов {rollups}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE invoice ENABLE TRIGGER USER")
+            cur.execute("ALTER TABLE consumption ENABLE TRIGGER USER")
+        conn.commit()
+
+    with conn.cursor() as cur:
+        carts = fill_carts(cur, users, cart_items, seed)
+        cur.execute("ANALYZE")
+    conn.commit()
+    print(f"Корзины: {users} пользователей, {carts} строк; всего {time.perf_counter() - started_at:.1f} с")
+
+
+def sample_positions(cur, rows):
+    """Названия справочников существующих позиций склада для файлов расхода и возврата."""
+    import ingest
+
+    joins, columns = [], []
+    for i, (_, table, column, id_col) in enumerate(ingest.REFERENCE_DIMENSIONS):
+        joins.append(f"JOIN {table} d{i} ON d{i}.id = b.{id_col}")
+        columns.append(f"d{i}.{column}")
+    cur.execute(f"""
+        SELECT {', '.join(columns)}
+        FROM stock_balance b {' '.join(joins)}
+        WHERE b.invoice_rows > 0
+        ORDER BY random()
+        LIMIT %s
+    """, (rows,))
+    names = [dim[0] for dim in ingest.REFERENCE_DIMENSIONS]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def write_xlsx(path, header, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    worksheet.append(header)
+    for row in rows:
+        worksheet.append([row.get(col) for col in header])
+    workbook.save(path)
+
+
+def write_upload_files(cur, directory, rows, items, seed):
+    """Файлы inflow.xlsx, outflow.xlsx и refund.xlsx по rows строк в каталоге directory."""
+    import ingest
+
+    rng = random.Random(seed)
+    positions = sample_positions(cur, rows)
+    if not positions:
+        raise SystemExit("В БД бенчмарка нет позиций: сначала сгенерируйте данные")
+    os.makedirs(directory, exist_ok=True)
+    day = date(2024, 1, 1)
+
+    inflow = []
+    for i in range(rows):
+        row = dict(positions[i % len(positions)])
+        for excel_col, table, _, _ in ingest.INFLOW_DIMENSIONS:
+            if excel_col not in row:
+                size = dict((t, s) for t, _, s in DIMENSIONS)[table]
+                row[excel_col] = f"bench-{table}-{rng.randint(1, dimension_size(size, items))}"
+        quan_w, quan_gp = rng.randint(0, 50), rng.randint(0, 500)
+        row.update({
+            "Дата прихода": day + timedelta(days=rng.randint(0, 365)),
+            "Приход Wafer, шт.": quan_w,
+            "Приход GelPack, шт.": quan_gp,
+            "Приход общий, шт.": quan_w + quan_gp,
+            "Примечание": "bench",
+        })
+        inflow.append(row)
+
+    outflow, refund = [], []
+    for i in range(rows):
+        row = dict(positions[i % len(positions)])
+        row.update({
+            "Дата расхода": day + timedelta(days=rng.randint(0, 365)),
+            "Расход Wafer, шт.": rng.randint(0, 2),
+            "Расход GelPack, шт.": rng.randint(1, 5),
+            "Примечание": "bench",
+            "Куда передано (Производственная партия)": f"bench-batch-{rng.randint(1, 100)}",
+            "ФИО": "bench",
+        })
+        outflow.append(row)
+        row = dict(positions[i % len(positions)])
+        row.update({
+            "Дата возврата": day + timedelta(days=rng.randint(0, 365)),
+            "Возврат Wafer, шт.": rng.randint(0, 2),
+            "Возврат GelPack, шт.": rng.randint(1, 5),
+        })
+        refund.append(row)
+
+    paths = {}
+    for kind, header, data in (("inflow", ingest.INFLOW_REQUIRED, inflow),
+                               ("outflow", ingest.OUTFLOW_REQUIRED, outflow),
+                               ("refund", ingest.REFUND_REQUIRED, refund)):
+        paths[kind] = os.path.join(directory, f"{kind}.xlsx")
+        write_xlsx(paths[kind], header, data)
+        print(f"{paths[kind]}: {len(data)} строк")
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических данных склада для бенчмарков')
+    parser.add_argument('--db', help='Имя БД бенчмарка (по умолчанию BENCH_DB_NAME или warehouse_bench)')
+    parser.add_argument('--items', type=int, default=50000, help='Число позиций склада (0 - не генерировать данные)')
+    parser.add_argument('--invoice-rows', type=int, default=200000)
+    parser.add_argument('--consumption-rows', type=int, default=60000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--cart-items', type=int, default=20, help='Позиций в корзине каждого пользователя')
+    parser.add_argument('--excel-dir', help='Каталог для Excel-файлов загрузки')
+    parser.add_argument('--excel-rows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    name = use_bench_database(args.db)
+    from db import connect
+
+    conn = connect()
+    try:
+        applied = create_schema(conn)
+        print(f"БД {name}: схема готова, применено миграций: {len(applied)}")
+        if args.items:
+            fill_data(conn, args.items, args.invoice_rows, args.consumption_rows,
+                      args.users, args.cart_items, args.seed)
+        if args.excel_dir:
+            with conn.cursor() as cur:
+                write_upload_files(cur, args.excel_dir, args.excel_rows, args.items or 50000, args.seed)
+            conn.rollback()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+# Нагрузочный тест: параллельные запросы к приложению, задержки p50/p95/p99 и пропускная способность
+# по сценариям (поиск, корзина, выгрузки, загрузки файлов). Результат сохраняется в bench/results/*.json.
+#
+# Данные готовит bench/datagen.py (пользователи bench-user-<n> с паролем bench).
+# По умолчанию приложение вызывается в этом же процессе (Flask test client) на БД бенчмарка;
+# с --base-url запросы идут по HTTP к запущенному серверу:
+#   python bench/load.py --threads 8 --requests 400 --files bench/files
+#   python bench/load.py --base-url http://127.0.0.1:5000 --scenarios search,cart
+#   python bench/compare.py
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from common import save_results, summarize, use_bench_database
+
+SCENARIOS = [
+    "search", "api_search", "add_to_cart", "cart_batch", "cart", "export_cart", "export_search",
+    "reports", "upload_inflow", "upload_outflow", "upload_refund",
+]
+# Группировки и годы отчетов сценария reports (годы - период данных bench/datagen.py)
+REPORT_GROUPS = ["pr", "tech", "stor", "cells", "n_chip"]
+REPORT_YEARS = [2020, 2021, 2022, 2023]
+# Сколько позиций добавляется одним запросом в сценарии cart_batch
+BATCH_OPS = 20
+UPLOAD_SCENARIOS = {"upload_inflow", "upload_outflow", "upload_refund"}
+
+
+class AppClient:
+    """Запросы к приложению в этом же процессе через Flask test client."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None, file_path=None):
+        data = dict(form or {})
+        if file_path:
+            data['file'] = (open(file_path, 'rb'), os.path.basename(file_path))
+        response = self._client.open(path, method=method, data=data or None, json=json_body,
+                                     buffered=True)
+        body = response.get_data()
+        return response.status_code, body
+
+
+class HttpClient:
+    """Запросы к запущенному серверу по HTTP (cookie сессии хранятся в клиенте)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, form=None, json_body=None, file_path=None):
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif file_path:
+            boundary = uuid.uuid4().hex
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            data = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+                    f'filename="{os.path.basename(file_path)}"\r\n'
+                    'Content-Type: application/octet-stream\r\n\r\n').encode() + content + \
+                f'\r\n--{boundary}--\r\n'.encode()
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Context:
+    """Общие данные сценариев: позиции для корзины, фильтры поиска и файлы загрузки."""
+
+    def __init__(self, items, chip_filters, files, upload_commit):
+        self.items = items
+        self.chip_filters = chip_filters
+        self.files = files
+        self.upload_commit = upload_commit
+
+
+def login(client, username):
+    status, _ = client.request('POST', '/login', form={'username': username, 'password': 'bench'})
+    if status >= 400:
+        raise SystemExit(f"Не удалось войти как {username}: {status}. Сгенерируйте данные bench/datagen.py")
+
+
+def do_request(scenario, client, ctx, rng):
+    chip = rng.choice(ctx.chip_filters)
+    if scenario == "search":
+        return client.request('GET', '/search?' + urllib.parse.urlencode({'chip_name': chip, 'manufacturer': 'all'}))
+    if scenario == "api_search":
+        return client.request('GET', '/api/search?' + urllib.parse.urlencode({'chip_name': chip}))
+    if scenario == "add_to_cart":
+        item = {'item_id': rng.choice(ctx.items)['item_id'], 'quantity_w': 0, 'quantity_gp': 1}
+        return client.request('POST', '/add_to_cart', json_body=item)
+    if scenario == "cart_batch":
+        ops = []
+        for item in rng.sample(ctx.items, min(BATCH_OPS, len(ctx.items))):
+            ops.append({'op': 'add', 'item_id': item['item_id'], 'quantity_w': 0, 'quantity_gp': 1})
+        return client.request('POST', '/cart/batch', json_body={'ops': ops})
+    if scenario == "cart":
+        return client.request('GET', '/cart')
+    if scenario == "export_cart":
+        return client.request('GET', '/export_cart?format=csv')
+    if scenario == "export_search":
+        return client.request('GET', '/export_search?' + urllib.parse.urlencode({'chip_name': chip, 'format': 'csv'}))
+    if scenario == "reports":
+        year = rng.choice(REPORT_YEARS)
+        params = {'group_by': rng.choice(REPORT_GROUPS), 'from': f'{year}-01-01', 'to': f'{year}-12-31'}
+        return client.request('GET', '/api/reports?' + urllib.parse.urlencode(params))
+    kind = scenario.split('_', 1)[1]
+    query = '?sync=1' if ctx.upload_commit else '?sync=1&dry_run=1'
+    return client.request('POST', f'/{kind}{query}', file_path=ctx.files[kind])
+
+
+def run_scenario(scenario, clients, ctx, total, warmup, seed):
+    """Выполняет total запросов сценария в len(clients) потоков; возвращает сводку."""
+    per_thread = max(total // len(clients), 1)
+    latencies, errors, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def worker(index, client):
+        rng = random.Random(seed * 1000 + index)
+        for _ in range(warmup):
+            try:
+                do_request(scenario, client, ctx, rng)
+            except Exception:
+                pass
+        local = []
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            try:
+                status, _ = do_request(scenario, client, ctx, rng)
+            except Exception:
+                status = 'exception'
+            local.append(time.perf_counter() - started)
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 'exception' or status >= 400:
+                    errors.append(status)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i, client)) for i, client in enumerate(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = summarize(latencies, len(errors), time.perf_counter() - started)
+    result['statuses'] = statuses
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест приложения склада')
+    parser.add_argument('--db', help='Имя БД бенчмарка (по умолчанию BENCH_DB_NAME или warehouse_bench)')
+    parser.add_argument('--base-url', help='Адрес запущенного сервера; без него - в этом процессе')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Сценарии через запятую')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400, help='Запросов на сценарий')
+    parser.add_argument('--upload-requests', type=int, default=8, help='Запросов на сценарий загрузки')
+    parser.add_argument('--warmup', type=int, default=2, help='Запросов прогрева на поток (не учитываются)')
+    parser.add_argument('--files', default='bench/files', help='Каталог с inflow/outflow/refund.xlsx')
+    parser.add_argument('--upload-commit', action='store_true', help='Загружать файлы в БД, а не только проверять (повторы того же файла пропускаются)')
+    parser.add_argument('--chip-filters', type=int, default=50, help='Сколько разных фильтров поиска')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Файл результата (по умолчанию bench/results/load-*.json)')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+    files = {kind: os.path.join(args.files, f"{kind}.xlsx") for kind in ("inflow", "outflow", "refund")}
+    if UPLOAD_SCENARIOS & set(scenarios):
+        missing = [path for path in files.values() if not os.path.exists(path)]
+        if missing:
+            raise SystemExit(f"Нет файлов загрузки: {', '.join(missing)} (bench/datagen.py --excel-dir)")
+
+    if args.base_url:
+        client_factory = lambda: HttpClient(args.base_url)
+        target = args.base_url
+    else:
+        target = use_bench_database(args.db)
+        from app import app
+        app.config['TESTING'] = True
+        client_factory = lambda: AppClient(app)
+
+    clients = []
+    for i in range(args.threads):
+        client = client_factory()
+        login(client, f"bench-user-{i + 1}")
+        clients.append(client)
+
+    rng = random.Random(args.seed)
+    chip_filters = [f"n_chip-{rng.randint(1, 500)}" for _ in range(args.chip_filters)]
+    status, body = clients[0].request('GET', '/api/search?page_size=1000')
+    items = json.loads(body).get('items', []) if status == 200 else []
+    if not items and {'add_to_cart', 'cart_batch'} & set(scenarios):
+        raise SystemExit("Поиск не вернул позиций: сгенерируйте данные bench/datagen.py")
+    ctx = Context(items, chip_filters, files, args.upload_commit)
+
+    results = {}
+    print(f"{'Сценарий':<16}{'запросов':>9}{'ошибок':>8}{'запр/с':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for scenario in scenarios:
+        total = args.upload_requests if scenario in UPLOAD_SCENARIOS else args.requests
+        warmup = 0 if scenario in UPLOAD_SCENARIOS else args.warmup
+        result = run_scenario(scenario, clients, ctx, total, warmup, args.seed)
+        results[scenario] = result
+        print(f"{scenario:<16}{result['requests']:>9}{result['errors']:>8}{result['throughput_rps'] or 0:>9.1f}"
+              f"{result['p50_ms'] or 0:>10.1f}{result['p95_ms'] or 0:>10.1f}{result['p99_ms'] or 0:>10.1f}")
+
+    params = {
+        'target': target,
+        'threads': args.threads,
+        'requests': args.requests,
+        'upload_requests': args.upload_requests,
+        'warmup': args.warmup,
+        'upload_commit': args.upload_commit,
+        'seed': args.seed,
+    }
+    path = save_results('load', params, results, args.output)
+    print(f"Результат: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+-- Синтетическая схема склада для бенчмарков: создается только в отдельной БД бенчмарка.
+-- Повторяет таблицы рабочей БД, которые использует приложение; item_id позиции
+-- вычисляется из id справочников, так строки прихода и расхода одной позиции совпадают.
+-- Таблицы stock_balance, import_jobs и т.д. создаются миграциями из migrations/;
+-- столбцы названий в cart удаляет миграция 0006_cart_compact.sql, как и в рабочей БД.
+
+CREATE TABLE IF NOT EXISTS start_p (id serial PRIMARY KEY, name_start text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS pr (id serial PRIMARY KEY, name_pr text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS tech (id serial PRIMARY KEY, name_tech text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS lot (id serial PRIMARY KEY, name_lot text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS wafer (id serial PRIMARY KEY, name_wafer text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS quad (id serial PRIMARY KEY, name_quad text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS in_lot (id serial PRIMARY KEY, in_lot text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS chip (id serial PRIMARY KEY, name_chip text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS n_chip (id serial PRIMARY KEY, n_chip text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS size_c (id serial PRIMARY KEY, size text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS pack (id serial PRIMARY KEY, name_pack text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS stor (id serial PRIMARY KEY, name_stor text NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS cells (id serial PRIMARY KEY, name_cells text NOT NULL UNIQUE);
+
+-- item_id как concat_ws('-', ...) без пустых значений. Сам concat_ws не IMMUTABLE (вывод значений
+-- зависит от настроек сеанса), а выражение генерируемого столбца обязано им быть
+CREATE OR REPLACE FUNCTION bench_item_id(VARIADIC ids integer[]) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$ SELECT array_to_string(ids, '-') $$;
+
+CREATE TABLE IF NOT EXISTS invoice (
+    id bigserial PRIMARY KEY,
+    item_id text GENERATED ALWAYS AS (
+        bench_item_id(id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip)
+    ) STORED,
+    id_start integer REFERENCES start_p (id),
+    id_pr integer REFERENCES pr (id),
+    id_tech integer REFERENCES tech (id),
+    id_lot integer REFERENCES lot (id),
+    id_wafer integer REFERENCES wafer (id),
+    id_quad integer REFERENCES quad (id),
+    id_in_lot integer REFERENCES in_lot (id),
+    id_n_chip integer REFERENCES n_chip (id),
+    id_chip integer REFERENCES chip (id),
+    id_size integer REFERENCES size_c (id),
+    id_pack integer REFERENCES pack (id),
+    id_stor integer REFERENCES stor (id),
+    id_cells integer REFERENCES cells (id),
+    date date,
+    quan_w integer,
+    quan_gp integer,
+    note text
+);
+
+CREATE TABLE IF NOT EXISTS consumption (
+    id bigserial PRIMARY KEY,
+    item_id text GENERATED ALWAYS AS (
+        bench_item_id(id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip)
+    ) STORED,
+    id_start integer REFERENCES start_p (id),
+    id_pr integer REFERENCES pr (id),
+    id_tech integer REFERENCES tech (id),
+    id_lot integer REFERENCES lot (id),
+    id_wafer integer REFERENCES wafer (id),
+    id_quad integer REFERENCES quad (id),
+    id_in_lot integer REFERENCES in_lot (id),
+    id_n_chip integer REFERENCES n_chip (id),
+    id_stor integer REFERENCES stor (id),
+    id_cells integer REFERENCES cells (id),
+    date date,
+    cons_w integer,
+    cons_gp integer,
+    note text,
+    transf_man text,
+    reciver text
+);
+
+CREATE INDEX IF NOT EXISTS invoice_item_id_idx ON invoice (item_id);
+CREATE INDEX IF NOT EXISTS consumption_item_id_idx ON consumption (item_id);
+
+CREATE TABLE IF NOT EXISTS users (
+    id serial PRIMARY KEY,
+    username text NOT NULL UNIQUE,
+    password text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_logs (
+    id bigserial PRIMARY KEY,
+    user_id integer,
+    action_type text,
+    file_name text,
+    target_table text,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS cart (
+    user_id integer NOT NULL REFERENCES users (id),
+    item_id text NOT NULL,
+    cons_w integer NOT NULL DEFAULT 0,
+    cons_gp integer NOT NULL DEFAULT 0,
+    start text,
+    manufacturer text,
+    technology text,
+    wafer text,
+    quadrant text,
+    lot text,
+    internal_lot text,
+    chip_code text,
+    note text,
+    stor text,
+    cells text,
+    date_added date,
+    PRIMARY KEY (user_id, item_id)
+);
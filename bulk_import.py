@@ -0,0 +1,128 @@
+# Пакетная загрузка каталога файлов из командной строки (flask warehouse import): файлы одного вида
+# загружаются параллельно в пуле процессов, каждый - через ingest.run_upload своей транзакцией, как из веб-формы.
+# Файл, прерванный взаимной блокировкой с параллельным файлом, run_upload загружает заново.
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import db
+import ingest
+import upload_reader
+
+FILE_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+# Итог загрузки файла (status в load_file) для вывода
+STATUS_TITLES = {
+    "done": "загружен",
+    "checked": "проверен, ошибок нет",
+    "duplicate": "уже загружен",
+    "invalid": "ошибки в строках",
+    "failed": "ошибка",
+}
+# Сколько ошибочных строк файла показывать в итоге
+SHOWN_ERRORS = 5
+
+
+def file_kind(root, path):
+    """Вид загрузки по имени подкаталога или файла: inflow/..., outflow_2024.xlsx. None, если не определен."""
+    first = os.path.relpath(path, root).split(os.sep)[0].lower()
+    for kind in ingest.UPLOAD_KINDS:
+        if first.startswith(kind):
+            return kind
+    return None
+
+
+def find_files(root, kind=None):
+    """Файлы каталога root (с подкаталогами) для загрузки: ([(вид, путь)], [пропущенные пути]).
+
+    Если kind не задан, вид определяется по file_kind. Файлы упорядочены по убыванию размера,
+    чтобы самые долгие загрузки каждого вида начинались первыми.
+    """
+    files, skipped = [], []
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            path = os.path.join(directory, name)
+            if name.startswith(('.', '~$')) or not name.lower().endswith(FILE_EXTENSIONS):
+                continue
+            file_kind_ = kind or file_kind(root, path)
+            if file_kind_ is None:
+                skipped.append(path)
+            else:
+                files.append((file_kind_, path))
+    files.sort(key=lambda item: os.path.getsize(item[1]), reverse=True)
+    return files, skipped
+
+
+def _init_worker():
+    # Соединения пула родительского процесса нельзя использовать после fork
+    db.reset_pool()
+
+
+def load_file(kind, path, user_id=None, dry_run=False, loader=None, chunk_size=None):
+    """Загружает один файл; возвращает итог для сводки (выполняется в процессе пула).
+
+    status: done (загружен), checked (dry_run, ошибок нет), duplicate (уже загружался),
+    invalid (ошибочные строки, файл не загружен), failed (файл не прочитан или ошибка БД).
+    """
+    result = {"kind": kind, "path": path, "status": "failed", "rows": 0, "inserted": 0, "attempts": 1,
+              "elapsed": 0.0, "rows_per_second": None, "error": None, "errors": []}
+    started = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            report = ingest.run_upload(kind, f, os.path.basename(path), user_id, None, dry_run, loader, chunk_size)
+        result.update(rows=report["rows"], inserted=report["inserted"], attempts=report["attempts"],
+                      rows_per_second=report["rows_per_second"])
+        if report["duplicate_of"]:
+            result["status"] = "duplicate"
+        elif report["error_count"]:
+            result.update(status="invalid", errors=report["errors"][:SHOWN_ERRORS])
+        else:
+            result["status"] = "checked" if dry_run else "done"
+    except ingest.UploadValidationError as e:
+        report = e.report.as_dict()
+        result.update(status="invalid", rows=report["rows"], error=str(e), errors=report["errors"][:SHOWN_ERRORS])
+    except upload_reader.UploadFormatError as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run(files, workers, on_result=None, **options):
+    """Загружает файлы [(вид, путь)] в workers процессах; возвращает итоги load_file в порядке завершения.
+
+    Виды загружаются по очереди в порядке ingest.UPLOAD_KINDS: сначала весь приход (он добавляет
+    позиции и значения справочников), затем расход, затем возврат; файлы одного вида - параллельно.
+    Очередность видов не исключает взаимных блокировок файлов одного вида с общими позициями:
+    такой файл повторяется (ingest.UPLOAD_RETRIES), а не считается ошибочным.
+    options передаются в load_file (user_id, dry_run, loader, chunk_size), on_result(итог)
+    вызывается по мере завершения файлов.
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for kind in ingest.UPLOAD_KINDS:
+            futures = [executor.submit(load_file, kind, path, **options)
+                       for file_kind_, path in files if file_kind_ == kind]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+    return results
+
+
+def summary(results, elapsed):
+    """Сводка пакетной загрузки: файлы по статусам, строки и общая скорость."""
+    statuses = {}
+    for result in results:
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    rows = sum(result["rows"] for result in results)
+    return {
+        "files": len(results),
+        "statuses": statuses,
+        "rows": rows,
+        "inserted": sum(result["inserted"] for result in results),
+        "elapsed": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed > 0 else None,
+    }
@@ -0,0 +1,73 @@
+# Списание корзины в расход (consumption) одним запросом, без выгрузки и повторной загрузки Excel
+
+# Позиции корзины, которых на складе нет или меньше, чем в корзине (строки остатков заблокированы заранее)
+SHORTAGES = """
+    SELECT c.item_id, c.cons_w, c.cons_gp,
+           COALESCE(b.quan_w - b.cons_w, 0), COALESCE(b.quan_gp - b.cons_gp, 0)
+    FROM cart c
+    LEFT JOIN stock_balance b ON b.item_id = c.item_id
+    WHERE c.user_id = %s
+      AND (b.item_id IS NULL OR c.cons_w > b.quan_w - b.cons_w OR c.cons_gp > b.quan_gp - b.cons_gp)
+    ORDER BY c.item_id
+"""
+
+# Корзина удаляется и сразу вставляется в consumption: id справочников берутся из stock_balance
+# по item_id, названия не сопоставляются заново
+CHECKOUT = """
+    WITH moved AS (
+        DELETE FROM cart
+        WHERE user_id = %(user_id)s
+        RETURNING item_id, cons_w, cons_gp
+    )
+    INSERT INTO consumption (
+        id_start, id_pr, id_tech, id_lot, id_wafer, id_quad, id_in_lot, id_n_chip,
+        date, cons_w, cons_gp, note, transf_man, reciver, id_stor, id_cells
+    )
+    SELECT b.id_start, b.id_pr, b.id_tech, b.id_lot, b.id_wafer, b.id_quad, b.id_in_lot, b.id_n_chip,
+           %(date)s, COALESCE(m.cons_w, 0), COALESCE(m.cons_gp, 0), b.note, %(transf_man)s, %(reciver)s,
+           b.id_stor, b.id_cells
+    FROM moved m
+    JOIN stock_balance b ON b.item_id = m.item_id
+    WHERE COALESCE(m.cons_w, 0) > 0 OR COALESCE(m.cons_gp, 0) > 0
+"""
+
+
+class CheckoutError(Exception):
+    """Корзину нельзя списать: shortages - [(item_id, в корзине w, gp, остаток w, gp)]."""
+
+    def __init__(self, message, shortages=()):
+        self.shortages = list(shortages)
+        super().__init__(message)
+
+
+def checkout(cur, user_id, checkout_date, transf_man=None, reciver=None):
+    """Списывает корзину пользователя в consumption в текущей транзакции и возвращает число строк.
+
+    Строки остатков позиций корзины блокируются в порядке item_id (как при резервировании),
+    затем проверяется, что остатка хватает на всю корзину.
+    """
+    cur.execute("SELECT count(*) FROM cart WHERE user_id = %s", (user_id,))
+    if not cur.fetchone()[0]:
+        raise CheckoutError("Корзина пуста")
+    cur.execute("""
+        SELECT b.item_id FROM stock_balance b
+        WHERE b.item_id IN (SELECT item_id FROM cart WHERE user_id = %s)
+        ORDER BY b.item_id
+        FOR UPDATE OF b
+    """, (user_id,))
+    cur.execute(SHORTAGES, (user_id,))
+    shortages = cur.fetchall()
+    if shortages:
+        raise CheckoutError(f"Недостаточно остатка по позициям: {len(shortages)}", shortages)
+    cur.execute(CHECKOUT, {
+        'user_id': user_id,
+        'date': checkout_date,
+        'transf_man': transf_man,
+        'reciver': reciver,
+    })
+    rows = cur.rowcount
+    cur.execute(
+        "INSERT INTO user_logs (user_id, action_type, file_name, target_table) VALUES (%s, %s, %s, %s)",
+        (user_id, "Списание корзины", None, "consumption")
+    )
+    return rows
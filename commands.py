@@ -0,0 +1,331 @@
+# Команды обслуживания БД склада: flask --app app warehouse <команда>
+
+import click
+from flask.cli import AppGroup
+
+import balance
+import copy_loader
+import ingest
+import partitions
+import reports
+import response_cache
+import schema
+import stock_search
+from db import get_db_connection
+
+warehouse = AppGroup('warehouse', help='Обслуживание БД склада.')
+
+
+@warehouse.command('migrate')
+def migrate_command():
+    """Применить новые миграции схемы БД."""
+    conn = get_db_connection()
+    try:
+        applied = schema.migrate(conn)
+    finally:
+        conn.close()
+    if applied:
+        click.echo("Применены миграции: " + ", ".join(applied))
+    else:
+        click.echo("Схема БД в актуальном состоянии")
+
+
+@warehouse.command('rebuild-balance')
+def rebuild_balance_command():
+    """Пересчитать таблицу остатков stock_balance по всей истории движений."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            count = balance.rebuild_balance(cur)
+            response_cache.mark_changed(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f"Остатки пересчитаны: {count} позиций")
+
+
+@warehouse.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Пересчитать дневные итоги движений movement_daily для отчетов."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            count = reports.rebuild(cur)
+            response_cache.mark_changed(cur)
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f"Итоги пересчитаны: {count} строк")
+
+
+@warehouse.command('verify-balance')
+@click.option('--limit', default=100, show_default=True, help='Сколько расхождений показать.')
+def verify_balance_command(limit):
+    """Сверить таблицу остатков с историей движений (код возврата 1 при расхождениях)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            mismatches = balance.verify_balance(cur, limit)
+    finally:
+        conn.close()
+    if not mismatches:
+        click.echo("Расхождений нет")
+        return
+    for item_id, column, actual, expected in mismatches:
+        click.echo(f"{item_id}: {column}: в таблице {actual}, ожидается {expected}")
+    raise SystemExit(1)
+
+
+@warehouse.command('explain-check')
+def explain_check_command():
+    """Проверить по EXPLAIN, что поиск по подстроке использует триграммные индексы.
+
+    Последовательное чтение запрещается на время проверки (stock_search.explain_check),
+    чтобы результат не зависел от размера таблиц. Код возврата 1 при ошибке.
+    """
+    failed = False
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for title, index_name, used in stock_search.explain_check(cur):
+                if index_name in used:
+                    click.echo(f"OK: {title} использует {index_name}")
+                else:
+                    failed = True
+                    click.echo(f"ОШИБКА: {title} не использует {index_name} (индексы в плане: {sorted(used)})")
+        conn.rollback()
+    finally:
+        conn.close()
+    if failed:
+        raise SystemExit(1)
+
+
+@warehouse.command('import-worker')
+@click.option('--workers', type=int, default=None, help='Одновременных загрузок (по умолчанию IMPORT_WORKERS).')
+def import_worker_command(workers):
+    """Выполнять задания загрузки из очереди в отдельном процессе (IMPORT_RUNNER=external)."""
+    import signal
+
+    import jobs
+
+    # SIGTERM останавливает обработчик так же, как Ctrl+C: дожидаемся выполняющихся загрузок
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    manager = jobs.JobManager(workers=workers or jobs.WORKERS, local=True)
+    click.echo(f"Обработчик загрузок запущен: {manager.workers} потоков")
+    try:
+        manager.run_forever()
+    except KeyboardInterrupt:
+        click.echo("Остановка: ожидание выполняющихся загрузок")
+        manager.shutdown()
+
+
+@warehouse.command('load')
+@click.argument('kind', type=click.Choice(list(ingest.UPLOAD_KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--loader', type=click.Choice(copy_loader.LOADERS), default='copy_binary',
+              show_default=True, help='Способ записи строк в БД.')
+@click.option('--chunk-size', type=int, default=None, help='Строк в порции (по умолчанию UPLOAD_CHUNK_SIZE).')
+@click.option('--user-id', type=int, default=None, help='Пользователь для журнала user_logs.')
+@click.option('--dry-run', is_flag=True, help='Только проверить файл, транзакция откатывается.')
+def load_command(kind, path, loader, chunk_size, user_id, dry_run):
+    """Загрузить большой файл прихода, расхода или возврата одной транзакцией (через COPY)."""
+    import os
+
+    import upload_reader
+
+    def progress(rows):
+        click.echo(f"\rОбработано строк: {rows}", nl=False)
+
+    file_name = os.path.basename(path)
+    try:
+        with open(path, 'rb') as f:
+            report = ingest.run_upload(kind, f, file_name, user_id, progress, dry_run, loader, chunk_size)
+    except ingest.UploadValidationError as e:
+        click.echo()
+        click.echo(f"Ошибка: {e}", err=True)
+        for error in e.report.as_dict()["errors"][:20]:
+            click.echo(f"  строка {error['row']}: {error['message']}", err=True)
+        raise SystemExit(1)
+    except upload_reader.UploadFormatError as e:
+        click.echo(f"Ошибка: {e}", err=True)
+        raise SystemExit(1)
+    click.echo()
+    if report["duplicate_of"]:
+        click.echo(f"Файл уже загружен {report['duplicate_of']['created_at']}: данные не изменены")
+        return
+    click.echo(f"{'Проверено' if dry_run else 'Загружено'} строк: {report['rows']} "
+               f"(новых {report['new']}, пропущено повторов {report['duplicates']}), "
+               f"способ: {report['loader']}, время: {report['elapsed']} с, "
+               f"скорость: {report['rows_per_second']} строк/с")
+
+
+@warehouse.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--kind', type=click.Choice(list(ingest.UPLOAD_KINDS)), default=None,
+              help='Вид всех файлов; по умолчанию - по имени подкаталога или файла (inflow/..., outflow_*.xlsx).')
+@click.option('--workers', type=int, default=None, help='Процессов загрузки (по умолчанию - число ядер).')
+@click.option('--loader', type=click.Choice(copy_loader.LOADERS), default='copy_binary',
+              show_default=True, help='Способ записи строк в БД.')
+@click.option('--chunk-size', type=int, default=None, help='Строк в порции (по умолчанию UPLOAD_CHUNK_SIZE).')
+@click.option('--user-id', type=int, default=None, help='Пользователь для журнала user_logs.')
+@click.option('--dry-run', is_flag=True, help='Только проверить файлы, транзакции откатываются.')
+def import_command(directory, kind, workers, loader, chunk_size, user_id, dry_run):
+    """Загрузить все файлы каталога параллельно, каждый файл - своей транзакцией (код возврата 1 при ошибках)."""
+    import os
+    import time
+
+    import bulk_import
+
+    files, skipped = bulk_import.find_files(directory, kind)
+    for path in skipped:
+        click.echo(f"Пропущен (вид загрузки не определен): {path}", err=True)
+    if not files:
+        click.echo("Нет файлов для загрузки")
+        return
+    workers = max(1, min(workers or os.cpu_count() or 1, len(files)))
+    click.echo(f"Файлов: {len(files)}, процессов: {workers}, способ записи: {loader}"
+               + (", только проверка" if dry_run else ""))
+
+    done = [0]
+
+    def on_result(result):
+        done[0] += 1
+        name = os.path.relpath(result["path"], directory)
+        line = (f"[{done[0]}/{len(files)}] {result['kind']} {name}: {bulk_import.STATUS_TITLES[result['status']]}, "
+                f"строк {result['rows']}, {result['elapsed']} с")
+        if result["rows_per_second"]:
+            line += f", {result['rows_per_second']} строк/с"
+        if result["attempts"] > 1:
+            line += f", попыток {result['attempts']}"
+        click.echo(line)
+        if result["error"]:
+            click.echo(f"    {result['error']}", err=True)
+        for error in result["errors"]:
+            click.echo(f"    строка {error['row']}: {error['message']}", err=True)
+
+    started = time.perf_counter()
+    results = bulk_import.run(files, workers, on_result, user_id=user_id, dry_run=dry_run,
+                              loader=loader, chunk_size=chunk_size)
+    total = bulk_import.summary(results, time.perf_counter() - started)
+    statuses = ", ".join(f"{bulk_import.STATUS_TITLES[status]} {count}"
+                         for status, count in sorted(total["statuses"].items()))
+    written = "" if dry_run else f", записано: {total['inserted']}"
+    click.echo(f"Итого файлов: {total['files']} ({statuses}); строк: {total['rows']}{written}; "
+               f"время: {total['elapsed']} с, скорость: {total['rows_per_second']} строк/с")
+    if any(status in total["statuses"] for status in ("invalid", "failed")):
+        raise SystemExit(1)
+
+
+@warehouse.command('export-cart')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--user-id', type=int, required=True, help='Чья корзина выгружается.')
+@click.option('--format', 'fmt', type=click.Choice(['xlsx', 'csv']), default=None,
+              help='Формат файла (по умолчанию - по расширению OUTPUT).')
+def export_cart_command(output, user_id, fmt):
+    """Выгрузить корзину пользователя в файл расхода (как /export_cart)."""
+    import export
+
+    fmt = fmt or ('csv' if output.lower().endswith('.csv') else 'xlsx')
+    rows = export.write_export(output, fmt, export.CART_EXPORT_COLUMNS, export.iter_cart_rows(user_id))
+    click.echo(f"Выгружено строк: {rows} в {output}")
+
+
+@warehouse.group('partitions')
+def partitions_group():
+    """Секционирование истории движений по дате и архивация старых периодов."""
+
+
+@partitions_group.command('convert')
+@click.option('--interval', type=click.Choice(['month', 'year']), default='month', show_default=True)
+@click.option('--ahead', default=3, show_default=True, help='Сколько будущих периодов создать.')
+def partitions_convert_command(interval, ahead):
+    """Перевести invoice и consumption на секции по дате (одна транзакция, таблицы блокируются)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for table in partitions.HISTORY_TABLES:
+                rows, count = partitions.convert(cur, table, interval, ahead)
+                click.echo(f"{table}: скопировано строк {rows}, секций {count}; "
+                           f"исходная таблица - {table}{partitions.LEGACY_SUFFIX}")
+        conn.commit()
+    except partitions.PartitionError as e:
+        conn.rollback()
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    click.echo("Проверьте остатки (flask warehouse verify-balance) и удалите исходные таблицы")
+
+
+@partitions_group.command('maintain')
+@click.option('--interval', type=click.Choice(['month', 'year']), default='month', show_default=True)
+@click.option('--ahead', default=3, show_default=True, help='Сколько будущих периодов должно быть создано.')
+def partitions_maintain_command(interval, ahead):
+    """Создать секции на ahead периодов вперед (запускать по расписанию)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for table in partitions.HISTORY_TABLES:
+                created = partitions.ensure_partitions(cur, table, interval, ahead)
+                click.echo(f"{table}: создано секций {len(created)}" + (f" ({', '.join(created)})" if created else ""))
+        conn.commit()
+    except partitions.PartitionError as e:
+        conn.rollback()
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+
+
+@partitions_group.command('restore-foreign-keys')
+def partitions_restore_foreign_keys_command():
+    """Вернуть внешние ключи на справочники таблицам, секционированным прежней версией convert."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for table in partitions.HISTORY_TABLES:
+                added = partitions.restore_foreign_keys(cur, table)
+                click.echo(f"{table}: восстановлено внешних ключей {len(added)}")
+        conn.commit()
+    except partitions.PartitionError as e:
+        conn.rollback()
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+
+
+@partitions_group.command('archive')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), required=True,
+              help='Архивировать периоды, которые целиком раньше этой даты.')
+@click.option('--drop', is_flag=True, help='Удалить секции, а не переносить в схему archive.')
+@click.option('--consumed-only', is_flag=True, help='Только периоды, все позиции которых израсходованы.')
+def partitions_archive_command(before, drop, consumed_only):
+    """Свернуть старые периоды в остатки на начало (stock_opening_balance) и отключить их секции."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            archived = partitions.archive(cur, before.date(), drop, consumed_only)
+        conn.commit()
+    except partitions.PartitionError as e:
+        conn.rollback()
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    for table, name, rows in archived:
+        click.echo(f"{table}: {name} - строк {rows}")
+    click.echo(f"Заархивировано секций: {len(archived)}")
+
+
+@partitions_group.command('list')
+def partitions_list_command():
+    """Показать секции invoice и consumption."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            for table in partitions.HISTORY_TABLES:
+                if not partitions.is_partitioned(cur, table):
+                    click.echo(f"{table}: не секционирована")
+                    continue
+                for name, start, end in partitions.list_partitions(cur, table):
+                    period = f"{start} - {end}" if start else "DEFAULT"
+                    click.echo(f"{table}: {name} ({period})")
+    finally:
+        conn.close()
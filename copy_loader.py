@@ -0,0 +1,167 @@
+# Запись строк загрузки через COPY ... FROM STDIN: строки кодируются в буфер в памяти (текстовый или
+# двоичный формат COPY), копируются во временную таблицу и переносятся в invoice/consumption одним INSERT ... SELECT
+
+import io
+import os
+import struct
+import zlib
+from datetime import date, datetime
+
+# Способ записи строк: values (execute_values), copy (COPY в текстовом формате) или copy_binary
+LOADERS = ("values", "copy", "copy_binary")
+LOADER = os.getenv('INGEST_LOADER', 'values')
+# Сколько байтов буфера передается серверу за одно чтение
+CHUNK_SIZE = 256 * 1024
+
+PG_EPOCH_DATE = date(2000, 1, 1)
+PG_EPOCH = datetime(2000, 1, 1)
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+BINARY_NULL = struct.pack(">i", -1)
+
+TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+# Типы столбцов временной таблицы: (таблица, столбцы) -> список типов PostgreSQL
+_column_types = {}
+
+
+class IterStream(io.RawIOBase):
+    """Файловый объект для copy_expert поверх генератора фрагментов байтов: в памяти один фрагмент."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _text_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.translate(TEXT_ESCAPES)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_text(rows, chunk_size=CHUNK_SIZE):
+    """Строки в текстовом формате COPY (табуляция между значениями, \\N - NULL) фрагментами по chunk_size."""
+    lines, size = [], 0
+    for row in rows:
+        line = "\t".join(_text_value(value) for value in row) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines).encode("utf-8")
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines).encode("utf-8")
+
+
+def _encode_text(value):
+    data = (value if isinstance(value, str) else str(value)).encode("utf-8")
+    return struct.pack(">i", len(data)) + data
+
+
+def _encode_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack(">ii", 4, (value - PG_EPOCH_DATE).days)
+
+
+def _encode_timestamp(value):
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    delta = value.replace(tzinfo=None) - PG_EPOCH
+    return struct.pack(">iq", 8, (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+# Кодирование значения в двоичном формате COPY: длина и данные в сетевом порядке байтов
+BINARY_ENCODERS = {
+    "smallint": lambda value: struct.pack(">ih", 2, value),
+    "integer": lambda value: struct.pack(">ii", 4, value),
+    "bigint": lambda value: struct.pack(">iq", 8, value),
+    "text": _encode_text,
+    "character varying": _encode_text,
+    "date": _encode_date,
+    "timestamp without time zone": _encode_timestamp,
+}
+
+
+def iter_binary(rows, types, chunk_size=CHUNK_SIZE):
+    """Строки в двоичном формате COPY фрагментами по chunk_size; types - типы столбцов по порядку."""
+    encoders = [BINARY_ENCODERS[type_] for type_ in types]
+    field_count = struct.pack(">h", len(types))
+    parts, size = [BINARY_HEADER], len(BINARY_HEADER)
+    for row in rows:
+        parts.append(field_count)
+        for encode, type_, value in zip(encoders, types, row):
+            try:
+                data = BINARY_NULL if value is None else encode(value)
+            except (struct.error, TypeError, ValueError, AttributeError):
+                # Исключение прерывает COPY, текст попадает в сообщение об ошибке сервера
+                raise ValueError(f"значение «{value}» не подходит для столбца типа {type_}")
+            parts.append(data)
+            size += len(data)
+        if size >= chunk_size:
+            yield b"".join(parts)
+            parts, size = [], 0
+    parts.append(BINARY_TRAILER)
+    yield b"".join(parts)
+
+
+def _types(cur, table, columns, stage):
+    key = (table, tuple(columns))
+    if key not in _column_types:
+        cur.execute("""
+            SELECT format_type(atttypid, NULL) FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+            ORDER BY attnum
+        """, (stage,))
+        _column_types[key] = [row[0] for row in cur.fetchall()]
+    return _column_types[key]
+
+
+def copy_rows(cur, table, columns, rows, binary=False):
+    """Записывает строки (кортежи значений в порядке columns) в table через COPY; возвращает их число.
+
+    Строки копируются во временную таблицу с теми же типами столбцов, затем переносятся
+    одним INSERT ... SELECT: ограничения и триггеры (stock_balance, movement_daily) срабатывают
+    один раз на пачку, как при execute_values. Временная таблица создается один раз на транзакцию
+    (своя для каждого набора столбцов) и очищается перед каждой пачкой. Если у столбца тип без
+    двоичного кодировщика, используется текстовый формат.
+
+    ON CONFLICT в переносе нет: у строк движений нет уникального ключа, кроме id, и две одинаковые
+    строки - два движения. Повторную загрузку отсеивают отпечатки файлов (fingerprints) до записи.
+    """
+    if not rows:
+        return 0
+    stage = f"copy_stage_{table}_{zlib.crc32(' '.join(columns).encode()):08x}"
+    names = ", ".join(columns)
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} ON COMMIT DROP AS SELECT {names} FROM {table} WITH NO DATA")
+    # DELETE, а не TRUNCATE: TRUNCATE на каждой пачке создает новый файл таблицы и меняет каталог
+    cur.execute(f"DELETE FROM {stage}")
+    types = _types(cur, table, columns, stage) if binary else None
+    if types is not None and all(type_ in BINARY_ENCODERS for type_ in types):
+        chunks, options = iter_binary(rows, types), "FORMAT binary"
+    else:
+        chunks, options = iter_text(rows), "FORMAT text"
+    cur.copy_expert(f"COPY {stage} ({names}) FROM STDIN WITH ({options})", IterStream(chunks), CHUNK_SIZE)
+    # Временная таблица не очищается VACUUM и читается в порядке записи, поэтому id строк идут в порядке файла
+    cur.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {stage}")
+    return cur.rowcount
@@ -0,0 +1,292 @@
+# Модуль работы с подключениями к PostgreSQL: потокобезопасный пул соединений
+
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+import metrics
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведенное время."""
+
+
+class PooledConnection:
+    """Обертка над соединением psycopg2: close() возвращает соединение в пул."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def close(self):
+        # Повторный close() ничего не делает, как и у обычного соединения
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+
+    @property
+    def closed(self):
+        return self._raw is None or self._raw.closed
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        # Соединение, которое забыли закрыть, все равно возвращается в пул
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+
+class ConnectionPool:
+    """Пул соединений с ограничением размера, проверкой при выдаче и пересозданием.
+
+    min_size      - сколько соединений держать открытыми постоянно;
+    max_size      - максимум одновременно открытых соединений;
+    timeout       - сколько секунд ждать свободное соединение;
+    max_uses      - после скольких выдач соединение закрывается (0 - без ограничения);
+    max_age       - через сколько секунд жизни соединение закрывается (0 - без ограничения);
+    ping_after    - после скольких секунд простоя перед выдачей выполняется SELECT 1.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10.0,
+                 max_uses=0, max_age=0, ping_after=5.0):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.ping_after = ping_after
+
+        self._lock = threading.Condition()
+        self._idle = deque()   # свободные соединения
+        self._meta = {}        # id(raw) -> {'created', 'uses', 'last_used'}
+        self._size = 0         # сколько соединений открыто сейчас
+        self._closed = False
+
+        # Метрики пула
+        self.stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'failed_checks': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+        }
+
+    def _register(self, raw):
+        now = time.monotonic()
+        self._meta[id(raw)] = {'created': now, 'uses': 0, 'last_used': now}
+        self.stats['created'] += 1
+        return raw
+
+    def _discard(self, raw):
+        self._meta.pop(id(raw), None)
+        self._size -= 1
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _expired(self, raw):
+        meta = self._meta[id(raw)]
+        if self.max_uses and meta['uses'] >= self.max_uses:
+            return True
+        if self.max_age and time.monotonic() - meta['created'] >= self.max_age:
+            return True
+        return False
+
+    def _healthy(self, raw):
+        if raw.closed:
+            return False
+        meta = self._meta[id(raw)]
+        if time.monotonic() - meta['last_used'] < self.ping_after:
+            return True
+        try:
+            with raw.cursor() as cur:
+                cur.execute("SELECT 1")
+            raw.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def fill(self):
+        """Открывает соединения до min_size."""
+        with self._lock:
+            while self._size < self.min_size:
+                self._size += 1
+                try:
+                    raw = self._register(self._connect())
+                except Exception:
+                    self._size -= 1
+                    raise
+                self._idle.append(raw)
+
+    def getconn(self):
+        """Выдает соединение из пула, при необходимости ожидая освобождения."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            raw = None
+            with self._lock:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"Нет свободных соединений с БД за {self.timeout} с (max_size={self.max_size})")
+                    waited = True
+                    self._lock.wait(remaining)
+                if self._idle:
+                    raw = self._idle.pop()
+                else:
+                    # Место в пуле занимаем сразу, а соединение открываем вне блокировки
+                    self._size += 1
+
+            if raw is None:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._register(raw)
+            elif not self._healthy(raw):
+                with self._lock:
+                    self.stats['failed_checks'] += 1
+                    self._discard(raw)
+                    self._lock.notify()
+                continue
+
+            with self._lock:
+                return self._checkout(raw, started, waited)
+
+    def _checkout(self, raw, started, waited):
+        meta = self._meta[id(raw)]
+        meta['uses'] += 1
+        self.stats['checkouts'] += 1
+        if waited:
+            wait_time = time.monotonic() - started
+            self.stats['waits'] += 1
+            self.stats['wait_time_total'] += wait_time
+            self.stats['wait_time_max'] = max(self.stats['wait_time_max'], wait_time)
+        return raw
+
+    def release(self, raw):
+        """Возвращает соединение в пул, откатывая незавершенную транзакцию."""
+        if not raw.closed and raw.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                raw.rollback()
+            except psycopg2.Error:
+                pass
+        with self._lock:
+            if id(raw) not in self._meta:
+                return
+            if raw.closed or self._closed or self._expired(raw):
+                self.stats['recycled'] += 1
+                self._discard(raw)
+            else:
+                self._meta[id(raw)]['last_used'] = time.monotonic()
+                self._idle.append(raw)
+            self._lock.notify()
+
+    def closeall(self):
+        """Закрывает все свободные соединения (например, при остановке сервера)."""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._lock.notify_all()
+
+    def snapshot(self):
+        """Текущее состояние пула и накопленные метрики."""
+        with self._lock:
+            data = dict(self.stats)
+            data.update(size=self._size, idle=len(self._idle), in_use=self._size - len(self._idle),
+                        min_size=self.min_size, max_size=self.max_size)
+        return data
+
+
+def connect():
+    """Новое соединение с БД вне пула (для долгоживущих соединений, например LISTEN).
+
+    Курсоры соединения замеряют время запросов (metrics.TimedCursor).
+    """
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST'),
+        database=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        cursor_factory=metrics.TimedCursor
+    )
+
+
+def _env_number(name, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, '') else default
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_enabled():
+    return os.getenv('DB_POOL_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+
+def get_pool():
+    """Возвращает пул процесса, создавая его при первом обращении (настройки из .env)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect,
+                    min_size=_env_number('DB_POOL_MIN', 1),
+                    max_size=_env_number('DB_POOL_MAX', 10),
+                    timeout=_env_number('DB_POOL_TIMEOUT', 10.0, float),
+                    max_uses=_env_number('DB_POOL_MAX_USES', 1000),
+                    max_age=_env_number('DB_POOL_MAX_AGE', 1800.0, float),
+                    ping_after=_env_number('DB_POOL_PING_AFTER', 5.0, float),
+                )
+    return _pool
+
+
+def reset_pool():
+    """Сбрасывает пул (после fork рабочего процесса или при остановке)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+
+
+def get_db_connection():
+    """Соединение с БД: из пула, если он включен, иначе новое.
+
+    У соединения из пула close() возвращает его в пул, поэтому вызывающий код
+    работает с ним так же, как с обычным соединением psycopg2.
+    """
+    if not pool_enabled():
+        return connect()
+    pool = get_pool()
+    return PooledConnection(pool, pool.getconn())
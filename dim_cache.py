@@ -0,0 +1,204 @@
+# Кэш справочников (name <-> id) в памяти процесса с TTL, LRU-вытеснением и сбросом через LISTEN/NOTIFY
+
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL, через который процессы сообщают друг другу об изменении справочников
+NOTIFY_CHANNEL = 'dim_cache'
+
+
+class DimensionCache:
+    """Потокобезопасный кэш значений справочников.
+
+    Хранит пары name -> id и id -> name для каждой таблицы, а также полные
+    списки значений (например, список производителей для фильтра поиска).
+    Записи живут ttl секунд, при превышении max_size вытесняются самые старые по использованию.
+    """
+
+    def __init__(self, max_size=10000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (вид, таблица, ключ) -> (значение, срок действия)
+        self._lists = {}               # таблица -> (список значений, срок действия)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_ids(self, table, names):
+        """Возвращает ({name: id} из кэша, [names, которых нет в кэше])."""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for name in names:
+                value = self._get(('n', table, name), now)
+                if value is None:
+                    missing.append(name)
+                else:
+                    found[name] = value
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def get_names(self, table, ids):
+        """Возвращает ({id: name} из кэша, [ids, которых нет в кэше])."""
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for id_ in ids:
+                value = self._get(('i', table, id_), now)
+                if value is None:
+                    missing.append(id_)
+                else:
+                    found[id_] = value
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, table, mapping):
+        """Запоминает пары {name: id} для таблицы."""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for name, id_ in mapping.items():
+                self._put(('n', table, name), id_, expires)
+                self._put(('i', table, id_), name, expires)
+
+    def store_created(self, created):
+        """Запись новых значений после фиксации транзакции: {таблица: {name: id}}.
+
+        Новые значения сразу видны в кэше, а списки значений этих таблиц сбрасываются.
+        """
+        for table, mapping in created.items():
+            if not mapping:
+                continue
+            self.put_many(table, mapping)
+            with self._lock:
+                self._lists.pop(table, None)
+
+    def names_list(self, table, loader):
+        """Полный список значений таблицы; loader() вызывается при промахе."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._lists.get(table)
+            if entry is not None and entry[1] >= now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        values = loader()
+        with self._lock:
+            self._lists[table] = (values, now + self.ttl)
+        return values
+
+    def invalidate(self, table=None):
+        """Сбрасывает кэш таблицы или весь кэш (table=None)."""
+        with self._lock:
+            self.invalidations += 1
+            if table is None:
+                self._entries.clear()
+                self._lists.clear()
+                return
+            for key in [key for key in self._entries if key[1] == table]:
+                del self._entries[key]
+            self._lists.pop(table, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'lists': len(self._lists),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+cache = DimensionCache(
+    max_size=int(os.getenv('DIM_CACHE_SIZE', 10000)),
+    ttl=float(os.getenv('DIM_CACHE_TTL', 300)),
+)
+
+
+def notify_enabled():
+    return os.getenv('DIM_CACHE_NOTIFY', '0').lower() in ('1', 'true', 'yes')
+
+
+def notify_changed(cur, tables):
+    """Отправляет другим процессам сигнал об изменении справочников.
+
+    Выполняется в текущей транзакции, поэтому сигнал доставляется только после COMMIT.
+    """
+    if not notify_enabled():
+        return
+    for table in sorted(set(tables)):
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, table))
+
+
+def start_listener(connect, poll_interval=5.0, handlers=None):
+    """Запускает фоновый поток LISTEN: по сигналу сбрасывается кэш указанной таблицы.
+
+    handlers - {канал: функция(payload)} для сигналов других кэшей (например, версии данных).
+    Сигналы из своего процесса тоже приходят, это безопасно: после сброса
+    значения просто будут загружены из БД заново.
+    """
+    channels = {NOTIFY_CHANNEL: cache.invalidate}
+    channels.update(handlers or {})
+
+    def listen():
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    for channel in channels:
+                        cur.execute(f"LISTEN {channel}")
+                # После переподключения сигналы могли быть пропущены
+                for handler in channels.values():
+                    handler(None)
+                while True:
+                    if select.select([conn], [], [], poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        channels[notify.channel](notify.payload or None)
+            except Exception as e:
+                logger.warning("Ошибка слушателя кэша справочников: %s", e)
+                time.sleep(poll_interval)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    thread = threading.Thread(target=listen, name='dim-cache-listener', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,147 @@
+# Потоковая выгрузка данных в Excel и CSV: строки читаются серверным курсором и сразу отдаются клиенту
+
+import csv
+import io
+import tempfile
+import uuid
+from datetime import date, datetime
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from db import get_db_connection
+
+# Сколько строк серверный курсор получает из БД за одно обращение
+ITERSIZE = 2000
+# Размер фрагмента ответа в байтах
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Столбцы файла выгрузки корзины (формат файла расхода для /outflow)
+CART_EXPORT_COLUMNS = [
+    "Номер запуска", "Производитель", "Технологический процесс", "Партия (Lot ID)", "Пластина (Wafer)",
+    "Quadrant", "Внутренняя партия", "Шифр кристалла", "Дата расхода",
+    "Расход Wafer, шт.", "Расход GelPack, шт.", "Расход общий, шт.", "Дата возврата",
+    "Возврат Wafer, шт.", "Возврат GelPack, шт.", "Возврат общий, шт.",
+    "Примечание", "Куда передано (Производственная партия)", "ФИО", "Место хранения", "Ячейка хранения"
+]
+
+CART_EXPORT_QUERY = """
+    SELECT
+        start AS "Номер запуска",
+        manufacturer AS "Производитель",
+        technology AS "Технологический процесс",
+        lot AS "Партия (Lot ID)",
+        wafer AS "Пластина (Wafer)",
+        quadrant AS "Quadrant",
+        internal_lot AS "Внутренняя партия",
+        chip_code AS "Шифр кристалла",
+        note AS "Примечание",
+        stor AS "Место хранения",
+        cells AS "Ячейка хранения",
+        date_added AS "Дата расхода",
+        cons_w AS "Расход Wafer, шт.",
+        cons_gp AS "Расход GelPack, шт."
+    FROM cart_view
+    WHERE user_id = %s
+    ORDER BY item_id
+"""
+
+# Столбцы, которые заполняются из CART_EXPORT_QUERY (в порядке запроса), остальные остаются пустыми
+FILLED_CART_COLUMNS = [
+    "Номер запуска", "Производитель", "Технологический процесс", "Партия (Lot ID)", "Пластина (Wafer)",
+    "Quadrant", "Внутренняя партия", "Шифр кристалла", "Примечание", "Место хранения", "Ячейка хранения",
+    "Дата расхода", "Расход Wafer, шт.", "Расход GelPack, шт."
+]
+
+
+def iter_query_rows(query, params=None, itersize=ITERSIZE):
+    """Строки запроса через именованный (серверный) курсор: в памяти не больше itersize строк.
+
+    Соединение удерживается, пока генератор не будет исчерпан или закрыт.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+    finally:
+        conn.close()
+
+
+def iter_cart_rows(user_id):
+    """Строки корзины пользователя в столбцах CART_EXPORT_COLUMNS; незаполняемые столбцы пустые."""
+    positions = [CART_EXPORT_COLUMNS.index(name) for name in FILLED_CART_COLUMNS]
+    for db_row in iter_query_rows(CART_EXPORT_QUERY, (user_id,)):
+        row = [None] * len(CART_EXPORT_COLUMNS)
+        for position, value in zip(positions, db_row):
+            row[position] = value
+        yield row
+
+
+def iter_csv(header, rows):
+    """CSV по частям. BOM в начале нужен, чтобы Excel открыл файл в UTF-8."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_xlsx(header, rows, sheet_name="Sheet1"):
+    """xlsx по частям. Книга пишется в режиме write-only во временный файл
+    (в памяти остается только текущая строка), затем файл отдается фрагментами."""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    worksheet.append(header)
+    for row in rows:
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(worksheet, value=value)
+            if isinstance(value, (date, datetime)):
+                cell.number_format = "YYYY-MM-DD"
+            cells.append(cell)
+        worksheet.append(cells)
+
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_export(fmt, header, rows):
+    """Генератор байтов файла выгрузки в формате fmt ('xlsx' или 'csv')."""
+    if fmt == 'csv':
+        return iter_csv(header, rows)
+    return iter_xlsx(header, rows)
+
+
+def write_export(path, fmt, header, rows):
+    """Записывает выгрузку в файл path; возвращает число строк данных."""
+    count = [0]
+
+    def counted():
+        for row in rows:
+            count[0] += 1
+            yield row
+
+    with open(path, 'wb') as f:
+        for chunk in iter_export(fmt, header, counted()):
+            f.write(chunk)
+    return count[0]
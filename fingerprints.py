@@ -0,0 +1,159 @@
+# Отпечатки загруженных файлов и строк: повторная загрузка того же файла или тех же строк не дублирует движения
+
+import hashlib
+import os
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+# Разделитель значений строки перед хэшированием
+SEPARATOR = '\x1f'
+# Размер блока чтения файла при подсчете хэша
+HASH_BLOCK = 1 << 20
+
+UPSERT_ROWS = """
+    INSERT INTO upload_rows (kind, key_hash, row_hash, upload_id) VALUES %s
+    ON CONFLICT (kind, key_hash) DO UPDATE SET row_hash = EXCLUDED.row_hash, upload_id = EXCLUDED.upload_id
+"""
+
+
+def row_dedupe_enabled():
+    """Сверять ли строки с уже загруженными другими файлами (UPLOAD_ROW_DEDUPE=1).
+
+    По умолчанию повтором считается только файл с тем же содержимым: у движения нет ключа,
+    который отличал бы повтор от второго такого же движения той же позиции в тот же день.
+    """
+    return os.getenv('UPLOAD_ROW_DEDUPE', '0').lower() in ('1', 'true', 'yes')
+
+
+def file_hash(file):
+    """sha256 содержимого файла; после чтения файл перематывается в начало."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(HASH_BLOCK), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.digest()
+
+
+def find_upload(cur, kind, content_hash):
+    """Предыдущая загрузка файла с тем же содержимым или None.
+
+    До конца транзакции берется блокировка по хэшу файла: одновременная загрузка
+    того же файла дождется окончания первой и увидит ее результат.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (int.from_bytes(content_hash[:8], 'big', signed=True),))
+    cur.execute("""
+        SELECT id, file_name, user_id, rows, created_at FROM upload_files
+        WHERE content_hash = %s AND kind = %s
+        ORDER BY id LIMIT 1
+    """, (content_hash, kind))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    id_, file_name, user_id, rows, created_at = row
+    return {
+        'upload_id': id_,
+        'file_name': file_name,
+        'user_id': user_id,
+        'rows': rows,
+        'created_at': created_at.isoformat() if created_at else None,
+    }
+
+
+def register_upload(cur, kind, content_hash, file_name, user_id):
+    """Запись о загружаемом файле в текущей транзакции; возвращает ее id."""
+    cur.execute(
+        "INSERT INTO upload_files (kind, content_hash, file_name, user_id) VALUES (%s, %s, %s, %s) RETURNING id",
+        (kind, content_hash, file_name, user_id)
+    )
+    return cur.fetchone()[0]
+
+
+def finish_upload(cur, upload_id, rows):
+    cur.execute("UPDATE upload_files SET rows = %s WHERE id = %s", (rows, upload_id))
+
+
+def _normalize(value):
+    # Значения уже приведены к типам схемы (upload_schema.validate): даты - без времени, количества - целые
+    if value is None or value is pd.NA or value is pd.NaT:
+        return ''
+    if isinstance(value, pd.Timestamp):
+        return value.date().isoformat()
+    return str(value)
+
+
+def _texts(df, columns):
+    present = [col for col in columns if col in df.columns]
+    return [SEPARATOR.join(_normalize(value) for value in row)
+            for row in df[present].astype(object).itertuples(index=False, name=None)]
+
+
+class RowFingerprints:
+    """Отпечатки строк одного файла для сверки с другими файлами (включается row_dedupe_enabled()).
+
+    Ключ строки - хэш естественного ключа (позиция, дата и т.п.) и номера его повторения
+    в файле, поэтому две одинаковые строки одного файла остаются двумя движениями.
+    Хэш строки - хэш всех ее значений после проверки по схеме, поэтому «5» и 5.0 или дата
+    с временем и без него дают одинаковый хэш. По ключам в upload_rows строка считается новой
+    (ключа нет), измененной (ключ есть, содержимое другое - ошибка) или повторной.
+    """
+
+    def __init__(self, kind, upload_id, key_columns, columns):
+        self.kind = kind
+        self.upload_id = upload_id
+        self.key_columns = key_columns
+        self.columns = columns
+        self._seen = {}  # хэш естественного ключа -> сколько раз встретился в файле
+
+    def _hashes(self, df):
+        keys, hashes = [], []
+        prefix = self.kind + SEPARATOR
+        for key_text, row_text in zip(_texts(df, self.key_columns), _texts(df, self.columns)):
+            base = hashlib.sha256((prefix + key_text).encode()).digest()
+            occurrence = self._seen.get(base, 0)
+            self._seen[base] = occurrence + 1
+            keys.append(hashlib.sha256(base + str(occurrence).encode()).digest())
+            hashes.append(hashlib.sha256(row_text.encode()).digest())
+        return keys, hashes
+
+    def filter(self, cur, df, report):
+        """Убирает из проверенной порции повторные строки и записывает отпечатки новых.
+
+        Новые, измененные и повторные строки считаются в report; повторные строки не
+        загружаются. Измененная строка (ключ
+        уже загружен другим файлом с другими значениями) - ошибка строки: ее загрузка
+        добавила бы второе движение к уже учтенному, и файл не загружается. Отпечатки
+        пишутся в текущей транзакции и откатываются вместе с загрузкой.
+        """
+        if df.empty:
+            return df
+        keys, hashes = self._hashes(df)
+        cur.execute("""
+            SELECT r.key_hash, r.row_hash, f.file_name, f.created_at
+            FROM upload_rows r
+            JOIN upload_files f ON f.id = r.upload_id
+            WHERE r.kind = %s AND r.key_hash = ANY(%s)
+        """, (self.kind, keys))
+        known = {bytes(key): (bytes(row_hash), file_name, created_at)
+                 for key, row_hash, file_name, created_at in cur.fetchall()}
+
+        keep, records = [], []
+        for number, key, row_hash in zip(df.index, keys, hashes):
+            previous = known.get(key)
+            if previous is None:
+                report.new += 1
+                keep.append(True)
+                records.append((self.kind, key, row_hash, self.upload_id))
+                continue
+            keep.append(False)
+            previous_hash, file_name, created_at = previous
+            if previous_hash == row_hash:
+                report.duplicates += 1
+                continue
+            report.add_changed(number)
+            loaded_at = created_at.strftime('%d.%m.%Y %H:%M') if created_at else '-'
+            report.add_error(number, f"строка уже загружена файлом «{file_name}» ({loaded_at}) с другими "
+                                     f"значениями: измененная строка не загружается, чтобы не задвоить движение")
+        if records:
+            execute_values(cur, UPSERT_ROWS, records, page_size=len(records))
+        return df[keep]
@@ -0,0 +1,67 @@
+# Конфигурация gunicorn (Linux): несколько процессов по числу ядер, в каждом - пул потоков и свой пул БД.
+#   gunicorn -c gunicorn.conf.py app:app
+# Настройки те же, что у serve.py (SERVER_*), число процессов - SERVER_WORKERS.
+
+import os
+
+
+def _env(name, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, '') else default
+
+
+def _cores():
+    # Ядра, доступные процессу (учитывает ограничения контейнера через affinity)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"{os.getenv('SERVER_HOST', '127.0.0.1')}:{_env('SERVER_PORT', 5000)}"
+workers = _env('SERVER_WORKERS', _cores())
+worker_class = 'gthread'
+threads = _env('SERVER_THREADS', 8)
+# Открытых соединений клиентов на процесс; остальные ждут в backlog
+worker_connections = _env('SERVER_CONNECTION_LIMIT', 200)
+backlog = _env('SERVER_BACKLOG', 2048)
+keepalive = _env('SERVER_KEEPALIVE', 5)
+timeout = _env('SERVER_TIMEOUT', 120)
+# Сколько секунд при остановке ждать текущие запросы и загрузки
+graceful_timeout = _env('SERVER_SHUTDOWN_TIMEOUT', 30)
+# Приложение загружается в каждом процессе после fork: пул БД и слушатель кэша справочников у каждого свои
+preload_app = False
+# Перезапуск процесса после N запросов (0 - без перезапуска)
+max_requests = _env('SERVER_MAX_REQUESTS', 0)
+max_requests_jitter = _env('SERVER_MAX_REQUESTS_JITTER', 0)
+accesslog = os.getenv('SERVER_ACCESS_LOG') or None
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def on_starting(server):
+    # Главный процесс до запуска воркеров: задания, выполнявшиеся при прошлой остановке, - обратно в очередь
+    import db
+    import jobs
+
+    if jobs.manager.local:
+        jobs.manager.recover(stale_after=0, start=False)
+    # Соединения главного процесса не должны достаться воркерам после fork
+    db.reset_pool()
+
+
+def post_worker_init(worker):
+    # Задания из очереди берет любой воркер: запуск одного задания дважды исключает _claim
+    import jobs
+
+    if jobs.manager.local:
+        jobs.manager.recover()
+
+
+def worker_exit(server, worker):
+    import db
+    import jobs
+
+    if not jobs.manager.shutdown(graceful_timeout):
+        worker.log.warning("Загрузки не завершились, они будут перезапущены при следующем старте")
+        return
+    db.reset_pool()
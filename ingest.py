@@ -0,0 +1,561 @@
+# Модуль загрузки Excel-файлов в БД: пакетное сопоставление справочников и вставка строк
+
+import logging
+import os
+import random
+import time
+
+import pandas as pd
+import psycopg2
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+import copy_loader
+import dim_cache
+import fingerprints
+import response_cache
+import upload_reader
+import upload_schema
+from upload_schema import DATE, INT, TEXT
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк отправлять в одном INSERT при execute_values
+PAGE_SIZE = 5000
+
+# Ошибки параллельных загрузок, после которых файл загружается заново: транзакция загрузки держит строки
+# stock_balance и movement_daily прошлых порций, пока блокирует строки следующих, и порядок позиций
+# в разных файлах разный
+RETRY_ERRORS = (errors.DeadlockDetected, errors.SerializationFailure)
+# Сколько раз повторять загрузку файла после такой ошибки
+UPLOAD_RETRIES = int(os.getenv('UPLOAD_RETRIES', 3))
+
+# Рекомендательная блокировка добавления значений в справочники: ключ (DIMENSION_LOCK, 0), одна на все таблицы
+DIMENSION_LOCK = 2
+
+# Справочники файла прихода: (столбец Excel, таблица, столбец таблицы, столбец invoice)
+INFLOW_DIMENSIONS = [
+    ("Номер запуска", "start_p", "name_start", "id_start"),
+    ("Производитель", "pr", "name_pr", "id_pr"),
+    ("Технологический процесс", "tech", "name_tech", "id_tech"),
+    ("Партия (Lot ID)", "lot", "name_lot", "id_lot"),
+    ("Пластина (Wafer)", "wafer", "name_wafer", "id_wafer"),
+    ("Quadrant", "quad", "name_quad", "id_quad"),
+    ("Внутренняя партия", "in_lot", "in_lot", "id_in_lot"),
+    ("Номер кристалла", "chip", "name_chip", "id_chip"),
+    ("Шифр кристалла", "n_chip", "n_chip", "id_n_chip"),
+    ("Размер кристалла", "size_c", "size", "id_size"),
+    ("Упаковка", "pack", "name_pack", "id_pack"),
+    ("Место хранения", "stor", "name_stor", "id_stor"),
+    ("Ячейка хранения", "cells", "name_cells", "id_cells"),
+]
+
+# Таблица и ее столбцы для записи строк файла прихода
+INFLOW_TARGET = ("invoice", [
+    "id_start", "id_tech", "id_chip", "id_lot", "id_wafer", "id_quad", "id_in_lot", "date", "quan_w",
+    "note", "id_pack", "id_cells", "id_n_chip", "id_pr", "id_size", "quan_gp", "id_stor",
+])
+
+# Порядок значений в строке для INFLOW_TARGET
+INFLOW_COLUMNS = [
+    "id_start", "id_tech", "id_chip", "id_lot", "id_wafer", "id_quad", "id_in_lot",
+    "Дата прихода", "Приход Wafer, шт.", "Примечание", "id_pack", "id_cells", "id_n_chip",
+    "id_pr", "id_size", "Приход GelPack, шт.", "id_stor",
+]
+
+
+# Справочники файлов расхода и возврата: значения должны уже существовать в БД
+REFERENCE_DIMENSIONS = [
+    ("Номер запуска", "start_p", "name_start", "id_start"),
+    ("Производитель", "pr", "name_pr", "id_pr"),
+    ("Технологический процесс", "tech", "name_tech", "id_tech"),
+    ("Партия (Lot ID)", "lot", "name_lot", "id_lot"),
+    ("Пластина (Wafer)", "wafer", "name_wafer", "id_wafer"),
+    ("Quadrant", "quad", "name_quad", "id_quad"),
+    ("Внутренняя партия", "in_lot", "in_lot", "id_in_lot"),
+    ("Шифр кристалла", "n_chip", "n_chip", "id_n_chip"),
+    ("Место хранения", "stor", "name_stor", "id_stor"),
+    ("Ячейка хранения", "cells", "name_cells", "id_cells"),
+]
+
+OUTFLOW_TARGET = ("consumption", [
+    "id_start", "id_pr", "id_tech", "id_lot", "id_wafer", "id_quad", "id_in_lot", "id_n_chip",
+    "date", "cons_w", "cons_gp", "note", "transf_man", "reciver", "id_stor", "id_cells",
+])
+
+OUTFLOW_COLUMNS = [
+    "id_start", "id_pr", "id_tech", "id_lot", "id_wafer", "id_quad", "id_in_lot", "id_n_chip",
+    "Дата расхода", "Расход Wafer, шт.", "Расход GelPack, шт.", "Примечание",
+    "Куда передано (Производственная партия)", "ФИО", "id_stor", "id_cells",
+]
+
+REFUND_TARGET = ("invoice", [
+    "id_start", "id_pr", "id_tech", "id_lot", "id_wafer", "id_quad", "id_in_lot", "id_n_chip",
+    "date", "quan_w", "quan_gp", "note", "id_stor", "id_cells",
+])
+
+REFUND_COLUMNS = [
+    "id_start", "id_pr", "id_tech", "id_lot", "id_wafer", "id_quad", "id_in_lot", "id_n_chip",
+    "Дата возврата", "Возврат Wafer, шт.", "Возврат GelPack, шт.", "note", "id_stor", "id_cells",
+]
+
+
+def dimension_schema(dimensions, storage_default=None):
+    """Текстовые столбцы справочников для схемы проверки: обязателен только шифр кристалла,
+    пустые место и ячейка хранения получают storage_default."""
+    schema = []
+    for excel_col, _, _, id_col in dimensions:
+        default = storage_default if id_col in ("id_stor", "id_cells") else None
+        schema.append((excel_col, TEXT, excel_col == "Шифр кристалла", default))
+    return schema
+
+
+# Схемы столбцов файлов для upload_schema.validate: (столбец, тип, обязательное значение, значение для пустых).
+# Дата движения обязательна, пустое количество - 0. В расходе и возврате пустые место и ячейка хранения - «-».
+INFLOW_SCHEMA = dimension_schema(INFLOW_DIMENSIONS) + [
+    ("Дата прихода", DATE, True, None),
+    ("Приход Wafer, шт.", INT, False, 0),
+    ("Приход GelPack, шт.", INT, False, 0),
+    ("Приход общий, шт.", INT, False, 0),
+    ("Примечание", TEXT, False, None),
+]
+OUTFLOW_SCHEMA = dimension_schema(REFERENCE_DIMENSIONS, storage_default="-") + [
+    ("Дата расхода", DATE, True, None),
+    ("Расход Wafer, шт.", INT, False, 0),
+    ("Расход GelPack, шт.", INT, False, 0),
+    ("Примечание", TEXT, False, None),
+    ("Куда передано (Производственная партия)", TEXT, False, None),
+    ("ФИО", TEXT, False, None),
+]
+REFUND_SCHEMA = dimension_schema(REFERENCE_DIMENSIONS, storage_default="-") + [
+    ("Дата возврата", DATE, True, None),
+    ("Возврат Wafer, шт.", INT, False, 0),
+    ("Возврат GelPack, шт.", INT, False, 0),
+]
+
+# Обязательные столбцы файлов: проверяются по строке заголовка до чтения данных
+INFLOW_REQUIRED = [col[0] for col in INFLOW_SCHEMA]
+OUTFLOW_REQUIRED = [col[0] for col in OUTFLOW_SCHEMA]
+REFUND_REQUIRED = [col[0] for col in REFUND_SCHEMA]
+
+# Естественные ключи строк для сверки с другими файлами (UPLOAD_ROW_DEDUPE): позиция, дата движения и получатель
+INFLOW_KEY = [dim[0] for dim in INFLOW_DIMENSIONS] + ["Дата прихода"]
+OUTFLOW_KEY = [dim[0] for dim in REFERENCE_DIMENSIONS] + [
+    "Дата расхода", "Куда передано (Производственная партия)", "ФИО",
+]
+REFUND_KEY = [dim[0] for dim in REFERENCE_DIMENSIONS] + ["Дата возврата"]
+
+
+class UploadReport:
+    """Итог проверки загружаемого файла: ошибки по строкам, неизвестные значения справочников
+    и сверка с ранее загруженными строками (новые, измененные, повторные).
+
+    Номер строки - номер строки в файле (заголовок - строка 1). Хранится не больше
+    MAX_ERRORS сообщений и номеров измененных строк, но считаются все.
+    """
+
+    MAX_ERRORS = 1000
+
+    def __init__(self):
+        self.rows = 0            # строк прочитано из файла
+        self.inserted = 0        # строк записано в БД
+        self.error_count = 0
+        self.errors = []         # (строка, сообщение)
+        self.missing = {}        # столбец Excel -> множество неизвестных значений
+        self.new = 0             # строк, которых не было в прошлых загрузках
+        self.changed = 0         # строк с тем же ключом, но другими значениями
+        self.changed_rows = []
+        self.duplicates = 0      # строк, уже загруженных раньше (пропущены)
+
+    @property
+    def ok(self):
+        return self.error_count == 0
+
+    def add_error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((int(row), message))
+
+    def add_missing(self, column, values):
+        self.missing.setdefault(column, set()).update(values)
+
+    def add_changed(self, row):
+        self.changed += 1
+        if len(self.changed_rows) < self.MAX_ERRORS:
+            self.changed_rows.append(int(row))
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "error_count": self.error_count,
+            "errors": [{"row": row, "message": message} for row, message in sorted(self.errors)],
+            "missing": {col: sorted(values) for col, values in self.missing.items()},
+            "new": self.new,
+            "changed": self.changed,
+            "changed_rows": sorted(self.changed_rows),
+            "duplicates": self.duplicates,
+        }
+
+
+class UploadValidationError(ValueError):
+    """В файле есть ошибочные строки; файл не загружен. report - полный отчет UploadReport."""
+
+    def __init__(self, report):
+        self.report = report
+        self.missing = {col: sorted(values) for col, values in report.missing.items()}
+        message = f"Файл не загружен: ошибок в строках - {report.error_count}"
+        if self.missing:
+            details = "; ".join(f"{col}: {', '.join(values)}" for col, values in self.missing.items())
+            message += f". Значения не найдены в справочниках: {details}"
+        super().__init__(message)
+
+
+def resolve_ids(cur, table, column, values):
+    """Возвращает словарь {значение: id} для существующих значений справочника.
+
+    Значения сначала ищутся в кэше справочников, остальные - одним запросом к БД.
+    """
+    found, missing = dim_cache.cache.get_ids(table, set(values))
+    if missing:
+        loaded = _select_ids(cur, table, column, missing)
+        dim_cache.cache.put_many(table, loaded)
+        found.update(loaded)
+    return found
+
+
+def map_reference_ids(cur, df, dimensions, report):
+    """Добавляет в df столбцы id справочников и возвращает строки, для которых все значения найдены.
+
+    Неизвестные значения собираются в report по всем столбцам (и по всему файлу),
+    а строки с ними отмечаются как ошибочные.
+    """
+    known = pd.Series(True, index=df.index)
+    for excel_col, table, column, id_col in dimensions:
+        names = df[excel_col]
+        present = names.notna()
+        ids = resolve_ids(cur, table, column, names[present].unique())
+        df[id_col] = names.map(ids)
+        unknown = df[id_col].isna() & present
+        if unknown.any():
+            report.add_missing(excel_col, set(names[unknown]))
+            for row, value in names[unknown].items():
+                report.add_error(row, f"{excel_col}: значение «{value}» не найдено в справочнике")
+            known &= ~unknown
+    df = df[known].copy()
+    # Пустое значение справочника - NULL
+    for _, _, _, id_col in dimensions:
+        df[id_col] = df[id_col].astype("Int64")
+    return df
+
+
+def row_writer(target, loader=None):
+    """Функция write(cur, rows), записывающая пачку строк в target = (таблица, столбцы).
+
+    loader - способ записи из copy_loader.LOADERS (по умолчанию INGEST_LOADER): values -
+    INSERT ... VALUES через execute_values, copy и copy_binary - COPY в текстовом или
+    двоичном формате через временную таблицу.
+    """
+    table, columns = target
+    loader = loader or copy_loader.LOADER
+    if loader not in copy_loader.LOADERS:
+        raise ValueError(f"Неизвестный способ записи строк: {loader}")
+    if loader == "values":
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s"
+        return lambda cur, rows: execute_values(cur, query, rows, page_size=PAGE_SIZE)
+    binary = loader == "copy_binary"
+    return lambda cur, rows: copy_loader.copy_rows(cur, table, columns, rows, binary)
+
+
+def insert_rows(cur, write, rows, row_numbers, report):
+    """Записывает строки функцией write (row_writer) под точкой сохранения. Если пачка не
+    записалась, она делится пополам, пока не останутся отдельные ошибочные строки: их ошибки
+    попадают в report. Взаимная блокировка с другой загрузкой (RETRY_ERRORS) - не ошибка строк:
+    она прерывает загрузку, и run_upload повторяет ее.
+
+    Возвращает количество вставленных строк.
+    """
+    if not rows:
+        return 0
+    cur.execute("SAVEPOINT upload_rows")
+    try:
+        write(cur, rows)
+        cur.execute("RELEASE SAVEPOINT upload_rows")
+        return len(rows)
+    except RETRY_ERRORS:
+        raise
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT upload_rows")
+        cur.execute("RELEASE SAVEPOINT upload_rows")
+        if len(rows) == 1:
+            report.add_error(row_numbers[0], (e.pgerror or str(e)).strip().splitlines()[0])
+            return 0
+    middle = len(rows) // 2
+    return (insert_rows(cur, write, rows[:middle], row_numbers[:middle], report)
+            + insert_rows(cur, write, rows[middle:], row_numbers[middle:], report))
+
+
+def resolve_or_create_ids(cur, table, column, values, created):
+    """Возвращает словарь {значение: id} для справочника, добавляя недостающие значения.
+
+    Значения, которых нет в кэше, ищутся одним запросом, отсутствующие добавляются
+    одним INSERT. Добавленные значения записываются в created[table] - в кэш они
+    попадают только после фиксации транзакции.
+
+    Уникальности названий в таблицах справочников нет, поэтому значения добавляются под одной
+    общей для всех справочников блокировкой, которая держится до конца транзакции: параллельная
+    загрузка с теми же новыми значениями дождется фиксации первой и найдет их запросом, начатым
+    после блокировки. Блокировка одна, поэтому загрузки, добавляющие значения в разные справочники
+    в разном порядке, не блокируют друг друга взаимно.
+    """
+    found, missing = dim_cache.cache.get_ids(table, set(values))
+    if not missing:
+        return found
+    existing = _select_ids(cur, table, column, missing)
+    found.update(existing)
+    missing = sorted(name for name in missing if name not in existing)
+    if missing:
+        cur.execute("SELECT pg_advisory_xact_lock(%s, 0)", (DIMENSION_LOCK,))
+        query = f"""
+            WITH v(name) AS (SELECT unnest(%s::text[])),
+            ins AS (
+                INSERT INTO {table} ({column})
+                SELECT v.name FROM v
+                WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{column} = v.name)
+                RETURNING id, {column}
+            )
+            SELECT r.name, MIN(r.id), bool_and(r.created) FROM (
+                SELECT {column} AS name, id, true AS created FROM ins
+                UNION ALL
+                SELECT t.{column}, t.id, false FROM {table} t JOIN v ON t.{column} = v.name
+            ) r
+            GROUP BY r.name
+        """
+        cur.execute(query, (missing,))
+        for name, id_, is_new in cur.fetchall():
+            found[name] = id_
+            if is_new:
+                created.setdefault(table, {})[name] = id_
+            else:
+                existing[name] = id_
+    dim_cache.cache.put_many(table, existing)
+    return found
+
+
+def _select_ids(cur, table, column, values):
+    """{значение: id} существующих значений справочника.
+
+    Прежний код загрузки записывал целые числа из Excel как «12345.0», а upload_schema.to_text
+    дает «12345»: такие значения ищутся в обоих видах, точное совпадение важнее.
+    """
+    values = list(values)
+    names = set(values)
+    legacy = {f"{value}.0": value for value in values
+              if value.lstrip("-").isdigit() and f"{value}.0" not in names}
+    cur.execute(f"SELECT {column}, MIN(id) FROM {table} WHERE {column} = ANY(%s) GROUP BY {column}",
+                (values + list(legacy),))
+    found, found_legacy = {}, {}
+    for name, id_ in cur.fetchall():
+        if name in legacy:
+            found_legacy[legacy[name]] = id_
+        else:
+            found[name] = id_
+    return {**found_legacy, **found}
+
+
+def column_values(series):
+    """Значения столбца в виде списка Python-объектов, пропуски (NaN/NaT) заменяются на None."""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def rows_for_insert(df, columns):
+    """Список кортежей для execute_values из столбцов DataFrame."""
+    return list(zip(*(column_values(df[col]) for col in columns)))
+
+
+def _finish_import(cur, target, df, columns, report, own_report, loader):
+    rows = rows_for_insert(df, columns)
+    inserted = insert_rows(cur, row_writer(target, loader), rows, df.index.tolist(), report)
+    report.inserted += inserted
+    if own_report and not report.ok:
+        raise UploadValidationError(report)
+    return inserted
+
+
+def import_inflow(cur, df, created=None, report=None, loader=None, row_prints=None):
+    """Загружает DataFrame файла прихода в invoice. Возвращает количество вставленных строк.
+
+    Столбцы проверяются и приводятся к типам по INFLOW_SCHEMA, для каждого справочника
+    уникальные значения сопоставляются одним запросом, id переносятся в строки через map(),
+    все строки записываются пачками способом loader (row_writer). Пустое значение справочника - NULL.
+    Транзакцией управляет вызывающий код; новые значения справочников возвращаются
+    в created, после COMMIT их нужно передать в dim_cache.cache.store_created().
+    Ошибки строк собираются в report; без report первая же порция с ошибками
+    завершается исключением UploadValidationError. row_prints (fingerprints.RowFingerprints) -
+    сверка проверенных строк с загруженными другими файлами.
+    """
+    own_report = report is None
+    report = UploadReport() if own_report else report
+    if created is None:
+        created = {}
+    report.rows += len(df)
+    df = upload_schema.validate(df, INFLOW_SCHEMA, report)
+    if row_prints is not None:
+        df = row_prints.filter(cur, df, report)
+
+    for excel_col, table, column, id_col in INFLOW_DIMENSIONS:
+        names = df[excel_col]
+        ids = resolve_or_create_ids(cur, table, column, names[names.notna()].unique(), created)
+        df[id_col] = names.map(ids).astype("Int64")
+    dim_cache.notify_changed(cur, created.keys())
+
+    return _finish_import(cur, INFLOW_TARGET, df, INFLOW_COLUMNS, report, own_report, loader)
+
+
+def import_outflow(cur, df, created=None, report=None, loader=None, row_prints=None):
+    """Загружает DataFrame файла расхода в consumption. Возвращает количество вставленных строк."""
+    own_report = report is None
+    report = UploadReport() if own_report else report
+    report.rows += len(df)
+    df = upload_schema.validate(df, OUTFLOW_SCHEMA, report)
+    if row_prints is not None:
+        df = row_prints.filter(cur, df, report)
+
+    df = map_reference_ids(cur, df, REFERENCE_DIMENSIONS, report)
+    return _finish_import(cur, OUTFLOW_TARGET, df, OUTFLOW_COLUMNS, report, own_report, loader)
+
+
+def import_refund(cur, df, created=None, report=None, loader=None, row_prints=None):
+    """Загружает DataFrame файла возврата в invoice. Возвращает количество вставленных строк."""
+    own_report = report is None
+    report = UploadReport() if own_report else report
+    report.rows += len(df)
+    df = upload_schema.validate(df, REFUND_SCHEMA, report)
+    if row_prints is not None:
+        df = row_prints.filter(cur, df, report)
+    df["note"] = "возврат"
+
+    df = map_reference_ids(cur, df, REFERENCE_DIMENSIONS, report)
+    return _finish_import(cur, REFUND_TARGET, df, REFUND_COLUMNS, report, own_report, loader)
+
+
+# Виды загрузок: обязательные столбцы, функция загрузки порции и запись в журнал user_logs
+UPLOAD_KINDS = {
+    "inflow": {
+        "required": INFLOW_REQUIRED,
+        "key": INFLOW_KEY,
+        "importer": import_inflow,
+        "action_type": "Загрузка файла: Приход",
+        "target_table": "invoice",
+    },
+    "outflow": {
+        "required": OUTFLOW_REQUIRED,
+        "key": OUTFLOW_KEY,
+        "importer": import_outflow,
+        "action_type": "Загрузка файла: Расход",
+        "target_table": "consumption",
+    },
+    "refund": {
+        "required": REFUND_REQUIRED,
+        "key": REFUND_KEY,
+        "importer": import_refund,
+        "action_type": "Загрузка файла: Возврат",
+        "target_table": "invoice",
+    },
+}
+
+
+def log_upload(cur, user_id, action_type, file_name, target_table):
+    """Запись о загрузке в user_logs в текущей транзакции."""
+    cur.execute(
+        "INSERT INTO user_logs (user_id, action_type, file_name, target_table) VALUES (%s, %s, %s, %s)",
+        (user_id, action_type, file_name, target_table)
+    )
+
+
+def _upload_once(spec, kind, file, file_name, user_id, content_hash, progress, dry_run, loader, chunk_size):
+    """Одна попытка run_upload: (report, прошлая загрузка файла или None, новые значения справочников)."""
+    created = {}
+    report = UploadReport()
+    previous = None
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            previous = fingerprints.find_upload(cur, kind, content_hash)
+            if previous is None:
+                upload_id = fingerprints.register_upload(cur, kind, content_hash, file_name, user_id)
+                row_prints = None
+                if fingerprints.row_dedupe_enabled():
+                    row_prints = fingerprints.RowFingerprints(kind, upload_id, spec["key"], spec["required"])
+                chunks = upload_reader.iter_chunks(file, file_name, spec["required"],
+                                                   chunk_size or upload_reader.CHUNK_SIZE)
+                for chunk in chunks:
+                    spec["importer"](cur, chunk, created, report, loader, row_prints)
+                    if progress is not None:
+                        progress(report.rows)
+                if not dry_run and report.ok:
+                    fingerprints.finish_upload(cur, upload_id, report.rows)
+                    log_upload(cur, user_id, spec["action_type"], file_name, spec["target_table"])
+                    response_cache.mark_changed(cur)
+        if dry_run or not report.ok or previous is not None:
+            conn.rollback()
+        else:
+            conn.commit()
+    finally:
+        conn.close()
+    return report, previous, created
+
+
+def run_upload(kind, file, file_name, user_id, progress=None, dry_run=False, loader=None,
+               chunk_size=None):
+    """Загружает файл вида kind ('inflow', 'outflow', 'refund') одной транзакцией.
+
+    Файл читается порциями, каждая порция вставляется под точкой сохранения, поэтому
+    ошибочная строка не прерывает проверку остальных. Если ошибки есть, транзакция
+    откатывается целиком и выбрасывается UploadValidationError с полным отчетом;
+    иначе выполняется один COMMIT на весь файл. При dry_run=True файл только проверяется:
+    транзакция откатывается всегда, а отчет возвращается.
+    Файл, уже загруженный раньше (тот же sha256), не разбирается: в отчете duplicate_of -
+    сведения о прошлой загрузке. При UPLOAD_ROW_DEDUPE=1 строки, загруженные раньше другими
+    файлами, пропускаются (fingerprints.RowFingerprints).
+    Если транзакция прервана взаимной блокировкой с параллельной загрузкой (RETRY_ERRORS),
+    файл загружается заново, до UPLOAD_RETRIES раз; число попыток - attempts в отчете.
+    После каждой порции вызывается progress(строк обработано).
+    loader - способ записи строк (row_writer), chunk_size - строк в порции (UPLOAD_CHUNK_SIZE).
+    Возвращает отчет UploadReport.as_dict() со временем загрузки (elapsed) и скоростью (rows_per_second).
+    """
+    started = time.perf_counter()
+    spec = UPLOAD_KINDS[kind]
+    loader = loader or copy_loader.LOADER
+    content_hash = fingerprints.file_hash(file)
+    attempt = 1
+    while True:
+        try:
+            report, previous, created = _upload_once(spec, kind, file, file_name, user_id, content_hash,
+                                                     progress, dry_run, loader, chunk_size)
+            break
+        except RETRY_ERRORS as e:
+            if attempt > UPLOAD_RETRIES:
+                raise
+            logger.warning("Загрузка %s прервана (%s), попытка %s", file_name, type(e).__name__, attempt + 1)
+            # Параллельные загрузки начинают заново в разное время, чтобы снова не столкнуться
+            time.sleep(random.uniform(0.05, 0.2) * attempt)
+            file.seek(0)
+            attempt += 1
+
+    elapsed = time.perf_counter() - started
+    result = report.as_dict()
+    result["dry_run"] = dry_run
+    result["duplicate_of"] = previous
+    result["loader"] = loader
+    result["attempts"] = attempt
+    result["elapsed"] = round(elapsed, 3)
+    result["rows_per_second"] = round(report.rows / elapsed) if elapsed > 0 else None
+    if dry_run or previous is not None:
+        return result
+    if not report.ok:
+        raise UploadValidationError(report)
+    dim_cache.cache.store_created(created)
+    response_cache.invalidate()
+    return result
@@ -0,0 +1,261 @@
+# Фоновые задания загрузки файлов: очередь в таблице import_jobs и ограниченный пул рабочих потоков
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import Json
+
+import ingest
+import metrics
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Сколько загрузок выполняется одновременно
+WORKERS = int(os.getenv('IMPORT_WORKERS', 2))
+# Каталог, куда сохраняются загруженные файлы до обработки
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+# Через сколько секунд без отметки о ходе выполнения задание считается прерванным
+STALE_AFTER = int(os.getenv('IMPORT_STALE_AFTER', 600))
+# Сколько раз задание перезапускается после сбоя процесса
+MAX_ATTEMPTS = int(os.getenv('IMPORT_MAX_ATTEMPTS', 3))
+# Как часто (в секундах) записывать в БД ход выполнения
+PROGRESS_INTERVAL = 1.0
+# Как часто (в секундах) отдельный обработчик заданий проверяет очередь
+POLL_INTERVAL = float(os.getenv('IMPORT_POLL_INTERVAL', 2))
+
+
+def async_enabled():
+    return os.getenv('IMPORT_ASYNC', '1').lower() not in ('0', 'false', 'no')
+
+
+def local_runner():
+    """Выполняет ли задания сам веб-процесс.
+
+    IMPORT_RUNNER=external - веб-процессы только ставят задания в очередь, выполняет их
+    отдельный процесс (flask warehouse import-worker), и загрузки не отнимают процессор у поиска.
+    """
+    return os.getenv('IMPORT_RUNNER', 'local').lower() != 'external'
+
+
+def _execute(query, params=None, fetch=False):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            result = cur.fetchall() if fetch else None
+        conn.commit()
+    finally:
+        conn.close()
+    return result
+
+
+class JobManager:
+    """Принимает загрузки в очередь и выполняет их в пуле из workers потоков."""
+
+    def __init__(self, workers=WORKERS, upload_dir=UPLOAD_DIR, local=None):
+        self.workers = workers
+        self.upload_dir = upload_dir
+        self.local = local_runner() if local is None else local
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import')
+            return self._executor
+
+    def submit(self, kind, file, file_name, user_id, dry_run=False):
+        """Сохраняет файл, ставит задание в очередь и возвращает его id.
+
+        dry_run=True - только проверка файла, без записи в БД.
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        ext = os.path.splitext(file_name or '')[1].lower()
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}{ext}")
+        try:
+            file.save(path)
+            job_id = _execute(
+                "INSERT INTO import_jobs (kind, file_name, path, user_id, dry_run) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                (kind, file_name, path, user_id, dry_run), fetch=True
+            )[0][0]
+        except Exception:
+            # Файл без задания никто не обработает и не удалит
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if self.local:
+            self._pool().submit(self._run, job_id)
+        return job_id
+
+    def _claim(self, job_id):
+        # Задание забирает только один поток (и только один процесс)
+        rows = _execute("""
+            UPDATE import_jobs
+            SET status = 'running', attempts = attempts + 1, rows_processed = 0,
+                started_at = now(), heartbeat_at = now(), finished_at = NULL, error = NULL
+            WHERE id = %s AND status = 'queued'
+            RETURNING kind, path, file_name, user_id, dry_run
+        """, (job_id,), fetch=True)
+        return rows[0] if rows else None
+
+    def _finish(self, job_id, status, error=None, result=None):
+        result = Json(result) if result is not None else None
+        _execute("""
+            UPDATE import_jobs
+            SET status = %s, error = %s, result = %s, finished_at = now(), heartbeat_at = now(),
+                rows_processed = COALESCE((%s::jsonb ->> 'rows')::bigint, rows_processed)
+            WHERE id = %s
+        """, (status, error, result, result, job_id))
+
+    def _run(self, job_id):
+        try:
+            job = self._claim(job_id)
+        except Exception as e:
+            logger.error("Не удалось запустить задание загрузки %s: %s", job_id, e)
+            return
+        if job is None:
+            return
+        kind, path, file_name, user_id, dry_run = job
+        last_report = [0.0]
+        started = time.monotonic()
+        outcome = {'status': 'failed', 'rows': 0}
+        metrics.begin_scope()
+
+        def progress(rows):
+            outcome['rows'] = rows
+            now = time.monotonic()
+            if now - last_report[0] >= PROGRESS_INTERVAL:
+                last_report[0] = now
+                _execute("UPDATE import_jobs SET rows_processed = %s, heartbeat_at = now() WHERE id = %s",
+                         (rows, job_id))
+
+        try:
+            if not os.path.exists(path):
+                self._finish(job_id, 'interrupted', "Файл задания не найден")
+                outcome['status'] = 'interrupted'
+                return
+            with open(path, 'rb') as f:
+                result = ingest.run_upload(kind, f, file_name, user_id, progress, dry_run)
+            self._finish(job_id, 'done', result=result)
+            outcome['status'] = 'done'
+        except Exception as e:
+            result = e.report.as_dict() if isinstance(e, ingest.UploadValidationError) else None
+            logger.warning("Задание загрузки %s завершилось ошибкой: %s", job_id, e)
+            try:
+                self._finish(job_id, 'failed', str(e), result)
+                spec = ingest.UPLOAD_KINDS[kind]
+                _execute(
+                    "INSERT INTO user_logs (user_id, action_type, file_name, target_table) VALUES (%s, %s, %s, %s)",
+                    (user_id, spec["action_type"] + " (ошибка)", file_name, spec["target_table"])
+                )
+            except Exception as log_error:
+                logger.error("Не удалось записать результат задания %s: %s", job_id, log_error)
+        finally:
+            metrics.finish_job(kind, outcome['status'], time.monotonic() - started, outcome['rows'])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get(self, job_id):
+        """Состояние задания: статус, обработано строк, скорость, ошибка. None, если задания нет."""
+        rows = _execute("""
+            SELECT id, kind, file_name, user_id, dry_run, status, attempts, rows_processed, error, result,
+                   created_at, started_at, finished_at,
+                   EXTRACT(EPOCH FROM COALESCE(finished_at, now()) - started_at)
+            FROM import_jobs
+            WHERE id = %s
+        """, (job_id,), fetch=True)
+        if not rows:
+            return None
+        (id_, kind, file_name, user_id, dry_run, status, attempts, rows_processed, error, result,
+         created_at, started_at, finished_at, elapsed) = rows[0]
+        elapsed = float(elapsed) if elapsed is not None else None
+        return {
+            'id': id_,
+            'kind': kind,
+            'file_name': file_name,
+            'user_id': user_id,
+            'dry_run': dry_run,
+            'status': status,
+            'attempts': attempts,
+            'rows_processed': rows_processed,
+            'rows_per_sec': round(rows_processed / elapsed, 1) if elapsed else None,
+            'elapsed_sec': round(elapsed, 3) if elapsed is not None else None,
+            'error': error,
+            'result': result,
+            'created_at': created_at.isoformat() if created_at else None,
+            'started_at': started_at.isoformat() if started_at else None,
+            'finished_at': finished_at.isoformat() if finished_at else None,
+        }
+
+    def recover(self, stale_after=STALE_AFTER, start=True):
+        """Восстановление после перезапуска сервера.
+
+        Задания, которые выполнялись и не отмечались stale_after секунд, перезапускаются
+        (загрузка идет одной транзакцией, поэтому прерванная загрузка ничего не оставила в БД)
+        либо, если попытки исчерпаны, помечаются как прерванные. Задания из очереди запускаются
+        снова. Единственный процесс, выполняющий задания, может передать stale_after=0: все задания
+        в статусе running принадлежали предыдущему запуску. start=False - только вернуть
+        прерванные задания в очередь (например, в главном процессе gunicorn до запуска воркеров).
+        """
+        _execute("""
+            UPDATE import_jobs
+            SET status = CASE WHEN attempts < %s THEN 'queued' ELSE 'interrupted' END,
+                error = 'Выполнение прервано перезапуском сервера'
+            WHERE status = 'running' AND heartbeat_at <= now() - %s * interval '1 second'
+        """, (MAX_ATTEMPTS, stale_after))
+        if not start:
+            return 0
+        queued = _execute("SELECT id FROM import_jobs WHERE status = 'queued' ORDER BY id", fetch=True)
+        for (job_id,) in queued:
+            self._pool().submit(self._run, job_id)
+        return len(queued)
+
+    def run_forever(self, poll_interval=POLL_INTERVAL):
+        """Отдельный обработчик заданий (IMPORT_RUNNER=external): берет задания из очереди в БД.
+
+        Одновременно выполняется не больше workers заданий; зависшие задания других
+        обработчиков перезапускаются по STALE_AFTER.
+        """
+        self.recover(start=False)
+        running = {}
+        last_recover = time.monotonic()
+        while True:
+            for job_id in [job_id for job_id, future in running.items() if future.done()]:
+                del running[job_id]
+            free = self.workers - len(running)
+            if free > 0:
+                queued = _execute(
+                    "SELECT id FROM import_jobs WHERE status = 'queued' AND NOT (id = ANY(%s)) ORDER BY id LIMIT %s",
+                    (list(running), free), fetch=True
+                )
+                for (job_id,) in queued:
+                    running[job_id] = self._pool().submit(self._run, job_id)
+            if time.monotonic() - last_recover >= STALE_AFTER:
+                last_recover = time.monotonic()
+                self.recover(start=False)
+            time.sleep(poll_interval)
+
+    def shutdown(self, timeout=None):
+        """Останавливает прием заданий и ждет выполняющиеся не дольше timeout секунд.
+
+        Задания из очереди остаются в статусе queued и запускаются после перезапуска.
+        Возвращает False, если выполняющиеся задания не успели завершиться.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return True
+        executor.shutdown(wait=False, cancel_futures=True)
+        waiter = threading.Thread(target=executor.shutdown, name='import-shutdown', daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+
+manager = JobManager()
@@ -0,0 +1,217 @@
+# Метрики производительности: время ответа по маршрутам, число и время запросов к БД, медленные запросы
+
+import logging
+import os
+import re
+import threading
+import time
+
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Запросы дольше SLOW_QUERY_MS миллисекунд пишутся в журнал (0 - не писать)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+# Предупреждение, если один HTTP-запрос выполнил больше запросов к БД (признак N+1)
+REQUEST_QUERY_WARN = int(os.getenv('REQUEST_QUERY_WARN', 50))
+
+# Границы корзин гистограмм: секунды для времени, штуки для числа запросов
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: накопительные счетчики по корзинам, сумма и количество."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Метрики процесса. Каждый рабочий процесс сервера считает свои метрики."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}   # (имя, метки) -> Histogram
+        self.counters = {}     # (имя, метки) -> число
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self):
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+        return histograms, counters
+
+
+registry = Registry()
+
+HELP = {
+    'http_request_duration_seconds': 'Время обработки HTTP-запроса',
+    'http_request_db_queries': 'Число запросов к БД за один HTTP-запрос',
+    'http_request_db_seconds': 'Время запросов к БД за один HTTP-запрос',
+    'db_queries_total': 'Всего запросов к БД',
+    'db_query_seconds_total': 'Суммарное время запросов к БД',
+    'db_slow_queries_total': 'Запросы к БД дольше SLOW_QUERY_MS',
+    'import_job_duration_seconds': 'Время выполнения задания загрузки',
+    'import_job_rows_total': 'Строк обработано заданиями загрузки',
+    'import_job_db_queries_total': 'Запросов к БД выполнено заданиями загрузки',
+}
+
+# Счетчики запросов к БД текущего потока (HTTP-запрос или задание загрузки)
+_local = threading.local()
+
+
+def begin_scope():
+    """Начинает подсчет запросов к БД в текущем потоке."""
+    _local.scope = {'queries': 0, 'db_time': 0.0}
+
+
+def end_scope():
+    """Завершает подсчет и возвращает {'queries': ..., 'db_time': ...}."""
+    scope = getattr(_local, 'scope', None)
+    _local.scope = None
+    return scope or {'queries': 0, 'db_time': 0.0}
+
+
+def _short_sql(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return re.sub(r'\s+', ' ', str(query)).strip()[:300]
+
+
+def record_query(query, elapsed):
+    """Учитывает выполненный запрос; медленный запрос пишется в журнал (без значений параметров)."""
+    registry.inc('db_queries_total')
+    registry.inc('db_query_seconds_total', value=elapsed)
+    scope = getattr(_local, 'scope', None)
+    if scope is not None:
+        scope['queries'] += 1
+        scope['db_time'] += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        registry.inc('db_slow_queries_total')
+        logger.warning("Медленный запрос (%.0f мс): %s", elapsed * 1000, _short_sql(query))
+
+
+class TimedCursor(extensions.cursor):
+    """Курсор psycopg2, который замеряет время каждого запроса."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+
+def finish_request(endpoint, method, status, elapsed):
+    """Учитывает завершенный HTTP-запрос.
+
+    Для потоковых ответов (выгрузки) учитывается время до начала передачи.
+    """
+    scope = end_scope()
+    labels = {'endpoint': endpoint, 'method': method, 'status': str(status)}
+    registry.observe('http_request_duration_seconds', labels, elapsed, LATENCY_BUCKETS)
+    registry.observe('http_request_db_queries', {'endpoint': endpoint}, scope['queries'], QUERY_COUNT_BUCKETS)
+    registry.observe('http_request_db_seconds', {'endpoint': endpoint}, scope['db_time'], LATENCY_BUCKETS)
+    if REQUEST_QUERY_WARN and scope['queries'] > REQUEST_QUERY_WARN:
+        logger.warning("%s %s выполнил %s запросов к БД за %.0f мс",
+                       method, endpoint, scope['queries'], elapsed * 1000)
+
+
+def finish_job(kind, status, elapsed, rows):
+    """Учитывает завершенное задание загрузки."""
+    scope = end_scope()
+    registry.observe('import_job_duration_seconds', {'kind': kind, 'status': status}, elapsed, JOB_BUCKETS)
+    registry.inc('import_job_rows_total', {'kind': kind}, rows or 0)
+    registry.inc('import_job_db_queries_total', {'kind': kind}, scope['queries'])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=None, counters=None):
+    """Метрики в текстовом формате Prometheus.
+
+    gauges - {имя: значение} для текущих показателей, counters - {имя: значение} для счетчиков
+    других модулей (пул соединений, кэши), которые только растут; их имена оканчиваются на _total.
+    """
+    histograms, own_counters = registry.collect()
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+        header(name, 'histogram')
+        for bound, value in zip(buckets, counts):
+            lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {value}")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    for (name, labels), value in sorted(own_counters.items()):
+        header(name, 'counter')
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    for name, value in sorted((counters or {}).items()):
+        if value is None:
+            continue
+        header(name, 'counter')
+        lines.append(f"{name} {_number(value)}")
+    for name, value in sorted((gauges or {}).items()):
+        if value is None:
+            continue
+        header(name, 'gauge')
+        lines.append(f"{name} {_number(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,176 @@
+-- Остатки по позициям склада (item_id), поддерживаются триггерами при записи в invoice и consumption.
+-- Поиск читает эту таблицу вместо агрегации всей истории движений.
+
+CREATE TABLE stock_balance AS
+SELECT item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+       note, id_stor, id_cells
+FROM invoice
+WITH NO DATA;
+
+ALTER TABLE stock_balance
+    ADD COLUMN quan_w bigint NOT NULL DEFAULT 0,
+    ADD COLUMN quan_gp bigint NOT NULL DEFAULT 0,
+    ADD COLUMN cons_w bigint NOT NULL DEFAULT 0,
+    ADD COLUMN cons_gp bigint NOT NULL DEFAULT 0,
+    ADD COLUMN invoice_rows integer NOT NULL DEFAULT 0,
+    ADD PRIMARY KEY (item_id);
+
+CREATE INDEX stock_balance_id_n_chip_idx ON stock_balance (id_n_chip);
+CREATE INDEX stock_balance_id_pr_idx ON stock_balance (id_pr);
+
+-- Эталонные остатки, посчитанные по всей истории: для перестроения и проверки stock_balance.
+-- Примечание берется из первой строки прихода, место и ячейка хранения - из последней.
+CREATE VIEW stock_balance_expected AS
+WITH inv AS (
+    SELECT item_id,
+           MIN(id_start) AS id_start, MIN(id_pr) AS id_pr, MIN(id_tech) AS id_tech,
+           MIN(id_wafer) AS id_wafer, MIN(id_lot) AS id_lot, MIN(id_in_lot) AS id_in_lot,
+           MIN(id_n_chip) AS id_n_chip, MIN(id_quad) AS id_quad,
+           (array_agg(note ORDER BY id) FILTER (WHERE note IS NOT NULL))[1] AS note,
+           (array_agg(id_stor ORDER BY id DESC) FILTER (WHERE id_stor IS NOT NULL))[1] AS id_stor,
+           (array_agg(id_cells ORDER BY id DESC) FILTER (WHERE id_cells IS NOT NULL))[1] AS id_cells,
+           SUM(COALESCE(quan_w, 0)) AS quan_w, SUM(COALESCE(quan_gp, 0)) AS quan_gp,
+           COUNT(*) AS invoice_rows
+    FROM invoice
+    GROUP BY item_id
+),
+cons AS (
+    SELECT item_id,
+           MIN(id_start) AS id_start, MIN(id_pr) AS id_pr, MIN(id_tech) AS id_tech,
+           MIN(id_wafer) AS id_wafer, MIN(id_lot) AS id_lot, MIN(id_in_lot) AS id_in_lot,
+           MIN(id_n_chip) AS id_n_chip, MIN(id_quad) AS id_quad,
+           SUM(COALESCE(cons_w, 0)) AS cons_w, SUM(COALESCE(cons_gp, 0)) AS cons_gp
+    FROM consumption
+    GROUP BY item_id
+)
+SELECT COALESCE(inv.item_id, cons.item_id) AS item_id,
+       COALESCE(inv.id_start, cons.id_start) AS id_start,
+       COALESCE(inv.id_pr, cons.id_pr) AS id_pr,
+       COALESCE(inv.id_tech, cons.id_tech) AS id_tech,
+       COALESCE(inv.id_wafer, cons.id_wafer) AS id_wafer,
+       COALESCE(inv.id_lot, cons.id_lot) AS id_lot,
+       COALESCE(inv.id_in_lot, cons.id_in_lot) AS id_in_lot,
+       COALESCE(inv.id_n_chip, cons.id_n_chip) AS id_n_chip,
+       COALESCE(inv.id_quad, cons.id_quad) AS id_quad,
+       inv.note, inv.id_stor, inv.id_cells,
+       COALESCE(inv.quan_w, 0) AS quan_w, COALESCE(inv.quan_gp, 0) AS quan_gp,
+       COALESCE(cons.cons_w, 0) AS cons_w, COALESCE(cons.cons_gp, 0) AS cons_gp,
+       COALESCE(inv.invoice_rows, 0)::integer AS invoice_rows
+FROM inv
+FULL JOIN cons ON cons.item_id = inv.item_id;
+
+-- Приращение остатков по строкам одного оператора над invoice
+CREATE FUNCTION stock_balance_apply_invoice() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE stock_balance b
+        SET quan_w = b.quan_w - d.quan_w,
+            quan_gp = b.quan_gp - d.quan_gp,
+            invoice_rows = b.invoice_rows - d.invoice_rows
+        FROM (
+            SELECT item_id, SUM(COALESCE(quan_w, 0)) AS quan_w, SUM(COALESCE(quan_gp, 0)) AS quan_gp,
+                   COUNT(*) AS invoice_rows
+            FROM old_rows
+            GROUP BY item_id
+        ) d
+        WHERE b.item_id = d.item_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO stock_balance AS b (
+            item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+            note, id_stor, id_cells, quan_w, quan_gp, invoice_rows
+        )
+        SELECT item_id,
+               MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+               MIN(id_n_chip), MIN(id_quad),
+               (array_agg(note ORDER BY id) FILTER (WHERE note IS NOT NULL))[1],
+               (array_agg(id_stor ORDER BY id DESC) FILTER (WHERE id_stor IS NOT NULL))[1],
+               (array_agg(id_cells ORDER BY id DESC) FILTER (WHERE id_cells IS NOT NULL))[1],
+               SUM(COALESCE(quan_w, 0)), SUM(COALESCE(quan_gp, 0)), COUNT(*)
+        FROM new_rows
+        GROUP BY item_id
+        ON CONFLICT (item_id) DO UPDATE SET
+            id_start = COALESCE(b.id_start, EXCLUDED.id_start),
+            id_pr = COALESCE(b.id_pr, EXCLUDED.id_pr),
+            id_tech = COALESCE(b.id_tech, EXCLUDED.id_tech),
+            id_wafer = COALESCE(b.id_wafer, EXCLUDED.id_wafer),
+            id_lot = COALESCE(b.id_lot, EXCLUDED.id_lot),
+            id_in_lot = COALESCE(b.id_in_lot, EXCLUDED.id_in_lot),
+            id_n_chip = COALESCE(b.id_n_chip, EXCLUDED.id_n_chip),
+            id_quad = COALESCE(b.id_quad, EXCLUDED.id_quad),
+            note = COALESCE(b.note, EXCLUDED.note),
+            id_stor = COALESCE(EXCLUDED.id_stor, b.id_stor),
+            id_cells = COALESCE(EXCLUDED.id_cells, b.id_cells),
+            quan_w = b.quan_w + EXCLUDED.quan_w,
+            quan_gp = b.quan_gp + EXCLUDED.quan_gp,
+            invoice_rows = b.invoice_rows + EXCLUDED.invoice_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Приращение остатков по строкам одного оператора над consumption
+CREATE FUNCTION stock_balance_apply_consumption() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE stock_balance b
+        SET cons_w = b.cons_w - d.cons_w,
+            cons_gp = b.cons_gp - d.cons_gp
+        FROM (
+            SELECT item_id, SUM(COALESCE(cons_w, 0)) AS cons_w, SUM(COALESCE(cons_gp, 0)) AS cons_gp
+            FROM old_rows
+            GROUP BY item_id
+        ) d
+        WHERE b.item_id = d.item_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO stock_balance AS b (
+            item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+            cons_w, cons_gp
+        )
+        SELECT item_id,
+               MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+               MIN(id_n_chip), MIN(id_quad),
+               SUM(COALESCE(cons_w, 0)), SUM(COALESCE(cons_gp, 0))
+        FROM new_rows
+        GROUP BY item_id
+        ON CONFLICT (item_id) DO UPDATE SET
+            cons_w = b.cons_w + EXCLUDED.cons_w,
+            cons_gp = b.cons_gp + EXCLUDED.cons_gp;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER stock_balance_invoice_ins AFTER INSERT ON invoice
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_invoice();
+CREATE TRIGGER stock_balance_invoice_upd AFTER UPDATE ON invoice
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_invoice();
+CREATE TRIGGER stock_balance_invoice_del AFTER DELETE ON invoice
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_invoice();
+
+CREATE TRIGGER stock_balance_consumption_ins AFTER INSERT ON consumption
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_consumption();
+CREATE TRIGGER stock_balance_consumption_upd AFTER UPDATE ON consumption
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_consumption();
+CREATE TRIGGER stock_balance_consumption_del AFTER DELETE ON consumption
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE stock_balance_apply_consumption();
+
+-- Начальное заполнение по существующей истории
+INSERT INTO stock_balance (
+    item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+    note, id_stor, id_cells, quan_w, quan_gp, cons_w, cons_gp, invoice_rows
+)
+SELECT item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+       note, id_stor, id_cells, quan_w, quan_gp, cons_w, cons_gp, invoice_rows
+FROM stock_balance_expected;
@@ -0,0 +1,7 @@
+-- Триграммные индексы для поиска по подстроке (ILIKE '%...%') в названиях справочников
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX n_chip_n_chip_trgm_idx ON n_chip USING gin (n_chip gin_trgm_ops);
+CREATE INDEX lot_name_lot_trgm_idx ON lot USING gin (name_lot gin_trgm_ops);
+CREATE INDEX start_p_name_start_trgm_idx ON start_p USING gin (name_start gin_trgm_ops);
@@ -0,0 +1,20 @@
+-- Очередь фоновых загрузок файлов (приход, расход, возврат)
+
+CREATE TABLE import_jobs (
+    id bigserial PRIMARY KEY,
+    kind text NOT NULL,
+    file_name text,
+    path text NOT NULL,
+    user_id integer,
+    status text NOT NULL DEFAULT 'queued',
+    attempts integer NOT NULL DEFAULT 0,
+    rows_processed bigint NOT NULL DEFAULT 0,
+    error text,
+    result jsonb,
+    created_at timestamp NOT NULL DEFAULT now(),
+    started_at timestamp,
+    heartbeat_at timestamp,
+    finished_at timestamp
+);
+
+CREATE INDEX import_jobs_status_idx ON import_jobs (status) WHERE status IN ('queued', 'running');
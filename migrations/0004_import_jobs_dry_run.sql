@@ -0,0 +1,3 @@
+-- Задания загрузки в режиме проверки: файл проверяется целиком, но ничего не записывается в БД
+
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS dry_run boolean NOT NULL DEFAULT false;
@@ -0,0 +1,3 @@
+-- Сумма резервов позиции во всех корзинах читается по индексу при каждом добавлении в корзину
+
+CREATE INDEX IF NOT EXISTS cart_item_id_idx ON cart (item_id);
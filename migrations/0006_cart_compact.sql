@@ -0,0 +1,45 @@
+-- Корзина хранит только позицию и количества; названия справочников берутся при чтении
+-- из stock_balance и справочников (представление cart_view), поэтому всегда совпадают со складом.
+
+ALTER TABLE cart
+    DROP COLUMN IF EXISTS start,
+    DROP COLUMN IF EXISTS manufacturer,
+    DROP COLUMN IF EXISTS technology,
+    DROP COLUMN IF EXISTS wafer,
+    DROP COLUMN IF EXISTS quadrant,
+    DROP COLUMN IF EXISTS lot,
+    DROP COLUMN IF EXISTS internal_lot,
+    DROP COLUMN IF EXISTS chip_code,
+    DROP COLUMN IF EXISTS note,
+    DROP COLUMN IF EXISTS stor,
+    DROP COLUMN IF EXISTS cells;
+
+CREATE VIEW cart_view AS
+SELECT c.item_id,
+       c.user_id,
+       s.name_start AS start,
+       p.name_pr AS manufacturer,
+       t.name_tech AS technology,
+       w.name_wafer AS wafer,
+       q.name_quad AS quadrant,
+       l.name_lot AS lot,
+       il.in_lot AS internal_lot,
+       nc.n_chip AS chip_code,
+       b.note,
+       st.name_stor AS stor,
+       ce.name_cells AS cells,
+       c.date_added,
+       c.cons_w,
+       c.cons_gp
+FROM cart c
+LEFT JOIN stock_balance b ON b.item_id = c.item_id
+LEFT JOIN start_p s ON s.id = b.id_start
+LEFT JOIN pr p ON p.id = b.id_pr
+LEFT JOIN tech t ON t.id = b.id_tech
+LEFT JOIN wafer w ON w.id = b.id_wafer
+LEFT JOIN quad q ON q.id = b.id_quad
+LEFT JOIN lot l ON l.id = b.id_lot
+LEFT JOIN in_lot il ON il.id = b.id_in_lot
+LEFT JOIN n_chip nc ON nc.id = b.id_n_chip
+LEFT JOIN stor st ON st.id = b.id_stor
+LEFT JOIN cells ce ON ce.id = b.id_cells;
@@ -0,0 +1,25 @@
+-- Отпечатки загруженных файлов и строк: повторная загрузка того же файла - пустая операция,
+-- а уже загруженные строки пропускаются
+
+CREATE TABLE IF NOT EXISTS upload_files (
+    id bigserial PRIMARY KEY,
+    kind text NOT NULL,
+    content_hash bytea NOT NULL,     -- sha256 содержимого файла
+    file_name text,
+    user_id integer,
+    rows integer NOT NULL DEFAULT 0,
+    created_at timestamp NOT NULL DEFAULT now()
+);
+
+-- Поиск только по равенству хэша: hash-индекс меньше B-дерева на 32-байтных ключах
+CREATE INDEX IF NOT EXISTS upload_files_content_hash_idx ON upload_files USING hash (content_hash);
+
+CREATE TABLE IF NOT EXISTS upload_rows (
+    kind text NOT NULL,
+    key_hash bytea NOT NULL,         -- естественный ключ строки и номер его повторения в файле
+    row_hash bytea NOT NULL,         -- все значения строки
+    upload_id bigint NOT NULL REFERENCES upload_files (id) ON DELETE CASCADE,
+    PRIMARY KEY (kind, key_hash)
+);
+
+CREATE INDEX IF NOT EXISTS upload_rows_upload_id_idx ON upload_rows (upload_id);
@@ -0,0 +1,21 @@
+-- Архив истории движений: итоги по позициям за отключенные (архивные) периоды invoice и consumption.
+-- Секционирование таблиц по дате выполняет команда flask warehouse partitions convert.
+
+-- Остатки на начало живой истории: суммы по позициям за все заархивированные периоды
+CREATE TABLE IF NOT EXISTS stock_opening_balance (LIKE stock_balance INCLUDING DEFAULTS);
+ALTER TABLE stock_opening_balance ADD PRIMARY KEY (item_id);
+
+-- Заархивированные секции: что и за какой период отключено
+CREATE TABLE IF NOT EXISTS history_archive (
+    id serial PRIMARY KEY,
+    table_name text NOT NULL,
+    partition_name text NOT NULL,
+    range_from date NOT NULL,
+    range_to date NOT NULL,
+    rows bigint NOT NULL,
+    dropped boolean NOT NULL DEFAULT false,
+    archived_at timestamp NOT NULL DEFAULT now()
+);
+
+-- Сюда переносятся отключенные секции, если их не удаляют
+CREATE SCHEMA IF NOT EXISTS archive;
@@ -0,0 +1,164 @@
+-- Дневные итоги движений для отчетов (/reports): приход, расход и возврат за день по сочетанию
+-- производителя, техпроцесса, шифра кристалла, места и ячейки хранения. Поддерживаются триггерами
+-- при записи в invoice и consumption, поэтому отчет не читает историю движений.
+-- Пустые id справочников хранятся как 0, строки без даты - за день '-infinity'.
+
+CREATE TABLE movement_daily (
+    day date NOT NULL,
+    id_pr integer NOT NULL,
+    id_tech integer NOT NULL,
+    id_n_chip integer NOT NULL,
+    id_stor integer NOT NULL,
+    id_cells integer NOT NULL,
+    inflow_w bigint NOT NULL DEFAULT 0,
+    inflow_gp bigint NOT NULL DEFAULT 0,
+    outflow_w bigint NOT NULL DEFAULT 0,
+    outflow_gp bigint NOT NULL DEFAULT 0,
+    refund_w bigint NOT NULL DEFAULT 0,
+    refund_gp bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, id_pr, id_tech, id_n_chip, id_stor, id_cells)
+);
+
+-- Приращение итогов по строкам одного оператора над invoice (возврат - строки с примечанием «возврат»)
+CREATE FUNCTION movement_daily_apply_invoice() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+                                         inflow_w, inflow_gp, refund_w, refund_gp)
+        SELECT COALESCE(date::date, '-infinity'), COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               -SUM(CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_w, 0) END),
+               -SUM(CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_gp, 0) END),
+               -SUM(CASE WHEN note = 'возврат' THEN COALESCE(quan_w, 0) ELSE 0 END),
+               -SUM(CASE WHEN note = 'возврат' THEN COALESCE(quan_gp, 0) ELSE 0 END)
+        FROM old_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+            inflow_w = m.inflow_w + EXCLUDED.inflow_w,
+            inflow_gp = m.inflow_gp + EXCLUDED.inflow_gp,
+            refund_w = m.refund_w + EXCLUDED.refund_w,
+            refund_gp = m.refund_gp + EXCLUDED.refund_gp;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+                                         inflow_w, inflow_gp, refund_w, refund_gp)
+        SELECT COALESCE(date::date, '-infinity'), COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               SUM(CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_w, 0) END),
+               SUM(CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_gp, 0) END),
+               SUM(CASE WHEN note = 'возврат' THEN COALESCE(quan_w, 0) ELSE 0 END),
+               SUM(CASE WHEN note = 'возврат' THEN COALESCE(quan_gp, 0) ELSE 0 END)
+        FROM new_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+            inflow_w = m.inflow_w + EXCLUDED.inflow_w,
+            inflow_gp = m.inflow_gp + EXCLUDED.inflow_gp,
+            refund_w = m.refund_w + EXCLUDED.refund_w,
+            refund_gp = m.refund_gp + EXCLUDED.refund_gp;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- Приращение итогов по строкам одного оператора над consumption
+CREATE FUNCTION movement_daily_apply_consumption() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+                                         outflow_w, outflow_gp)
+        SELECT COALESCE(date::date, '-infinity'), COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               -SUM(COALESCE(cons_w, 0)), -SUM(COALESCE(cons_gp, 0))
+        FROM old_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+            outflow_w = m.outflow_w + EXCLUDED.outflow_w,
+            outflow_gp = m.outflow_gp + EXCLUDED.outflow_gp;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+                                         outflow_w, outflow_gp)
+        SELECT COALESCE(date::date, '-infinity'), COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               SUM(COALESCE(cons_w, 0)), SUM(COALESCE(cons_gp, 0))
+        FROM new_rows
+        GROUP BY 1, 2, 3, 4, 5, 6
+        ORDER BY 1, 2, 3, 4, 5, 6
+        ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+            outflow_w = m.outflow_w + EXCLUDED.outflow_w,
+            outflow_gp = m.outflow_gp + EXCLUDED.outflow_gp;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER movement_daily_invoice_ins AFTER INSERT ON invoice
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_invoice();
+CREATE TRIGGER movement_daily_invoice_upd AFTER UPDATE ON invoice
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_invoice();
+CREATE TRIGGER movement_daily_invoice_del AFTER DELETE ON invoice
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_invoice();
+
+CREATE TRIGGER movement_daily_consumption_ins AFTER INSERT ON consumption
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_consumption();
+CREATE TRIGGER movement_daily_consumption_upd AFTER UPDATE ON consumption
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_consumption();
+CREATE TRIGGER movement_daily_consumption_del AFTER DELETE ON consumption
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE movement_daily_apply_consumption();
+
+-- Полный пересчет итогов по живой истории. Заархивированные периоды (stock_opening_balance)
+-- попадают в день '-infinity': они учитываются в остатках, но не в движениях за период.
+CREATE FUNCTION movement_daily_rebuild() RETURNS bigint
+LANGUAGE plpgsql AS $$
+DECLARE
+    days bigint;
+BEGIN
+    -- Параллельные записи дождутся пересчета и добавят свои строки поверх него
+    LOCK TABLE movement_daily IN EXCLUSIVE MODE;
+    DELETE FROM movement_daily;
+    INSERT INTO movement_daily (day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+                                inflow_w, inflow_gp, outflow_w, outflow_gp, refund_w, refund_gp)
+    SELECT day, id_pr, id_tech, id_n_chip, id_stor, id_cells,
+           SUM(inflow_w), SUM(inflow_gp), SUM(outflow_w), SUM(outflow_gp), SUM(refund_w), SUM(refund_gp)
+    FROM (
+        SELECT COALESCE(date::date, '-infinity') AS day, COALESCE(id_pr, 0) AS id_pr,
+               COALESCE(id_tech, 0) AS id_tech, COALESCE(id_n_chip, 0) AS id_n_chip,
+               COALESCE(id_stor, 0) AS id_stor, COALESCE(id_cells, 0) AS id_cells,
+               CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_w, 0) END AS inflow_w,
+               CASE WHEN note = 'возврат' THEN 0 ELSE COALESCE(quan_gp, 0) END AS inflow_gp,
+               0 AS outflow_w, 0 AS outflow_gp,
+               CASE WHEN note = 'возврат' THEN COALESCE(quan_w, 0) ELSE 0 END AS refund_w,
+               CASE WHEN note = 'возврат' THEN COALESCE(quan_gp, 0) ELSE 0 END AS refund_gp
+        FROM invoice
+        UNION ALL
+        SELECT COALESCE(date::date, '-infinity'), COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               0, 0, COALESCE(cons_w, 0), COALESCE(cons_gp, 0), 0, 0
+        FROM consumption
+        UNION ALL
+        SELECT '-infinity', COALESCE(id_pr, 0), COALESCE(id_tech, 0),
+               COALESCE(id_n_chip, 0), COALESCE(id_stor, 0), COALESCE(id_cells, 0),
+               quan_w, quan_gp, cons_w, cons_gp, 0, 0
+        FROM stock_opening_balance
+    ) m
+    GROUP BY day, id_pr, id_tech, id_n_chip, id_stor, id_cells;
+    GET DIAGNOSTICS days = ROW_COUNT;
+    RETURN days;
+END;
+$$;
+
+-- Начальное заполнение по существующей истории
+SELECT movement_daily_rebuild();
@@ -0,0 +1,104 @@
+-- Триггеры остатков блокируют строки stock_balance в порядке item_id: одна пачка строк параллельной
+-- загрузки (фоновые задания, flask warehouse import) с общими позициями не блокирует другую взаимно.
+-- UPDATE ... FROM не гарантирует порядок, поэтому строки сначала блокируются SELECT ... FOR UPDATE.
+-- Между пачками одной загрузки порядок не гарантирован: взаимную блокировку разрешает повтор
+-- загрузки файла (ingest.run_upload, UPLOAD_RETRIES).
+
+CREATE OR REPLACE FUNCTION stock_balance_apply_invoice() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM 1 FROM stock_balance
+        WHERE item_id IN (SELECT item_id FROM old_rows)
+        ORDER BY item_id
+        FOR UPDATE;
+
+        UPDATE stock_balance b
+        SET quan_w = b.quan_w - d.quan_w,
+            quan_gp = b.quan_gp - d.quan_gp,
+            invoice_rows = b.invoice_rows - d.invoice_rows
+        FROM (
+            SELECT item_id, SUM(COALESCE(quan_w, 0)) AS quan_w, SUM(COALESCE(quan_gp, 0)) AS quan_gp,
+                   COUNT(*) AS invoice_rows
+            FROM old_rows
+            GROUP BY item_id
+            ORDER BY item_id
+        ) d
+        WHERE b.item_id = d.item_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO stock_balance AS b (
+            item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+            note, id_stor, id_cells, quan_w, quan_gp, invoice_rows
+        )
+        SELECT item_id,
+               MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+               MIN(id_n_chip), MIN(id_quad),
+               (array_agg(note ORDER BY id) FILTER (WHERE note IS NOT NULL))[1],
+               (array_agg(id_stor ORDER BY id DESC) FILTER (WHERE id_stor IS NOT NULL))[1],
+               (array_agg(id_cells ORDER BY id DESC) FILTER (WHERE id_cells IS NOT NULL))[1],
+               SUM(COALESCE(quan_w, 0)), SUM(COALESCE(quan_gp, 0)), COUNT(*)
+        FROM new_rows
+        GROUP BY item_id
+        ORDER BY item_id
+        ON CONFLICT (item_id) DO UPDATE SET
+            id_start = COALESCE(b.id_start, EXCLUDED.id_start),
+            id_pr = COALESCE(b.id_pr, EXCLUDED.id_pr),
+            id_tech = COALESCE(b.id_tech, EXCLUDED.id_tech),
+            id_wafer = COALESCE(b.id_wafer, EXCLUDED.id_wafer),
+            id_lot = COALESCE(b.id_lot, EXCLUDED.id_lot),
+            id_in_lot = COALESCE(b.id_in_lot, EXCLUDED.id_in_lot),
+            id_n_chip = COALESCE(b.id_n_chip, EXCLUDED.id_n_chip),
+            id_quad = COALESCE(b.id_quad, EXCLUDED.id_quad),
+            note = COALESCE(b.note, EXCLUDED.note),
+            id_stor = COALESCE(EXCLUDED.id_stor, b.id_stor),
+            id_cells = COALESCE(EXCLUDED.id_cells, b.id_cells),
+            quan_w = b.quan_w + EXCLUDED.quan_w,
+            quan_gp = b.quan_gp + EXCLUDED.quan_gp,
+            invoice_rows = b.invoice_rows + EXCLUDED.invoice_rows;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION stock_balance_apply_consumption() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM 1 FROM stock_balance
+        WHERE item_id IN (SELECT item_id FROM old_rows)
+        ORDER BY item_id
+        FOR UPDATE;
+
+        UPDATE stock_balance b
+        SET cons_w = b.cons_w - d.cons_w,
+            cons_gp = b.cons_gp - d.cons_gp
+        FROM (
+            SELECT item_id, SUM(COALESCE(cons_w, 0)) AS cons_w, SUM(COALESCE(cons_gp, 0)) AS cons_gp
+            FROM old_rows
+            GROUP BY item_id
+            ORDER BY item_id
+        ) d
+        WHERE b.item_id = d.item_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO stock_balance AS b (
+            item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+            cons_w, cons_gp
+        )
+        SELECT item_id,
+               MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+               MIN(id_n_chip), MIN(id_quad),
+               SUM(COALESCE(cons_w, 0)), SUM(COALESCE(cons_gp, 0))
+        FROM new_rows
+        GROUP BY item_id
+        ORDER BY item_id
+        ON CONFLICT (item_id) DO UPDATE SET
+            cons_w = b.cons_w + EXCLUDED.cons_w,
+            cons_gp = b.cons_gp + EXCLUDED.cons_gp;
+    END IF;
+    RETURN NULL;
+END;
+$$;
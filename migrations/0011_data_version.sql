@@ -0,0 +1,9 @@
+-- Версия данных склада для кэша результатов поиска и ETag: одна строка, общая для всех процессов.
+-- Увеличивается в той же транзакции, что и запись движений, поэтому видна вместе с ними.
+
+CREATE TABLE IF NOT EXISTS data_version (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    version bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO data_version DEFAULT VALUES ON CONFLICT DO NOTHING;
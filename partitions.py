@@ -0,0 +1,355 @@
+# Секционирование истории движений (invoice, consumption) по дате и архивация старых периодов
+
+import re
+from datetime import date
+
+import balance
+
+# Секционируемые таблицы истории
+HISTORY_TABLES = ("invoice", "consumption")
+# Под этим именем остается исходная таблица после перевода на секции (до проверки и удаления)
+LEGACY_SUFFIX = "_unpartitioned"
+
+BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+# Суммы по позициям одной секции прихода/расхода для stock_opening_balance
+ROLLUP_INVOICE = """
+    INSERT INTO stock_opening_balance AS o (
+        item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad,
+        note, id_stor, id_cells, quan_w, quan_gp, invoice_rows
+    )
+    SELECT item_id,
+           MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+           MIN(id_n_chip), MIN(id_quad),
+           (array_agg(note ORDER BY id) FILTER (WHERE note IS NOT NULL))[1],
+           (array_agg(id_stor ORDER BY id DESC) FILTER (WHERE id_stor IS NOT NULL))[1],
+           (array_agg(id_cells ORDER BY id DESC) FILTER (WHERE id_cells IS NOT NULL))[1],
+           SUM(COALESCE(quan_w, 0)), SUM(COALESCE(quan_gp, 0)), COUNT(*)
+    FROM {partition}
+    GROUP BY item_id
+    ON CONFLICT (item_id) DO UPDATE SET
+        note = COALESCE(o.note, EXCLUDED.note),
+        id_stor = COALESCE(EXCLUDED.id_stor, o.id_stor),
+        id_cells = COALESCE(EXCLUDED.id_cells, o.id_cells),
+        quan_w = o.quan_w + EXCLUDED.quan_w,
+        quan_gp = o.quan_gp + EXCLUDED.quan_gp,
+        invoice_rows = o.invoice_rows + EXCLUDED.invoice_rows
+"""
+
+ROLLUP_CONSUMPTION = """
+    INSERT INTO stock_opening_balance AS o (
+        item_id, id_start, id_pr, id_tech, id_wafer, id_lot, id_in_lot, id_n_chip, id_quad, cons_w, cons_gp
+    )
+    SELECT item_id,
+           MIN(id_start), MIN(id_pr), MIN(id_tech), MIN(id_wafer), MIN(id_lot), MIN(id_in_lot),
+           MIN(id_n_chip), MIN(id_quad),
+           SUM(COALESCE(cons_w, 0)), SUM(COALESCE(cons_gp, 0))
+    FROM {partition}
+    GROUP BY item_id
+    ON CONFLICT (item_id) DO UPDATE SET
+        cons_w = o.cons_w + EXCLUDED.cons_w,
+        cons_gp = o.cons_gp + EXCLUDED.cons_gp
+"""
+
+ROLLUPS = {"invoice": ROLLUP_INVOICE, "consumption": ROLLUP_CONSUMPTION}
+
+# Дневные итоги movement_daily за архивируемый период переносятся в день '-infinity', как при
+# пересчете movement_daily_rebuild(): заархивированная история входит в остатки, но не в движения.
+# Возврат прихода становится приходом - в stock_opening_balance они не различаются.
+FOLD_DAILY_INVOICE = """
+    INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells, inflow_w, inflow_gp)
+    SELECT '-infinity', id_pr, id_tech, id_n_chip, id_stor, id_cells,
+           SUM(inflow_w + refund_w), SUM(inflow_gp + refund_gp)
+    FROM movement_daily
+    WHERE day >= %(start)s AND day < %(end)s
+    GROUP BY id_pr, id_tech, id_n_chip, id_stor, id_cells
+    ORDER BY id_pr, id_tech, id_n_chip, id_stor, id_cells
+    ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+        inflow_w = m.inflow_w + EXCLUDED.inflow_w,
+        inflow_gp = m.inflow_gp + EXCLUDED.inflow_gp;
+    UPDATE movement_daily SET inflow_w = 0, inflow_gp = 0, refund_w = 0, refund_gp = 0
+    WHERE day >= %(start)s AND day < %(end)s
+"""
+
+FOLD_DAILY_CONSUMPTION = """
+    INSERT INTO movement_daily AS m (day, id_pr, id_tech, id_n_chip, id_stor, id_cells, outflow_w, outflow_gp)
+    SELECT '-infinity', id_pr, id_tech, id_n_chip, id_stor, id_cells, SUM(outflow_w), SUM(outflow_gp)
+    FROM movement_daily
+    WHERE day >= %(start)s AND day < %(end)s
+    GROUP BY id_pr, id_tech, id_n_chip, id_stor, id_cells
+    ORDER BY id_pr, id_tech, id_n_chip, id_stor, id_cells
+    ON CONFLICT (day, id_pr, id_tech, id_n_chip, id_stor, id_cells) DO UPDATE SET
+        outflow_w = m.outflow_w + EXCLUDED.outflow_w,
+        outflow_gp = m.outflow_gp + EXCLUDED.outflow_gp;
+    UPDATE movement_daily SET outflow_w = 0, outflow_gp = 0
+    WHERE day >= %(start)s AND day < %(end)s
+"""
+
+FOLD_DAILY = {"invoice": FOLD_DAILY_INVOICE, "consumption": FOLD_DAILY_CONSUMPTION}
+
+DELETE_EMPTY_DAILY = """
+    DELETE FROM movement_daily
+    WHERE day >= %(start)s AND day < %(end)s
+      AND inflow_w = 0 AND inflow_gp = 0 AND outflow_w = 0 AND outflow_gp = 0
+      AND refund_w = 0 AND refund_gp = 0
+"""
+
+
+class PartitionError(Exception):
+    """Операцию с секциями выполнить нельзя (таблица не секционирована, строки вне секций и т.п.)."""
+
+
+def period_start(day, interval):
+    """Начало периода (месяца или года), в который попадает день."""
+    if interval == 'year':
+        return date(day.year, 1, 1)
+    return date(day.year, day.month, 1)
+
+
+def next_period(start, interval):
+    if interval == 'year':
+        return date(start.year + 1, 1, 1)
+    if start.month == 12:
+        return date(start.year + 1, 1, 1)
+    return date(start.year, start.month + 1, 1)
+
+
+def partition_name(table, start, interval):
+    if interval == 'year':
+        return f"{table}_p{start.year}"
+    return f"{table}_p{start.year}_{start.month:02d}"
+
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions(cur, table):
+    """Секции таблицы: [(имя, начало, конец)] по возрастанию; у секции DEFAULT начало и конец - None."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+    """, (table,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = BOUND_RE.search(bound or '')
+        if match:
+            partitions.append((name, date.fromisoformat(match.group(1)[:10]), date.fromisoformat(match.group(2)[:10])))
+        else:
+            partitions.append((name, None, None))
+    return sorted(partitions, key=lambda p: (p[1] is None, p[1] or date.min))
+
+
+def create_partition(cur, table, start, interval):
+    """Создает секцию периода, если ее нет. Возвращает имя секции или None, если она уже была."""
+    name = partition_name(table, start, interval)
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is not None:
+        return None
+    cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                (start.isoformat(), next_period(start, interval).isoformat()))
+    return name
+
+
+def _history_columns(cur, table):
+    """Столбцы таблицы, в которые можно писать (без вычисляемых)."""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def _move_triggers(cur, source, target):
+    """Переносит пользовательские триггеры (stock_balance и др.) со старой таблицы на новую."""
+    cur.execute("""
+        SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger
+        WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal
+    """, (source,))
+    triggers = cur.fetchall()
+    pattern = re.compile(r" ON (\S+\.)?" + re.escape(source) + " ")
+    for name, definition in triggers:
+        cur.execute(f'DROP TRIGGER "{name}" ON {source}')
+        cur.execute(pattern.sub(f" ON {target} ", definition, count=1))
+    return [name for name, _ in triggers]
+
+
+def convert(cur, table, interval='month', ahead=3, today=None):
+    """Переводит таблицу истории на секции по дате в одной транзакции.
+
+    Исходная таблица переименовывается в <table>_unpartitioned и остается для проверки;
+    строки копируются в новую секционированную таблицу с секциями за каждый период от самой
+    ранней даты до ahead периодов вперед и секцией DEFAULT (пустая дата). Триггеры остатков,
+    внешние ключи на справочники и последовательность id переносятся на новую таблицу.
+    Уникальность id в секционированной таблице не проверяется (ключ секционирования должен
+    входить в уникальный индекс).
+    Возвращает (число строк, число секций).
+    """
+    if is_partitioned(cur, table):
+        raise PartitionError(f"Таблица {table} уже секционирована")
+    legacy = table + LEGACY_SUFFIX
+    cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cur.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    cur.execute(f"""
+        CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (date)
+    """)
+    cur.execute("""
+        SELECT is_identity FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = 'id'
+    """, (legacy,))
+    identity = (cur.fetchone() or ('NO',))[0] == 'YES'
+    if identity:
+        cur.execute(f"ALTER TABLE {table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+    else:
+        # Последовательность serial переходит к новой таблице, иначе удалится вместе со старой
+        cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (legacy,))
+        sequence = cur.fetchone()[0]
+        if sequence:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+
+    cur.execute(f"SELECT MIN(date)::date, MAX(date)::date FROM {legacy}")
+    first, last = cur.fetchone()
+    created = ensure_partitions(cur, table, interval, ahead, today, since=first, until=last)
+    cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    columns = ", ".join(_history_columns(cur, legacy))
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy}")
+    rows = cur.rowcount
+    if identity:
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+    for column in ("id", "item_id", "date"):
+        cur.execute(f"CREATE INDEX {table}_{column}_part_idx ON {table} ({column})")
+    _copy_foreign_keys(cur, legacy, table)
+    # Триггеры переносятся после копирования: скопированные строки уже учтены в stock_balance
+    _move_triggers(cur, legacy, table)
+    balance.create_expected_view(cur)
+    return rows, len(created) + 1
+
+
+def _copy_foreign_keys(cur, source, target):
+    """Создает на target внешние ключи source, которых на ней нет (LIKE их не копирует);
+    строки target проверяются. Возвращает имена созданных ключей."""
+    cur.execute("""
+        SELECT s.conname, pg_get_constraintdef(s.oid) FROM pg_constraint s
+        WHERE s.conrelid = %s::regclass AND s.contype = 'f'
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint t
+                          WHERE t.conrelid = %s::regclass AND t.conname = s.conname)
+        ORDER BY s.conname
+    """, (source, target))
+    added = []
+    for name, definition in cur.fetchall():
+        cur.execute(f'ALTER TABLE {target} ADD CONSTRAINT "{name}" {definition}')
+        added.append(name)
+    return added
+
+
+def restore_foreign_keys(cur, table):
+    """Восстанавливает внешние ключи таблицы, секционированной до того, как convert стал их переносить:
+    ключи берутся с исходной таблицы <table>_unpartitioned. Возвращает имена созданных ключей."""
+    legacy = table + LEGACY_SUFFIX
+    if not is_partitioned(cur, table):
+        raise PartitionError(f"Таблица {table} не секционирована")
+    cur.execute("SELECT to_regclass(%s)", (legacy,))
+    if cur.fetchone()[0] is None:
+        raise PartitionError(f"Исходная таблица {legacy} удалена: создайте внешние ключи {table} вручную")
+    return _copy_foreign_keys(cur, legacy, table)
+
+
+def ensure_partitions(cur, table, interval='month', ahead=3, today=None, since=None, until=None):
+    """Создает недостающие секции от since (или текущего периода) до ahead периодов вперед
+    (но не раньше периода until).
+
+    Возвращает имена созданных секций. Если строки нужного периода уже попали в секцию
+    DEFAULT, PostgreSQL не даст создать секцию - выбрасывается PartitionError.
+    """
+    if not is_partitioned(cur, table):
+        raise PartitionError(f"Таблица {table} не секционирована: flask warehouse partitions convert")
+    today = today or date.today()
+    start = period_start(since or today, interval)
+    end = period_start(today, interval)
+    for _ in range(ahead):
+        end = next_period(end, interval)
+    if until is not None:
+        end = max(end, period_start(until, interval))
+    created = []
+    while start <= end:
+        cur.execute("SAVEPOINT create_partition")
+        try:
+            name = create_partition(cur, table, start, interval)
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+            raise PartitionError(f"Не удалось создать секцию {partition_name(table, start, interval)}: {e}")
+        cur.execute("RELEASE SAVEPOINT create_partition")
+        if name:
+            created.append(name)
+        start = next_period(start, interval)
+    return created
+
+
+def _partition_rows(cur, partition):
+    cur.execute(f"SELECT COUNT(*) FROM {partition}")
+    return cur.fetchone()[0]
+
+
+def _has_stock(cur, partition):
+    """Есть ли у позиций секции ненулевой остаток (значит, период еще не закрыт)."""
+    cur.execute(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM stock_balance b
+            WHERE b.item_id IN (SELECT item_id FROM {partition})
+              AND (b.quan_w - b.cons_w <> 0 OR b.quan_gp - b.cons_gp <> 0)
+        )
+    """)
+    return cur.fetchone()[0]
+
+
+def archive(cur, before, drop=False, consumed_only=False):
+    """Архивирует периоды invoice и consumption, которые целиком раньше даты before.
+
+    Суммы по позициям каждой секции добавляются в stock_opening_balance, затем секция
+    отключается от таблицы и переносится в схему archive (или удаляется при drop=True).
+    stock_balance не меняется: отключение секции не вызывает триггеров, а сумма живой
+    истории и stock_opening_balance остается прежней. Дневные итоги movement_daily за период
+    переносятся в день '-infinity'. consumed_only=True - архивировать
+    только периоды, все позиции которых полностью израсходованы.
+    Возвращает список (таблица, секция, строк) в порядке архивации.
+    """
+    for table in HISTORY_TABLES:
+        if not is_partitioned(cur, table):
+            raise PartitionError(f"Таблица {table} не секционирована: flask warehouse partitions convert")
+    candidates = []
+    for table in HISTORY_TABLES:
+        for name, start, end in list_partitions(cur, table):
+            if start is not None and end <= before:
+                candidates.append((start, table, name, end))
+    # Старые периоды первыми: место и ячейка хранения берутся из самого позднего периода
+    candidates.sort()
+    if consumed_only:
+        skipped = {start for start, table, name, end in candidates if _has_stock(cur, name)}
+        candidates = [c for c in candidates if c[0] not in skipped]
+
+    archived = []
+    for start, table, name, end in candidates:
+        rows = _partition_rows(cur, name)
+        cur.execute(ROLLUPS[table].format(partition=name))
+        cur.execute(FOLD_DAILY[table], {'start': start, 'end': end})
+        cur.execute(DELETE_EMPTY_DAILY, {'start': start, 'end': end})
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        if drop:
+            cur.execute(f"DROP TABLE {name}")
+        else:
+            cur.execute(f"ALTER TABLE {name} SET SCHEMA archive")
+        cur.execute("""
+            INSERT INTO history_archive (table_name, partition_name, range_from, range_to, rows, dropped)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (table, name, start, end, rows, drop))
+        archived.append((table, name, rows))
+    if archived:
+        balance.create_expected_view(cur)
+    return archived
@@ -0,0 +1,104 @@
+# Отчеты по движениям склада: приход, расход, возврат и остаток по справочнику за период.
+# Читают дневные итоги movement_daily (миграция 0009), а не историю invoice и consumption.
+
+from datetime import date
+
+# Группировка отчета: столбец movement_daily, справочник и его столбец с названием
+GROUPS = {
+    'pr': ('id_pr', 'pr', 'name_pr'),
+    'tech': ('id_tech', 'tech', 'name_tech'),
+    'stor': ('id_stor', 'stor', 'name_stor'),
+    'cells': ('id_cells', 'cells', 'name_cells'),
+    'n_chip': ('id_n_chip', 'n_chip', 'n_chip'),
+}
+
+GROUP_TITLES = {
+    'pr': 'Производитель',
+    'tech': 'Технологический процесс',
+    'stor': 'Место хранения',
+    'cells': 'Ячейка хранения',
+    'n_chip': 'Шифр кристалла',
+}
+
+REPORT_COLUMNS = [
+    "id", "name", "inflow_w", "inflow_gp", "outflow_w", "outflow_gp",
+    "refund_w", "refund_gp", "balance_w", "balance_gp",
+]
+
+REPORT_HEADER = [
+    "ID", "Название", "Приход Wafer, шт.", "Приход GelPack, шт.", "Расход Wafer, шт.", "Расход GelPack, шт.",
+    "Возврат Wafer, шт.", "Возврат GelPack, шт.", "Остаток Wafer, шт.", "Остаток GelPack, шт.",
+]
+
+# Остаток на конец периода - сумма всех дней до date_to включительно (вместе с днем '-infinity':
+# строки без даты и заархивированная история). Группы без движений за период и с нулевым
+# остатком не выводятся. id 0 - движения без значения справочника.
+REPORT_QUERY = """
+    WITH closing AS (
+        SELECT {key} AS id,
+               SUM(inflow_w + refund_w - outflow_w)::bigint AS balance_w,
+               SUM(inflow_gp + refund_gp - outflow_gp)::bigint AS balance_gp
+        FROM movement_daily
+        WHERE day <= %(date_to)s
+        GROUP BY 1
+    ),
+    period AS (
+        SELECT {key} AS id,
+               SUM(inflow_w)::bigint AS inflow_w, SUM(inflow_gp)::bigint AS inflow_gp,
+               SUM(outflow_w)::bigint AS outflow_w, SUM(outflow_gp)::bigint AS outflow_gp,
+               SUM(refund_w)::bigint AS refund_w, SUM(refund_gp)::bigint AS refund_gp
+        FROM movement_daily
+        WHERE day BETWEEN %(date_from)s AND %(date_to)s
+        GROUP BY 1
+    )
+    SELECT c.id, d.{name},
+           COALESCE(p.inflow_w, 0), COALESCE(p.inflow_gp, 0),
+           COALESCE(p.outflow_w, 0), COALESCE(p.outflow_gp, 0),
+           COALESCE(p.refund_w, 0), COALESCE(p.refund_gp, 0),
+           c.balance_w, c.balance_gp
+    FROM closing c
+    LEFT JOIN period p ON p.id = c.id
+    LEFT JOIN {table} d ON d.id = c.id
+    WHERE p.id IS NOT NULL OR c.balance_w <> 0 OR c.balance_gp <> 0
+    ORDER BY d.{name} NULLS LAST, c.id
+"""
+
+
+class ReportError(ValueError):
+    """Неверные параметры отчета (группировка или даты)."""
+
+
+def parse_params(group_by, date_from, date_to):
+    """Проверяет параметры отчета; возвращает (group_by, date_from, date_to).
+
+    По умолчанию отчет строится с начала года по сегодняшний день.
+    """
+    group_by = group_by or 'pr'
+    if group_by not in GROUPS:
+        raise ReportError(f"Неизвестная группировка: {group_by}. Допустимо: {', '.join(GROUPS)}")
+    try:
+        date_to = date.fromisoformat(date_to) if date_to else date.today()
+        date_from = date.fromisoformat(date_from) if date_from else date(date_to.year, 1, 1)
+    except ValueError:
+        raise ReportError("Дата должна быть в формате ГГГГ-ММ-ДД")
+    if date_from > date_to:
+        raise ReportError("Начало периода позже его окончания")
+    return group_by, date_from, date_to
+
+
+def movement_report(cur, group_by, date_from, date_to):
+    """Строки отчета в порядке REPORT_COLUMNS, отсортированные по названию."""
+    key, table, name = GROUPS[group_by]
+    cur.execute(REPORT_QUERY.format(key=key, table=table, name=name),
+                {'date_from': date_from, 'date_to': date_to})
+    return [list(row) for row in cur.fetchall()]
+
+
+def row_to_dict(row):
+    return dict(zip(REPORT_COLUMNS, row))
+
+
+def rebuild(cur):
+    """Пересчитывает movement_daily по истории движений; возвращает число строк итогов."""
+    cur.execute("SELECT movement_daily_rebuild()")
+    return cur.fetchone()[0]
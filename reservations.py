@@ -0,0 +1,226 @@
+# Резервирование остатков корзинами: доступно = остаток позиции - сумма количеств во всех корзинах
+
+# Остаток позиции берется из stock_balance по первичному ключу, строка блокируется до конца
+# транзакции: одновременные добавления одной позиции выполняются по очереди
+BALANCE_FOR_UPDATE = """
+    SELECT quan_w - cons_w, quan_gp - cons_gp
+    FROM stock_balance
+    WHERE item_id = %s
+    FOR UPDATE
+"""
+
+# Резервы позиции во всех корзинах (по индексу cart_item_id_idx)
+RESERVED = """
+    SELECT COALESCE(SUM(cons_w), 0), COALESCE(SUM(cons_gp), 0)
+    FROM cart
+    WHERE item_id = %s
+"""
+
+
+class InsufficientStockError(Exception):
+    """Запрошено больше, чем доступно с учетом резервов других корзин."""
+
+    def __init__(self, item_id, available_w, available_gp):
+        self.item_id = item_id
+        self.available_w = available_w
+        self.available_gp = available_gp
+        super().__init__(
+            f"Недостаточно остатка: доступно {available_w} шт. на пластине и {available_gp} шт. в GelPack")
+
+
+class UnknownItemError(Exception):
+    """Позиции нет в остатках склада."""
+
+
+def lock_available(cur, item_id):
+    """Блокирует позицию и возвращает (доступно wafer, доступно GelPack) за вычетом всех резервов.
+
+    Вызывается в транзакции, которая затем меняет корзину: блокировка держится до COMMIT.
+    """
+    cur.execute(BALANCE_FOR_UPDATE, (item_id,))
+    row = cur.fetchone()
+    if row is None:
+        raise UnknownItemError(f"Позиция {item_id} не найдена на складе")
+    cur.execute(RESERVED, (item_id,))
+    reserved_w, reserved_gp = cur.fetchone()
+    return int(row[0]) - int(reserved_w), int(row[1]) - int(reserved_gp)
+
+
+def check(item_id, available, delta_w, delta_gp):
+    """Проверяет, что резерв можно увеличить на delta_w/delta_gp; уменьшать резерв можно всегда."""
+    available_w, available_gp = available
+    if (delta_w > 0 and delta_w > available_w) or (delta_gp > 0 and delta_gp > available_gp):
+        raise InsufficientStockError(item_id, max(available_w, 0), max(available_gp, 0))
+
+
+def reserve(cur, item_id, delta_w, delta_gp):
+    """Блокирует позицию и проверяет, что ее резерв можно увеличить на delta_w/delta_gp."""
+    check(item_id, lock_available(cur, item_id), delta_w, delta_gp)
+
+
+def set_quantity(cur, user_id, item_id, cons_w, cons_gp):
+    """Устанавливает количество позиции в корзине пользователя с проверкой доступного остатка.
+
+    Возвращает False, если позиции нет в корзине.
+    """
+    # Сначала блокируется строка остатка (как при добавлении), затем строка корзины
+    available = lock_available(cur, item_id)
+    cur.execute("SELECT cons_w, cons_gp FROM cart WHERE user_id = %s AND item_id = %s FOR UPDATE",
+                (user_id, item_id))
+    row = cur.fetchone()
+    if row is None:
+        return False
+    check(item_id, available, cons_w - (row[0] or 0), cons_gp - (row[1] or 0))
+    cur.execute("UPDATE cart SET cons_w = %s, cons_gp = %s WHERE user_id = %s AND item_id = %s",
+                (cons_w, cons_gp, user_id, item_id))
+    return True
+
+
+def quantity(value):
+    """Количество из запроса: целое неотрицательное число, иначе ValueError."""
+    try:
+        number = int(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Неверное количество")
+    if number < 0:
+        raise ValueError("Количество не может быть отрицательным")
+    return number
+
+
+# Максимум операций в одном пакете
+MAX_BATCH_OPS = 5000
+
+
+class BatchError(Exception):
+    """Пакет операций не применен. errors - [{'index', 'item_id', 'message', ...}];
+    conflict=True - не хватает остатка (409), иначе ошибка в запросе (400)."""
+
+    def __init__(self, errors, conflict=False):
+        self.errors = errors
+        self.conflict = conflict
+        super().__init__("; ".join(error['message'] for error in errors[:5]))
+
+
+def parse_ops(ops):
+    """Проверяет список операций add/update/remove и приводит его к единому виду."""
+    if not isinstance(ops, list) or not ops:
+        raise BatchError([{'index': None, 'item_id': None, 'message': "Нет операций"}])
+    if len(ops) > MAX_BATCH_OPS:
+        raise BatchError([{'index': None, 'item_id': None,
+                           'message': f"Слишком много операций (максимум {MAX_BATCH_OPS})"}])
+    parsed, errors = [], []
+    for index, op in enumerate(ops):
+        kind = op.get('op') if isinstance(op, dict) else None
+        item_id = op.get('item_id') if isinstance(op, dict) else None
+        if kind not in ('add', 'update', 'remove') or item_id in (None, ''):
+            errors.append({'index': index, 'item_id': item_id, 'message': "Неверная операция"})
+            continue
+        entry = {'op': kind, 'item_id': str(item_id), 'w': 0, 'gp': 0}
+        try:
+            if kind == 'add':
+                entry['w'] = quantity(op.get('quantity_w'))
+                entry['gp'] = quantity(op.get('quantity_gp'))
+                if entry['w'] == 0 and entry['gp'] == 0:
+                    raise ValueError("Не указано количество")
+            elif kind == 'update':
+                entry['w'] = quantity(op.get('cons_w'))
+                entry['gp'] = quantity(op.get('cons_gp'))
+        except ValueError as e:
+            errors.append({'index': index, 'item_id': item_id, 'message': str(e)})
+            continue
+        parsed.append(entry)
+    if errors:
+        raise BatchError(errors)
+    return parsed
+
+
+def apply_batch(cur, user_id, ops, date_added):
+    """Применяет пакет операций с корзиной пользователя в текущей транзакции.
+
+    Операции выполняются по порядку (add прибавляет, update устанавливает, remove удаляет),
+    но в БД записывается только итог по каждой позиции: один DELETE, один UPDATE ... FROM (VALUES)
+    и один INSERT на весь пакет. Резервы проверяются для всех позиций сразу; если хоть одной
+    не хватает остатка, не применяется ничего.
+    Возвращает {'added': n, 'updated': n, 'removed': n}.
+    """
+    from psycopg2.extras import execute_values
+
+    ops = parse_ops(ops)
+    items = tuple(sorted({op['item_id'] for op in ops}))
+
+    # Остатки блокируются в порядке item_id, как при добавлении по одной позиции
+    cur.execute("""
+        SELECT item_id, quan_w - cons_w, quan_gp - cons_gp
+        FROM stock_balance
+        WHERE item_id IN %s
+        ORDER BY item_id
+        FOR UPDATE
+    """, (items,))
+    balances = {str(row[0]): (int(row[1]), int(row[2])) for row in cur.fetchall()}
+    cur.execute("""
+        SELECT item_id, COALESCE(SUM(cons_w), 0), COALESCE(SUM(cons_gp), 0)
+        FROM cart
+        WHERE item_id IN %s
+        GROUP BY item_id
+    """, (items,))
+    reserved = {str(row[0]): (int(row[1]), int(row[2])) for row in cur.fetchall()}
+    cur.execute("SELECT item_id, cons_w, cons_gp FROM cart WHERE user_id = %s AND item_id IN %s FOR UPDATE",
+                (user_id, items))
+    current = {str(row[0]): (row[1] or 0, row[2] or 0) for row in cur.fetchall()}
+
+    final = dict(current)
+    errors = []
+    for index, op in enumerate(ops):
+        item_id = op['item_id']
+        if op['op'] == 'remove':
+            final[item_id] = None
+        elif op['op'] == 'update':
+            if final.get(item_id) is None:
+                errors.append({'index': index, 'item_id': item_id, 'message': "Позиции нет в корзине"})
+            else:
+                final[item_id] = (op['w'], op['gp'])
+        else:
+            previous = final.get(item_id) or (0, 0)
+            final[item_id] = (previous[0] + op['w'], previous[1] + op['gp'])
+    if errors:
+        raise BatchError(errors)
+
+    for item_id in items:
+        new = final.get(item_id) or (0, 0)
+        old = current.get(item_id, (0, 0))
+        delta_w, delta_gp = new[0] - old[0], new[1] - old[1]
+        if delta_w <= 0 and delta_gp <= 0:
+            continue
+        if item_id not in balances:
+            errors.append({'index': None, 'item_id': item_id, 'message': f"Позиция {item_id} не найдена на складе"})
+            continue
+        taken = reserved.get(item_id, (0, 0))
+        available_w = balances[item_id][0] - taken[0]
+        available_gp = balances[item_id][1] - taken[1]
+        try:
+            check(item_id, (available_w, available_gp), delta_w, delta_gp)
+        except InsufficientStockError as e:
+            errors.append({'index': None, 'item_id': item_id, 'message': str(e),
+                           'available_w': e.available_w, 'available_gp': e.available_gp})
+    if errors:
+        raise BatchError(errors, conflict=True)
+
+    removed = [item_id for item_id in current if final[item_id] is None]
+    updated = [(user_id, item_id) + final[item_id] for item_id in current
+               if final[item_id] is not None and final[item_id] != current[item_id]]
+    added = [(user_id, item_id) + final[item_id] + (date_added,)
+             for item_id in items if item_id not in current and final.get(item_id) is not None]
+
+    if removed:
+        cur.execute("DELETE FROM cart WHERE user_id = %s AND item_id IN %s", (user_id, tuple(removed)))
+    if updated:
+        # В VALUES значения item_id - текст, поэтому сравнение идет по тексту
+        execute_values(cur, """
+            UPDATE cart c
+            SET cons_w = v.cons_w, cons_gp = v.cons_gp
+            FROM (VALUES %s) AS v (user_id, item_id, cons_w, cons_gp)
+            WHERE c.user_id = v.user_id AND c.item_id::text = v.item_id
+        """, updated)
+    if added:
+        execute_values(cur, "INSERT INTO cart (user_id, item_id, cons_w, cons_gp, date_added) VALUES %s", added)
+    return {'added': len(added), 'updated': len(updated), 'removed': len(removed)}
@@ -0,0 +1,210 @@
+# Кэш результатов поиска по версии данных склада: LRU в памяти процесса или общий Redis, ETag для ответов.
+# Версия данных хранится в БД (таблица data_version) и общая для всех процессов; процесс держит ее копию.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import dim_cache
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Канал PostgreSQL, по которому процессы узнают о новой версии данных
+NOTIFY_CHANNEL = 'data_version'
+# Префикс записей в Redis
+REDIS_PREFIX = 'warehouse:response:'
+# Сколько секунд копия версии в процессе считается актуальной без сигнала об изменении
+VERSION_TTL = float(os.getenv('RESPONSE_CACHE_VERSION_TTL', 1))
+
+# Срок жизни записи и ETag: изменения, сделанные в обход приложения, видны не позже, чем через TTL
+TTL = float(os.getenv('RESPONSE_CACHE_TTL', 300))
+
+
+def enabled():
+    return os.getenv('RESPONSE_CACHE', '1').lower() not in ('0', 'false', 'no')
+
+
+class MemoryBackend:
+    """LRU-кэш в памяти процесса. Записи прежних версий данных больше не читаются
+    и вытесняются как давно не использованные.
+    """
+
+    def __init__(self, max_size=1000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> (значение, срок действия)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisBackend:
+    """Общий кэш процессов в Redis (CACHE_REDIS_URL).
+
+    Ошибки Redis не прерывают запрос: результат просто читается из БД.
+    """
+
+    def __init__(self, url, ttl=300.0):
+        import redis  # необязательная зависимость: pip install redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url, socket_timeout=1)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            raw = self._redis.get(REDIS_PREFIX + key)
+        except Exception as e:
+            logger.warning("Redis недоступен: %s", e)
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def put(self, key, value):
+        try:
+            self._redis.set(REDIS_PREFIX + key, json.dumps(value, default=str), ex=max(int(self.ttl), 1))
+        except Exception as e:
+            logger.warning("Не удалось записать в Redis: %s", e)
+
+    def stats(self):
+        return {'backend': 'redis', 'size': None, 'hits': self.hits, 'misses': self.misses}
+
+
+def _create_backend():
+    url = os.getenv('CACHE_REDIS_URL')
+    if url:
+        return RedisBackend(url, TTL)
+    return MemoryBackend(int(os.getenv('RESPONSE_CACHE_SIZE', 1000)), TTL)
+
+
+backend = _create_backend()
+
+
+_version_lock = threading.Lock()
+_version = None     # (версия, момент чтения из БД)
+_generation = 0     # увеличивается при каждом сбросе копии версии
+
+
+def _read_version():
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT version FROM data_version")
+            row = cur.fetchone()
+        conn.rollback()
+    except Exception as e:
+        logger.warning("Не удалось прочитать версию данных: %s", e)
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+    return row[0] if row else None
+
+
+def version():
+    """Текущая версия данных склада или None, если кэш выключен или версию не прочитать.
+
+    Версия читается из БД, только если копия в процессе сброшена (invalidate) или старше VERSION_TTL.
+    """
+    global _version
+    if not enabled():
+        return None
+    with _version_lock:
+        cached_version, generation = _version, _generation
+    if cached_version is not None and time.monotonic() - cached_version[1] < VERSION_TTL:
+        return cached_version[0]
+    value = _read_version()
+    with _version_lock:
+        # Копию, прочитанную до сброса, не сохраняем: она могла не увидеть только что зафиксированную запись
+        if value is not None and _generation == generation:
+            _version = (value, time.monotonic())
+    return value
+
+
+def _digest(version, parts):
+    # Срок действия входит в ключ, чтобы ETag устаревал не позже, чем через TTL
+    epoch = int(time.time() // TTL) if TTL > 0 else 0
+    raw = json.dumps([version, epoch, *parts], default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def etag(version, *parts):
+    """ETag ответа: версия данных и параметры запроса. None - без ETag."""
+    if version is None:
+        return None
+    return _digest(version, parts)[:24]
+
+
+def cached(version, parts, loader):
+    """Результат loader() из кэша по параметрам запроса и версии данных.
+
+    Версию нужно получить до чтения из БД: тогда результат, прочитанный одновременно
+    с изменением данных, сохраняется под старой версией и больше не используется.
+    """
+    if version is None:
+        return loader()
+    key = _digest(version, parts)
+    value = backend.get(key)
+    if value is None:
+        value = loader()
+        backend.put(key, value)
+    return value
+
+
+def mark_changed(cur):
+    """Новая версия данных в транзакции записи: после COMMIT закэшированные результаты и ETag
+    всех процессов устаревают. После COMMIT вызывается invalidate() в своем процессе; другие
+    процессы получают сигнал NOTIFY_CHANNEL (DIM_CACHE_NOTIFY=1) или читают версию через VERSION_TTL.
+
+    Строка версии блокируется до конца транзакции, поэтому вызывать ее нужно последней перед COMMIT.
+    """
+    cur.execute("UPDATE data_version SET version = version + 1")
+    if dim_cache.notify_enabled():
+        cur.execute("SELECT pg_notify(%s, '')", (NOTIFY_CHANNEL,))
+
+
+def invalidate(payload=None):
+    """Сбрасывает копию версии в процессе: после COMMIT записи и по сигналу NOTIFY_CHANNEL."""
+    global _version, _generation
+    with _version_lock:
+        _version = None
+        _generation += 1
+
+
+def stats():
+    result = backend.stats()
+    result['version'] = version()
+    return result
@@ -0,0 +1,51 @@
+# Управление схемой БД: последовательное применение SQL-миграций из каталога migrations/
+
+import os
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+
+def available_migrations():
+    """Список (версия, путь) всех файлов миграций в порядке имен."""
+    return [
+        (name[:-len('.sql')], os.path.join(MIGRATIONS_DIR, name))
+        for name in sorted(os.listdir(MIGRATIONS_DIR))
+        if name.endswith('.sql')
+    ]
+
+
+def applied_migrations(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version text PRIMARY KEY,
+            applied_at timestamp NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(conn):
+    """Применяет еще не примененные миграции, каждую в своей транзакции.
+
+    Возвращает список примененных версий.
+    """
+    done = []
+    with conn.cursor() as cur:
+        applied = applied_migrations(cur)
+    conn.commit()
+    for version, path in available_migrations():
+        if version in applied:
+            continue
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(version)
+    return done
@@ -0,0 +1,68 @@
+# Запуск приложения в рабочем режиме на waitress (один процесс, пул потоков) с настройками из .env.
+# Для нескольких процессов по числу ядер (Linux) - gunicorn с конфигурацией gunicorn.conf.py.
+
+import logging
+import os
+import signal
+
+from waitress import create_server
+
+import db
+import jobs
+
+logger = logging.getLogger(__name__)
+
+
+def _env(name, default, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value not in (None, '') else default
+
+
+def settings():
+    """Настройки waitress из переменных окружения SERVER_*."""
+    return {
+        'host': os.getenv('SERVER_HOST', '127.0.0.1'),
+        'port': _env('SERVER_PORT', 5000),
+        # Потоки, обрабатывающие запросы; каждому потоку нужно свое соединение из пула БД
+        'threads': _env('SERVER_THREADS', 8),
+        # Сколько соединений клиентов держится открытыми одновременно, остальные ждут в backlog
+        'connection_limit': _env('SERVER_CONNECTION_LIMIT', 200),
+        'backlog': _env('SERVER_BACKLOG', 2048),
+        # Через сколько секунд закрывается неактивное соединение клиента
+        'channel_timeout': _env('SERVER_CHANNEL_TIMEOUT', 120),
+        'ident': 'warehouse',
+    }
+
+
+def run(app):
+    """Запускает сервер; SIGTERM и Ctrl+C останавливают его без потери загрузок.
+
+    При остановке сервер перестает принимать соединения, дает текущим запросам завершиться
+    и ждет выполняющиеся загрузки не дольше SERVER_SHUTDOWN_TIMEOUT секунд. Незавершенная
+    загрузка откатывается и запускается заново при следующем старте.
+    """
+    options = settings()
+    pool_max = _env('DB_POOL_MAX', 10)
+    if db.pool_enabled() and pool_max < options['threads'] + jobs.WORKERS:
+        logger.warning("DB_POOL_MAX=%s меньше, чем потоков сервера и загрузок (%s): запросы будут ждать соединение",
+                       pool_max, options['threads'] + jobs.WORKERS)
+    if jobs.manager.local:
+        # Единственный процесс, выполняющий задания: задания в статусе running остались от прошлого запуска
+        jobs.manager.recover(stale_after=0)
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    server = create_server(app, **options)
+    logger.info("Сервер запущен на http://%s:%s (потоков: %s, соединений: %s)",
+                options['host'], options['port'], options['threads'], options['connection_limit'])
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        logger.info("Остановка сервера: ожидание выполняющихся загрузок")
+        if not jobs.manager.shutdown(_env('SERVER_SHUTDOWN_TIMEOUT', 30.0, float)):
+            # Соединения закроются вместе с процессом, БД откатит незавершенные транзакции
+            logger.warning("Загрузки не завершились, они будут перезапущены при следующем старте")
+            os._exit(1)
+        db.reset_pool()
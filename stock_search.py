@@ -0,0 +1,159 @@
+# Поиск по остаткам склада: построение запроса, постраничная выдача по ключу и оценка количества
+
+import base64
+import json
+import os
+
+# Размер страницы результатов поиска по умолчанию и максимальный
+PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = 1000
+
+# Порядок столбцов совпадает с индексами row[...] в шаблоне search.html
+SEARCH_COLUMNS = [
+    "item_id", "id_start", "launch", "manufacturer", "technology", "wafer", "quadrant", "lot",
+    "internal_lot", "chip_code", "ostatok_w", "ostatok_gp", "note", "stor", "cells",
+]
+
+SEARCH_QUERY = """
+        SELECT b.item_id,
+            b.id_start,
+            s.name_start,
+            p.name_pr,
+            t.name_tech,
+            w.name_wafer,
+            q.name_quad,
+            l.name_lot,
+            il.in_lot,
+            nc.n_chip,
+            (b.quan_w - b.cons_w) AS ostatok_w,
+            (b.quan_gp - b.cons_gp) AS ostatok_gp,
+            b.note,
+            st.name_stor,
+            c.name_cells
+            FROM stock_balance b
+        LEFT JOIN n_chip nc ON nc.id = b.id_n_chip
+        LEFT JOIN quad q ON q.id = b.id_quad
+        LEFT JOIN start_p s ON s.id = b.id_start
+        LEFT JOIN tech t ON t.id = b.id_tech
+        LEFT JOIN pr p ON p.id = b.id_pr
+        LEFT JOIN wafer w ON w.id = b.id_wafer
+        LEFT JOIN lot l ON l.id = b.id_lot
+        LEFT JOIN in_lot il ON il.id = b.id_in_lot
+        LEFT JOIN stor st ON st.id = b.id_stor
+        LEFT JOIN cells c ON c.id = b.id_cells
+        WHERE b.invoice_rows > 0
+"""
+
+
+class InvalidCursorError(ValueError):
+    """Курсор страницы поврежден или подделан."""
+
+
+def encode_cursor(item_id):
+    """Курсор следующей страницы: item_id последней строки в base64."""
+    return base64.urlsafe_b64encode(json.dumps([item_id]).encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))[0]
+    except Exception:
+        raise InvalidCursorError("Неверный курсор страницы")
+
+
+def page_size_from(value):
+    """Размер страницы из параметра запроса с ограничением сверху."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return min(max(size, 1), MAX_PAGE_SIZE)
+
+
+def build_query(chip_name, manufacturer_filter):
+    """Текст запроса поиска и параметры с учетом фильтров (без сортировки и LIMIT)."""
+    query = SEARCH_QUERY
+    params = []
+    # Фильтры сначала отбирают id в справочниках (по триграммному индексу для подстроки),
+    # и только позиции с этими id читаются из stock_balance
+    if chip_name:
+        query += " AND b.id_n_chip IN (SELECT id FROM n_chip WHERE n_chip ILIKE %s)"
+        params.append(f"%{chip_name}%")
+    if manufacturer_filter and manufacturer_filter != "all":
+        query += " AND b.id_pr IN (SELECT id FROM pr WHERE name_pr = %s)"
+        params.append(manufacturer_filter)
+    return query, params
+
+
+def fetch_page(cur, chip_name, manufacturer_filter, cursor=None, page_size=PAGE_SIZE):
+    """Одна страница результатов в порядке item_id, начиная после курсора.
+
+    Возвращает (строки, курсор следующей страницы или None).
+    """
+    query, params = build_query(chip_name, manufacturer_filter)
+    if cursor:
+        query += " AND b.item_id > %s"
+        params.append(decode_cursor(cursor))
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    query += " ORDER BY b.item_id LIMIT %s"
+    params.append(page_size + 1)
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][0])
+    return rows, next_cursor
+
+
+def estimate_count(cur, chip_name, manufacturer_filter):
+    """Оценка числа найденных позиций по плану запроса (без выполнения самого запроса)."""
+    query, params = build_query(chip_name, manufacturer_filter)
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def plan_index_names(cur, query, params=None):
+    """Имена индексов, которые использует план запроса (EXPLAIN без выполнения)."""
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    names = set()
+    nodes = [plan[0]["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Index Name" in node:
+            names.add(node["Index Name"])
+        nodes.extend(node.get("Plans", []))
+    return names
+
+
+# Запросы поиска по подстроке и индексы, которые они обязаны использовать
+EXPLAIN_CHECKS = [
+    ("поиск по шифру кристалла", lambda: build_query("probe", "all"), "n_chip_n_chip_trgm_idx"),
+    ("поиск по партии", lambda: ("SELECT id FROM lot WHERE name_lot ILIKE %s", ["%probe%"]), "lot_name_lot_trgm_idx"),
+    ("поиск по номеру запуска",
+     lambda: ("SELECT id FROM start_p WHERE name_start ILIKE %s", ["%probe%"]), "start_p_name_start_trgm_idx"),
+]
+
+
+def explain_check(cur):
+    """Список (проверка, нужный индекс, индексы в плане) для EXPLAIN_CHECKS.
+
+    Последовательное чтение запрещается до конца транзакции: проверяется, что индекс
+    пригоден для запроса, независимо от размера таблиц. Транзакцию нужно откатить.
+    """
+    cur.execute("SET LOCAL enable_seqscan = off")
+    results = []
+    for title, build, index_name in EXPLAIN_CHECKS:
+        query, params = build()
+        results.append((title, index_name, plan_index_names(cur, query, params)))
+    return results
+
+
+def row_to_dict(row):
+    return dict(zip(SEARCH_COLUMNS, row))
@@ -0,0 +1,30 @@
+# Тесты работают с БД из .env (DB_HOST, DB_NAME, ...) со схемой и миграциями; без БД они пропускаются.
+# Тесты, которые пишут в БД, запускать только на тестовой БД (например, БД бенчмарка).
+
+import os
+import sys
+
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+
+@pytest.fixture
+def conn():
+    """Соединение с БД вне пула; незафиксированные изменения откатываются после теста."""
+    import db
+
+    if not os.getenv('DB_NAME'):
+        pytest.skip("БД не задана (DB_NAME)")
+    try:
+        connection = db.connect()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"БД недоступна: {e}")
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        connection.close()
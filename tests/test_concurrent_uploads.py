@@ -0,0 +1,67 @@
+# Параллельные загрузки с общими позициями в разном порядке порций: обе загружаются, остатки сходятся
+# (ingest.run_upload повторяет файл после взаимной блокировки). Тест фиксирует свои строки в БД:
+# справочники с уникальными названиями, остальные данные не затрагиваются.
+
+import io
+import threading
+import uuid
+
+import pandas as pd
+
+import ingest
+
+ITEMS = 6
+ROUNDS = 3
+
+
+def inflow_file(tags, date, quantity):
+    rows = []
+    for tag in tags:
+        row = {excel_col: f"test-{table}-{tag}" for excel_col, table, _, _ in ingest.INFLOW_DIMENSIONS}
+        row.update({"Дата прихода": date, "Приход Wafer, шт.": 0, "Приход GelPack, шт.": quantity,
+                    "Приход общий, шт.": quantity, "Примечание": None})
+        rows.append(row)
+    buffer = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_parallel_uploads_with_reversed_items(conn):
+    tags = [uuid.uuid4().hex[:12] for _ in range(ITEMS)]
+    ingest.run_upload("inflow", inflow_file(tags, "01.01.2024", 1), f"inflow-{tags[0]}.xlsx", None)
+
+    for round_ in range(ROUNDS):
+        files = [inflow_file(tags, f"{round_ + 2:02d}.01.2024", 1),
+                 inflow_file(list(reversed(tags)), f"{round_ + 2:02d}.02.2024", 1)]
+        results, failures = [], []
+        barrier = threading.Barrier(len(files))
+
+        def worker(file, name):
+            barrier.wait()
+            try:
+                # Каждая строка - своя порция: строки остатков блокируются по одной, в порядке файла
+                results.append(ingest.run_upload("inflow", file, name, None, chunk_size=1))
+            except Exception as e:
+                failures.append(e)
+
+        threads = [threading.Thread(target=worker, args=(file, f"inflow-{tags[0]}-{round_}-{i}.xlsx"))
+                   for i, file in enumerate(files)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert failures == []
+        assert [result["inserted"] for result in results] == [ITEMS, ITEMS]
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.quan_gp, e.quan_gp FROM stock_balance b
+            JOIN stock_balance_expected e ON e.item_id = b.item_id
+            JOIN n_chip n ON n.id = b.id_n_chip
+            WHERE n.n_chip = ANY(%s)
+        """, ([f"test-n_chip-{tag}" for tag in tags],))
+        balances = cur.fetchall()
+    conn.rollback()
+    assert len(balances) == ITEMS
+    assert all(stored == expected == 1 + 2 * ROUNDS for stored, expected in balances)
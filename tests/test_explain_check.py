@@ -0,0 +1,16 @@
+# Поиск по подстроке должен использовать триграммные индексы (то же, что flask warehouse explain-check)
+
+import pytest
+
+import stock_search
+
+
+def test_search_uses_trigram_indexes(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cur.fetchone() is None:
+            pytest.skip("pg_trgm не установлен: миграция 0002 не применена")
+        results = stock_search.explain_check(cur)
+    missing = [f"{title}: {index_name} (в плане: {sorted(used)})"
+               for title, index_name, used in results if index_name not in used]
+    assert not missing, "Запросы не используют индексы: " + "; ".join(missing)
@@ -0,0 +1,100 @@
+# Отпечатки загрузок (fingerprints): повтор файла не задваивает движения, второе движение другим файлом загружается,
+# при UPLOAD_ROW_DEDUPE=1 исправленная строка другого файла отклоняется
+# Тест фиксирует свои строки в БД: справочники с уникальными названиями, остальные данные не затрагиваются.
+
+import io
+import uuid
+
+import pandas as pd
+import pytest
+
+import ingest
+
+
+def xlsx(rows):
+    buffer = io.BytesIO()
+    pd.DataFrame(rows).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def position(tag):
+    """Значения справочников одной позиции; новые значения добавит загрузка прихода."""
+    return {excel_col: f"test-{table}-{tag}" for excel_col, table, _, _ in ingest.INFLOW_DIMENSIONS}
+
+
+def outflow_row(values, quantity):
+    row = {col: values[col] for col, _, _, _ in ingest.REFERENCE_DIMENSIONS}
+    row.update({
+        "Дата расхода": "01.03.2024",
+        "Расход Wafer, шт.": 0,
+        "Расход GelPack, шт.": quantity,
+        "Примечание": None,
+        "Куда передано (Производственная партия)": "test",
+        "ФИО": "test",
+    })
+    return row
+
+
+def balance(conn, tag):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.quan_gp, b.cons_gp FROM stock_balance b
+            JOIN n_chip n ON n.id = b.id_n_chip
+            WHERE n.n_chip = %s
+        """, (f"test-n_chip-{tag}",))
+        row = cur.fetchone()
+    conn.rollback()
+    return row
+
+
+def inflow_row(values):
+    return dict(values, **{"Дата прихода": "01.02.2024", "Приход Wafer, шт.": 0,
+                           "Приход GelPack, шт.": 10, "Приход общий, шт.": 10, "Примечание": None})
+
+
+def test_same_file_is_loaded_once(conn):
+    tag = uuid.uuid4().hex[:12]
+    values = position(tag)
+    ingest.run_upload("inflow", xlsx([inflow_row(values)]), f"inflow-{tag}.xlsx", None)
+    content = xlsx([outflow_row(values, 2)]).getvalue()
+    result = ingest.run_upload("outflow", io.BytesIO(content), f"outflow-{tag}.xlsx", None)
+    assert result["duplicate_of"] is None
+
+    result = ingest.run_upload("outflow", io.BytesIO(content), f"outflow-{tag}-copy.xlsx", None)
+    assert result["duplicate_of"]["file_name"] == f"outflow-{tag}.xlsx"
+    assert balance(conn, tag) == (10, 2)
+
+
+def test_same_movement_in_another_file_is_loaded(conn, monkeypatch):
+    monkeypatch.delenv("UPLOAD_ROW_DEDUPE", raising=False)
+    tag = uuid.uuid4().hex[:12]
+    values = position(tag)
+    ingest.run_upload("inflow", xlsx([inflow_row(values)]), f"inflow-{tag}.xlsx", None)
+    ingest.run_upload("outflow", xlsx([outflow_row(values, 2)]), f"outflow-{tag}-1.xlsx", None)
+    # Второй расход той же позиции в тот же день: другой файл, те же значения строки
+    row = dict(outflow_row(values, 2), **{"Дата расхода": pd.Timestamp("2024-03-01")})
+    result = ingest.run_upload("outflow", xlsx([row]), f"outflow-{tag}-2.xlsx", None)
+    assert result["inserted"] == 1
+    assert balance(conn, tag) == (10, 4)
+
+
+def test_row_dedupe_rejects_changed_row(conn, monkeypatch):
+    monkeypatch.setenv("UPLOAD_ROW_DEDUPE", "1")
+    tag = uuid.uuid4().hex[:12]
+    values = position(tag)
+    ingest.run_upload("inflow", xlsx([inflow_row(values)]), f"inflow-{tag}.xlsx", None)
+    ingest.run_upload("outflow", xlsx([outflow_row(values, 2)]), f"outflow-{tag}.xlsx", None)
+
+    # Та же строка в другом формате (дата ячейкой Excel, количество текстом) - повтор
+    row = dict(outflow_row(values, "2"), **{"Дата расхода": pd.Timestamp("2024-03-01")})
+    result = ingest.run_upload("outflow", xlsx([row]), f"outflow-{tag}-copy.xlsx", None)
+    assert (result["duplicates"], result["inserted"]) == (1, 0)
+
+    # Исправленный файл: то же движение с другим количеством
+    with pytest.raises(ingest.UploadValidationError) as error:
+        ingest.run_upload("outflow", xlsx([outflow_row(values, 3)]), f"outflow-{tag}-fixed.xlsx", None)
+    report = error.value.report
+    assert report.changed_rows == [2]
+    assert f"outflow-{tag}.xlsx" in report.errors[0][1]
+    assert balance(conn, tag) == (10, 2)
@@ -0,0 +1,89 @@
+# Одновременные добавления в корзину не резервируют больше остатка (reservations, /add_to_cart).
+# Тест фиксирует свои строки в БД: позицию с уникальными названиями справочников и пользователей теста,
+# корзины и пользователи удаляются после проверки.
+
+import io
+import threading
+import uuid
+
+import pandas as pd
+
+import ingest
+
+THREADS = 8
+STOCK_GP = 20
+ATTEMPTS_PER_THREAD = 5
+
+
+def inflow_file(tag):
+    row = {excel_col: f"test-{table}-{tag}" for excel_col, table, _, _ in ingest.INFLOW_DIMENSIONS}
+    row.update({"Дата прихода": "01.02.2024", "Приход Wafer, шт.": 0, "Приход GelPack, шт.": STOCK_GP,
+                "Приход общий, шт.": STOCK_GP, "Примечание": None})
+    buffer = io.BytesIO()
+    pd.DataFrame([row]).to_excel(buffer, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def test_concurrent_adds_do_not_over_reserve(conn):
+    from app import app
+
+    tag = uuid.uuid4().hex[:12]
+    ingest.run_upload("inflow", inflow_file(tag), f"inflow-{tag}.xlsx", None)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.item_id FROM stock_balance b
+            JOIN n_chip n ON n.id = b.id_n_chip
+            WHERE n.n_chip = %s
+        """, (f"test-n_chip-{tag}",))
+        item_id = cur.fetchone()[0]
+        user_ids = []
+        for i in range(THREADS):
+            cur.execute("INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id",
+                        (f"test-{tag}-{i}", "test"))
+            user_ids.append(cur.fetchone()[0])
+    conn.commit()
+
+    app.config['TESTING'] = True
+    app.secret_key = app.secret_key or 'test'
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(THREADS)
+
+    def worker(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        barrier.wait()
+        for _ in range(ATTEMPTS_PER_THREAD):
+            response = client.post('/add_to_cart', json={'item_id': item_id, 'quantity_w': 0, 'quantity_gp': 1})
+            with lock:
+                statuses.append(response.status_code)
+
+    try:
+        threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT COALESCE(SUM(cons_gp), 0) FROM cart WHERE item_id = %s", (item_id,))
+            reserved_gp = int(cur.fetchone()[0])
+            cur.execute("SELECT quan_w, quan_gp, cons_w, cons_gp FROM stock_balance WHERE item_id = %s",
+                        (item_id,))
+            stored = cur.fetchone()
+            cur.execute("SELECT quan_w, quan_gp, cons_w, cons_gp FROM stock_balance_expected WHERE item_id = %s",
+                        (item_id,))
+            expected = cur.fetchone()
+        conn.rollback()
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM cart WHERE user_id = ANY(%s)", (user_ids,))
+            cur.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+        conn.commit()
+
+    assert set(statuses) <= {200, 409}
+    assert statuses.count(200) == reserved_gp == STOCK_GP
+    assert statuses.count(409) == THREADS * ATTEMPTS_PER_THREAD - STOCK_GP
+    assert tuple(stored) == tuple(expected) == (0, STOCK_GP, 0, 0)
@@ -0,0 +1,111 @@
+# Потоковое чтение загружаемых файлов (xlsx/xls/csv) порциями фиксированного размера
+
+import os
+
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # calamine необязателен, без него используется openpyxl
+    CalamineWorkbook = None
+
+# Сколько строк файла передавать в загрузку за один раз
+CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 5000))
+# Движок чтения Excel: auto (calamine, если установлен), calamine или openpyxl
+ENGINE = os.getenv('UPLOAD_ENGINE', 'auto')
+
+
+class UploadFormatError(ValueError):
+    """Файл не удалось прочитать или в нем нет обязательных столбцов."""
+
+
+def _engine(file_name):
+    ext = os.path.splitext(file_name or '')[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ENGINE == 'calamine' or (ENGINE == 'auto' and CalamineWorkbook is not None):
+        if CalamineWorkbook is None:
+            raise UploadFormatError("Движок calamine не установлен (pip install python-calamine)")
+        return 'calamine'
+    if ext == '.xls':
+        # Старый формат openpyxl не читает: файл разбирается целиком средствами pandas
+        return 'pandas'
+    return 'openpyxl'
+
+
+def _sheet_rows(file, engine):
+    """Итератор строк первого листа в виде кортежей значений."""
+    if engine == 'calamine':
+        workbook = CalamineWorkbook.from_filelike(file)
+        return iter(workbook.get_sheet_by_index(0).iter_rows())
+    if engine == 'openpyxl':
+        from openpyxl import load_workbook
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        return _closing_rows(workbook)
+    df = pd.read_excel(file, header=None)
+    return (tuple(row) for row in df.itertuples(index=False, name=None))
+
+
+def _closing_rows(workbook):
+    # Книга read_only держит файл открытым, пока ее не закроют: закрывается и при недочитанных строках
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _is_empty(value):
+    return value is None or value == '' or (isinstance(value, float) and value != value)
+
+
+def read_header(header, required_columns):
+    """Проверяет строку заголовка и возвращает список названий столбцов."""
+    columns = [str(value).strip() if not _is_empty(value) else f"Unnamed: {i}" for i, value in enumerate(header)]
+    missing = [col for col in required_columns if col not in columns]
+    if missing:
+        raise UploadFormatError("В файле нет обязательных столбцов: " + ", ".join(missing))
+    return columns
+
+
+def iter_chunks(file, file_name, required_columns, chunk_size=CHUNK_SIZE):
+    """Читает файл порциями по chunk_size строк и возвращает их в виде DataFrame.
+
+    Заголовок проверяется до чтения данных, поэтому файл с неверной шапкой отклоняется
+    сразу. Полностью пустые строки пропускаются. Индекс DataFrame - номер строки в файле
+    (заголовок - строка 1), по нему в отчете об ошибках указываются строки.
+    """
+    engine = _engine(file_name)
+    if engine == 'csv':
+        try:
+            header = pd.read_csv(file, nrows=0, sep=None, engine='python', encoding='utf-8-sig')
+        except Exception as e:
+            raise UploadFormatError(f"Не удалось прочитать файл: {e}")
+        read_header(header.columns, required_columns)
+        file.seek(0)
+        for chunk in pd.read_csv(file, sep=None, engine='python', encoding='utf-8-sig', chunksize=chunk_size):
+            chunk.columns = [str(col).strip() for col in chunk.columns]
+            chunk.index = chunk.index + 2
+            yield chunk.dropna(how='all')
+        return
+
+    try:
+        rows = _sheet_rows(file, engine)
+        header = next(rows)
+    except StopIteration:
+        raise UploadFormatError("Файл пуст")
+    except Exception as e:
+        raise UploadFormatError(f"Не удалось прочитать файл: {e}")
+    columns = read_header(header, required_columns)
+
+    batch, numbers = [], []
+    for number, row in enumerate(rows, start=2):
+        if all(_is_empty(value) for value in row):
+            continue
+        values = [None if value == '' else value for value in row[:len(columns)]]
+        batch.append(values + [None] * (len(columns) - len(values)))
+        numbers.append(number)
+        if len(batch) >= chunk_size:
+            yield pd.DataFrame(batch, columns=columns, index=numbers)
+            batch, numbers = [], []
+    if batch:
+        yield pd.DataFrame(batch, columns=columns, index=numbers)
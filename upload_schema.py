@@ -0,0 +1,146 @@
+# Проверка и приведение типов столбцов загружаемого файла по схеме - сразу для всей порции, без обхода строк
+
+from numbers import Real
+
+import numpy as np
+import pandas as pd
+
+# Типы столбцов схемы
+TEXT = 'text'
+INT = 'int'
+DATE = 'date'
+
+# Форматы дат в текстовых ячейках, по порядку проверки. Ячейки Excel с датой приходят уже датами.
+DATE_FORMATS = ["%d.%m.%Y", "%Y-%m-%d", "%d.%m.%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d.%m.%y", "%d/%m/%Y"]
+# Начало отсчета дат Excel, если дата пришла числом (ячейка без формата даты), и предел таких чисел
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+MAX_EXCEL_SERIAL = 100000
+
+INVALID_MESSAGES = {
+    INT: "не является целым числом",
+    DATE: "не является датой (ДД.ММ.ГГГГ)",
+}
+
+
+def _cell_types(values, check):
+    """Маска ячеек, для которых check(значение) истинно; для столбцов не object - без обхода ячеек.
+
+    check вызывается для различных значений столбца, а не для каждой ячейки: в столбцах
+    справочников различных значений немного.
+    """
+    if values.dtype != object:
+        return pd.Series(False, index=values.index)
+    codes, uniques = pd.factorize(values)
+    flags = np.fromiter((check(value) for value in uniques), dtype=bool, count=len(uniques))
+    # Код -1 (пустая ячейка) попадает на последний элемент - False
+    return pd.Series(np.append(flags, False)[codes], index=values.index)
+
+
+def _is_str(value):
+    return isinstance(value, str)
+
+
+def _is_number(value):
+    return isinstance(value, Real) and not isinstance(value, bool)
+
+
+def normalize(series):
+    """Пустые ячейки (NaN, NaT, None, строки из пробелов) - None, у строк обрезаются пробелы.
+
+    Возвращает столбец dtype object и маску строковых ячеек.
+    """
+    values = series.astype(object)
+    if series.dtype != object and pd.api.types.is_string_dtype(series.dtype):
+        # Строковый dtype (pandas 3 по умолчанию для текста): все непустые ячейки - строки
+        is_text = series.notna()
+    else:
+        is_text = _cell_types(series, _is_str)
+    if is_text.any():
+        codes, uniques = pd.factorize(values[is_text])
+        stripped = pd.Series(uniques, dtype=object).str.strip()
+        values[is_text] = stripped.where(stripped != "", None).to_numpy(dtype=object)[codes]
+    values = values.where(values.notna(), None)
+    return values, is_text & values.notna()
+
+
+def to_text(values, is_text):
+    """Текст без пробелов по краям. Целые числа пишутся без дробной части: 12345.0 -> «12345»,
+    как в отпечатках строк (fingerprints)."""
+    result = values.copy()
+    other = values.notna() & ~is_text
+    if other.any():
+        raw = values[other]
+        numbers = pd.to_numeric(raw.where(_cell_types(raw, _is_number)), errors="coerce")
+        whole = numbers.notna() & (numbers % 1 == 0)
+        text = raw.astype(str).str.strip()
+        text[whole] = numbers[whole].astype("int64").astype(str)
+        result[other] = text
+    return result, pd.Series(False, index=values.index)
+
+
+def to_int(values, is_text):
+    """Целые числа; запятая в тексте - десятичный разделитель. Дробные и нечисловые значения - ошибки."""
+    raw = values.copy()
+    if is_text.any():
+        raw[is_text] = raw[is_text].str.replace(",", ".", regex=False)
+    numbers = pd.to_numeric(raw, errors="coerce")
+    invalid = (numbers.isna() & values.notna()) | (numbers.notna() & (numbers % 1 != 0))
+    return numbers.where(~invalid), invalid
+
+
+def to_date(values, is_text):
+    """Даты без времени: даты Excel, текст в одном из DATE_FORMATS, числа как даты Excel."""
+    result = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    text = values[is_text]
+    for fmt in DATE_FORMATS:
+        pending = text[result[text.index].isna()]
+        if pending.empty:
+            break
+        result[pending.index] = pd.to_datetime(pending, format=fmt, errors="coerce").to_numpy()
+
+    other = values.notna() & ~is_text
+    if other.any():
+        raw = values[other]
+        serial = _cell_types(raw, _is_number)
+        if serial.any():
+            days = pd.to_numeric(raw[serial], errors="coerce")
+            days = days.where((days >= 1) & (days < MAX_EXCEL_SERIAL))
+            result[days.index] = (EXCEL_EPOCH + pd.to_timedelta(days, unit="D")).to_numpy()
+        rest = raw[~serial]
+        if not rest.empty:
+            result[rest.index] = pd.to_datetime(rest, errors="coerce").to_numpy()
+    result = result.dt.normalize()
+    return result, result.isna() & values.notna()
+
+
+CONVERTERS = {TEXT: to_text, INT: to_int, DATE: to_date}
+
+
+def validate(df, schema, report):
+    """Приводит столбцы df к типам схемы и возвращает копию только с правильными строками.
+
+    schema - список (столбец, тип, обязательное значение, значение по умолчанию для пустых).
+    Значения, которые не удалось привести к типу, и пустые обязательные значения
+    записываются в report по номеру строки (индекс df). Текстовые столбцы - str или None,
+    целые - int64 (или Int64 без значения по умолчанию), даты - datetime64 без времени.
+    """
+    df = df.copy()
+    valid = pd.Series(True, index=df.index)
+    for name, type_, required, default in schema:
+        values, is_text = normalize(df[name])
+        result, invalid = CONVERTERS[type_](values, is_text)
+        for row, value in values[invalid].items():
+            report.add_error(row, f"{name}: «{value}» {INVALID_MESSAGES[type_]}")
+        if default is not None:
+            # Строки с ошибками все равно отбрасываются, поэтому значение по умолчанию получают и они
+            result = result.where(result.notna(), default)
+        elif required:
+            empty = result.isna() & ~invalid
+            for row in empty[empty].index:
+                report.add_error(row, f"{name}: значение не заполнено")
+            invalid |= empty
+        if type_ == INT:
+            result = result.astype("int64" if default is not None else "Int64")
+        df[name] = result
+        valid &= ~invalid
+    return df[valid].copy()